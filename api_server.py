@@ -2,29 +2,21 @@
 Flask API Server for Image Enhancement
 Exposes Real-ESRGAN as HTTP endpoint for web UI
 """
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Response, request, jsonify, send_file, stream_with_context
 from flask_cors import CORS
 import os
 import logging
 from io import BytesIO
-from PIL import Image
-import sys
 
-# Patch torchvision compatibility
-try:
-    import torchvision.transforms.functional as F
-    
-    class FunctionalTensorModule:
-        @staticmethod
-        def rgb_to_grayscale(img, num_output_channels=1):
-            return F.rgb_to_grayscale(img, num_output_channels)
-    
-    sys.modules['torchvision.transforms.functional_tensor'] = FunctionalTensorModule()
-except Exception:
-    pass
+from src.utils import patch_torchvision_compat
+
+patch_torchvision_compat()
 
-from src.super_resolution import SuperResolution
-from src.utils import pil_to_cv2, cv2_to_pil
+from src.config import Config
+from src.scheduler import QueueFullError
+from src.inference import decode_image, get_service
+from src.model_registry import parse_scale_mode, parse_target_scale, select_model
+from src.encoding import FORMATS, PROFILES, negotiate_format
 
 # Configure logging
 logging.basicConfig(
@@ -37,10 +29,8 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
 
-# Initialize model (do this once on startup)
-logger.info("Loading Real-ESRGAN model...")
-sr_model = SuperResolution()
-logger.info("Model loaded successfully!")
+# The model, queue, result cache and jobs live in the shared inference
+# service, loaded on first use (see src/inference.py)
 
 @app.route('/health', methods=['GET'])
 def health():
@@ -48,15 +38,22 @@ def health():
     return jsonify({
         'status': 'healthy',
         'model': 'Real-ESRGAN',
-        'gpu_available': sr_model.upsampler.device.type == 'cuda'
+        **get_service().stats()
     })
 
 @app.route('/api/upscale', methods=['POST'])
 def upscale_image():
     """
     Upscale image endpoint
-    Accepts: multipart/form-data with 'image' file
-    Returns: Enhanced image as PNG
+    Accepts: multipart/form-data with 'image' file, optional 'format'
+             (png, jpeg, webp, avif), 'profile' (fast, small) and 'model'
+             (x4plus, anime, x2plus) fields; without 'format' the Accept
+             header is used. 'scale' (1-4, e.g. 1.5) sets the output size;
+             without 'model' the cheapest model reaching it is used, and
+             'scale_mode=fast' shrinks the input rather than the output.
+             'stream=1' sends a PNG band by band as it is upscaled (chunked
+             response, model scale only).
+    Returns: Enhanced image in the negotiated format; 429 when the queue is full
     """
     try:
         # Check if image is in request
@@ -68,44 +65,160 @@ def upscale_image():
         if file.filename == '':
             return jsonify({'error': 'No file selected'}), 400
         
+        # Pick the output encoding
+        try:
+            output_format = negotiate_format(
+                request.form.get('format'), request.headers.get('Accept'), Config.OUTPUT_FORMAT
+            )
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        profile = request.form.get('profile', Config.ENCODE_PROFILE).lower()
+        if profile not in PROFILES:
+            return jsonify({'error': f"Unknown profile '{profile}'. Available: {', '.join(PROFILES)}"}), 400
+        try:
+            scale = parse_target_scale(request.form.get('scale'))
+            fast = parse_scale_mode(request.form.get('scale_mode'))
+            model = select_model(scale, request.form.get('model'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        stream = request.values.get('stream', '').lower() in ('1', 'true', 'yes')
+        if stream and output_format != 'png':
+            return jsonify({'error': 'Streaming is only available for PNG output'}), 400
+        if stream and scale:
+            return jsonify({'error': 'Streaming is only available at the model scale'}), 400
+        
         # Read image
         logger.info(f"Processing image: {file.filename}")
-        image_bytes = file.read()
-        input_image = Image.open(BytesIO(image_bytes))
-        
-        # Convert to RGB if necessary
-        if input_image.mode != 'RGB':
-            input_image = input_image.convert('RGB')
-        
-        # Convert PIL to CV2
-        cv2_image = pil_to_cv2(input_image)
+        image_bgr = decode_image(file.read())
+        service = get_service()
         
-        # Upscale
-        logger.info("Starting upscaling...")
-        upscaled_cv2 = sr_model.upscale(cv2_image)
+        headers = {'X-Output-Format': output_format, 'X-Encode-Profile': profile, 'X-Model': model}
+        if scale:
+            headers['X-Scale'] = f"{scale:g}"
+            headers['X-Scale-Mode'] = 'fast' if fast else 'quality'
         
-        # Convert back to PIL
-        output_image = cv2_to_pil(upscaled_cv2)
+        if stream:
+            # Re-sent images are served from the result cache
+            cache_key, output_bytes = service.lookup(image_bgr, output_format, profile, model)
+            if output_bytes is None:
+                # Bands are upscaled on the inference queue and sent as they arrive
+                try:
+                    chunks = service.stream_png(request.remote_addr, image_bgr, profile, cache_key, model)
+                except QueueFullError as e:
+                    return jsonify({'error': str(e)}), 429, {'Retry-After': '30'}
+                headers.update({'X-Cache': 'miss', 'X-Stream': 'png-bands', 'Vary': 'Accept'})
+                return Response(stream_with_context(chunks), mimetype='image/png', headers=headers)
+            logger.info("Result cache hit")
+            headers['X-Cache'] = 'hit'
+        else:
+            # Upscale on the inference queue (re-sent images come from the result cache)
+            logger.info("Starting upscaling...")
+            try:
+                encoded, cache_hit = service.upscale(
+                    request.remote_addr, image_bgr, output_format, profile, model, scale, fast
+                )
+            except QueueFullError as e:
+                return jsonify({'error': str(e)}), 429, {'Retry-After': '30'}
+            output_bytes = encoded.data
+            headers['X-Cache'] = 'hit' if cache_hit else 'miss'
+            if not cache_hit:
+                headers['X-Encode-Time-Ms'] = f"{encoded.seconds * 1000:.0f}"
         
-        # Save to BytesIO
-        output_buffer = BytesIO()
-        output_image.save(output_buffer, format='PNG', optimize=True)
-        output_buffer.seek(0)
-        
-        logger.info(f"Upscaling complete. Output size: {output_image.size}")
+        headers['X-Encoded-Bytes'] = str(len(output_bytes))
         
         # Return image
-        return send_file(
-            output_buffer,
-            mimetype='image/png',
+        response = send_file(
+            BytesIO(output_bytes),
+            mimetype=FORMATS[output_format].mimetype,
             as_attachment=False,
-            download_name='upscaled.png'
+            download_name=f"upscaled{FORMATS[output_format].extension}"
         )
+        response.headers.update(headers)
+        response.headers['Vary'] = 'Accept'
+        return response
     
     except Exception as e:
         logger.error(f"Error processing image: {str(e)}", exc_info=True)
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/jobs', methods=['POST'])
+def create_job():
+    """
+    Submit an image for asynchronous upscaling
+    Accepts: same form fields as /api/upscale, plus optional 'callback_url'
+             (POSTed the final job status when webhooks are enabled)
+    Returns: 202 with the job id and its status/result URLs; 429 when busy
+    """
+    if 'image' not in request.files or request.files['image'].filename == '':
+        return jsonify({'error': 'No image provided'}), 400
+    
+    try:
+        output_format = negotiate_format(
+            request.form.get('format'), request.headers.get('Accept'), Config.OUTPUT_FORMAT
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    profile = request.form.get('profile', Config.ENCODE_PROFILE).lower()
+    if profile not in PROFILES:
+        return jsonify({'error': f"Unknown profile '{profile}'. Available: {', '.join(PROFILES)}"}), 400
+    try:
+        scale = parse_target_scale(request.form.get('scale'))
+        fast = parse_scale_mode(request.form.get('scale_mode'))
+        model = select_model(scale, request.form.get('model'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    try:
+        image_bgr = decode_image(request.files['image'].stream)
+    except Exception as e:
+        return jsonify({'error': f"Could not read image: {e}"}), 400
+    
+    manager = get_service().jobs
+    try:
+        job = manager.submit(
+            request.remote_addr, image_bgr, output_format, profile, request.form.get('callback_url'), model,
+            scale, fast
+        )
+    except QueueFullError as e:
+        return jsonify({'error': str(e)}), 429, {'Retry-After': '30'}
+    
+    body = manager.status(job)
+    body['status_url'] = f"/api/jobs/{job.id}"
+    body['result_url'] = f"/api/jobs/{job.id}/result"
+    return jsonify(body), 202, {'Location': body['status_url']}
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """Job status: queued/running/done/failed, queue position, progress and ETA"""
+    manager = get_service().jobs
+    job = manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown or expired job'}), 404
+    return jsonify(manager.status(job))
+
+@app.route('/api/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    """Encoded result of a finished job (202 with the status while it is still running)"""
+    manager = get_service().jobs
+    job = manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown or expired job'}), 404
+    if job.status == 'failed':
+        return jsonify(manager.status(job)), 500
+    if job.status != 'done':
+        return jsonify(manager.status(job)), 202
+    
+    result = job.result
+    response = send_file(
+        BytesIO(result.data),
+        mimetype=result.mimetype,
+        as_attachment=False,
+        download_name=f"upscaled{result.extension}"
+    )
+    response.headers['X-Encode-Time-Ms'] = f"{result.seconds * 1000:.0f}"
+    response.headers['X-Encoded-Bytes'] = str(result.size)
+    return response
+
 @app.route('/', methods=['GET'])
 def index():
     """Root endpoint"""
@@ -114,13 +227,17 @@ def index():
         'version': '1.0',
         'endpoints': {
             '/health': 'GET - Health check',
-            '/api/upscale': 'POST - Upscale image (multipart/form-data)',
+            '/api/upscale': 'POST - Upscale image (multipart/form-data; format: png|jpeg|webp|avif, profile: fast|small, model: x4plus|anime|x2plus, scale: 1-4, scale_mode: quality|fast, stream: 1)',
+            '/api/jobs': 'POST - Submit an asynchronous upscale job (same fields as /api/upscale)',
+            '/api/jobs/<id>': 'GET - Job status, queue position, progress and ETA',
+            '/api/jobs/<id>/result': 'GET - Result of a finished job',
         }
     })
 
 def main():
     """Run Flask server"""
     port = int(os.environ.get('PORT', 5000))
+    get_service()
     logger.info(f"Starting Flask server on port {port}...")
     app.run(host='0.0.0.0', port=port, debug=False)
 
@@ -0,0 +1,182 @@
+"""
+ASGI API Server for Image Enhancement
+Same /health and /api/upscale contract as api_server.py, served by uvicorn:
+uploads are accepted concurrently, decoding and encoding run in worker
+threads and inference goes through the shared inference service.
+"""
+import asyncio
+import logging
+import os
+from contextlib import asynccontextmanager
+
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+from src.utils import patch_torchvision_compat
+
+patch_torchvision_compat()
+
+from src.config import Config
+from src.scheduler import QueueFullError
+from src.inference import decode_image, get_service
+from src.model_registry import parse_scale_mode, parse_target_scale, select_model
+from src.encoding import FORMATS, PROFILES, negotiate_format
+
+# Configure logging
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+# Shared inference service, loaded at startup (not import: CPU tile-pool
+# workers re-import this module)
+service = None
+
+
+async def health(request):
+    """Health check endpoint"""
+    return JSONResponse({
+        'status': 'healthy',
+        'model': 'Real-ESRGAN',
+        **service.stats()
+    })
+
+
+async def upscale_image(request):
+    """
+    Upscale image endpoint
+    Accepts: multipart/form-data with 'image' file, optional 'format'
+             (png, jpeg, webp, avif), 'profile' (fast, small) and 'model'
+             (x4plus, anime, x2plus) fields; without 'format' the Accept
+             header is used. 'scale' (1-4) and 'scale_mode' (quality, fast)
+             set the output size as on the Flask server
+    Returns: Enhanced image in the negotiated format; 429 when the queue is full
+    """
+    try:
+        form = await request.form()
+        file = form.get('image')
+
+        # Check if image is in request
+        if file is None or isinstance(file, str):
+            return JSONResponse({'error': 'No image provided'}, status_code=400)
+        if file.filename == '':
+            return JSONResponse({'error': 'No file selected'}, status_code=400)
+        if form.get('stream', '').lower() in ('1', 'true', 'yes'):
+            return JSONResponse({'error': 'Streaming is only available on the Flask server'}, status_code=400)
+
+        # Pick the output encoding
+        try:
+            output_format = negotiate_format(
+                form.get('format'), request.headers.get('accept'), Config.OUTPUT_FORMAT
+            )
+        except ValueError as e:
+            return JSONResponse({'error': str(e)}, status_code=400)
+        profile = form.get('profile', Config.ENCODE_PROFILE).lower()
+        if profile not in PROFILES:
+            return JSONResponse(
+                {'error': f"Unknown profile '{profile}'. Available: {', '.join(PROFILES)}"}, status_code=400
+            )
+        try:
+            scale = parse_target_scale(form.get('scale'))
+            fast = parse_scale_mode(form.get('scale_mode'))
+            model = select_model(scale, form.get('model'))
+        except ValueError as e:
+            return JSONResponse({'error': str(e)}, status_code=400)
+
+        # Read and decode off the event loop
+        logger.info(f"Processing image: {file.filename}")
+        image_bytes = await file.read()
+        await form.close()
+        image_bgr = await asyncio.to_thread(decode_image, image_bytes)
+        del image_bytes
+
+        headers = {'X-Output-Format': output_format, 'X-Encode-Profile': profile, 'X-Model': model, 'Vary': 'Accept'}
+        if scale:
+            headers['X-Scale'] = f"{scale:g}"
+            headers['X-Scale-Mode'] = 'fast' if fast else 'quality'
+
+        # Serve re-sent images from the result cache
+        cache_key, output_bytes = await asyncio.to_thread(
+            service.lookup, image_bgr, output_format, profile, model, scale, fast
+        )
+        if output_bytes is not None:
+            logger.info("Result cache hit")
+            headers['X-Cache'] = 'hit'
+        else:
+            # Upscale on the inference worker; the event loop keeps serving other requests
+            client_id = request.client.host if request.client else 'anonymous'
+            try:
+                future = service.submit(client_id, image_bgr, model, scale, fast)
+            except QueueFullError as e:
+                return JSONResponse({'error': str(e)}, status_code=429, headers={'Retry-After': '30'})
+            upscaled_bgr = await asyncio.wrap_future(future)
+            del image_bgr
+            logger.info(f"Upscaling complete. Output size: {upscaled_bgr.shape[1]}×{upscaled_bgr.shape[0]}")
+
+            encoded, _ = await asyncio.to_thread(
+                service.encode_result, cache_key, upscaled_bgr, output_format, profile
+            )
+            output_bytes = encoded.data
+
+            headers['X-Cache'] = 'miss'
+            headers['X-Encode-Time-Ms'] = f"{encoded.seconds * 1000:.0f}"
+
+        headers['X-Encoded-Bytes'] = str(len(output_bytes))
+        headers['Content-Disposition'] = f"inline; filename=upscaled{FORMATS[output_format].extension}"
+        return Response(output_bytes, media_type=FORMATS[output_format].mimetype, headers=headers)
+
+    except Exception as e:
+        logger.error(f"Error processing image: {str(e)}", exc_info=True)
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+
+async def index(request):
+    """Root endpoint"""
+    return JSONResponse({
+        'service': 'Image Enhancement API',
+        'version': '1.0',
+        'endpoints': {
+            '/health': 'GET - Health check',
+            '/api/upscale': 'POST - Upscale image (multipart/form-data; format: png|jpeg|webp|avif, profile: fast|small, model: x4plus|anime|x2plus, scale: 1-4, scale_mode: quality|fast)',
+        }
+    })
+
+
+@asynccontextmanager
+async def lifespan(app):
+    """Load the model behind the scheduler at startup; drain it at shutdown"""
+    global service
+    service = await asyncio.to_thread(get_service)
+    try:
+        yield
+    finally:
+        await asyncio.to_thread(service.shutdown)
+
+
+app = Starlette(
+    routes=[
+        Route('/', index, methods=['GET']),
+        Route('/health', health, methods=['GET']),
+        Route('/api/upscale', upscale_image, methods=['POST']),
+    ],
+    middleware=[Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'])],
+    lifespan=lifespan,
+)
+
+
+def main():
+    """Run the ASGI server with uvicorn"""
+    import uvicorn
+
+    port = int(os.environ.get('PORT', 5000))
+    logger.info(f"Starting ASGI server on port {port}...")
+    # One process: the model lives in this process, behind the scheduler
+    uvicorn.run(app, host='0.0.0.0', port=port, workers=1)
+
+
+if __name__ == '__main__':
+    main()
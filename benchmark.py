@@ -0,0 +1,800 @@
+"""
+Performance benchmarks for the image pipeline
+
+Usage:
+    python benchmark.py cpu-pool --sizes 256 512 --workers 1 2 4 --threads 1
+    python benchmark.py grading --sizes 1024 4096 --band-rows 512
+    python benchmark.py grading-parallel --sizes 4096 8192 --workers 2 4 8
+    python benchmark.py telegram-encode --sizes 4096 8192 --max-mb 9.5
+    python benchmark.py encode --sizes 2048 4096 --formats png jpeg webp
+    python benchmark.py stream --sizes 512 1024
+    python benchmark.py array-api --sizes 1024 2048
+    python benchmark.py scale-matrix --size 512 --scales 1.5 2 3
+    python benchmark.py tile-tune --candidates 128 256 512 --sizes 300 1200 --save
+    python benchmark.py canvas --size 1024 --blend 16
+    python benchmark.py tile-dedup --size 512 --tile 128 --flat-tolerance 2
+    python benchmark.py precision --size 256 --images 4 --precisions fp32 bf16 int8
+    python benchmark.py backends --size 256 --backends pytorch torchscript onnxruntime
+    python benchmark.py load-test --url http://localhost:5000 --clients 1 8 32
+
+Results are printed as plain-text tables. Benchmarks that run the network
+use the weights from Config (downloaded on first use). load-test drives an
+already running API server (api_server.py or asgi_server.py) over HTTP.
+"""
+import argparse
+import time
+import tracemalloc
+from io import BytesIO
+from pathlib import Path
+
+from src.utils import patch_torchvision_compat
+
+patch_torchvision_compat()
+
+import cv2
+import numpy as np
+
+from src.config import Config
+
+
+def make_test_image(width, height, seed=0):
+    """Synthetic photo-like BGR image: smooth gradients plus fine texture"""
+    rng = np.random.default_rng(seed)
+    coarse = rng.integers(0, 256, size=(max(2, height // 32), max(2, width // 32), 3), dtype=np.uint8)
+    img = cv2.resize(coarse, (width, height), interpolation=cv2.INTER_CUBIC)
+    noise = rng.integers(-12, 13, size=img.shape)
+    return np.clip(img.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+
+
+def timed(func, repeat=1):
+    """Best wall-clock time of func over repeat runs, and its last result"""
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def peak_memory(func):
+    """Peak Python-allocated memory (MB) while running func, including its result"""
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+    finally:
+        tracemalloc.stop()
+
+
+def print_table(headers, rows):
+    """Print rows as an aligned text table"""
+    widths = [max(len(str(v)) for v in column) for column in zip(headers, *rows)]
+    print('  '.join(str(h).ljust(w) for h, w in zip(headers, widths)))
+    print('  '.join('-' * w for w in widths))
+    for row in rows:
+        print('  '.join(str(v).ljust(w) for v, w in zip(row, widths)))
+
+
+def bench_cpu_pool(args):
+    """Wall-clock scaling of the CPU tile pool versus in-process RealESRGANer"""
+    from src.super_resolution import SuperResolution
+    from src.cpu_pool import CPUTilePool
+
+    Config.CPU_WORKERS = 0
+    Config.USE_GPU = False
+    Config.USE_FP16 = False
+    sr = SuperResolution()
+
+    rows = []
+    for size in args.sizes:
+        img = make_test_image(size, size)
+        baseline, expected = timed(lambda: sr.upsampler.enhance(img, outscale=sr.scale)[0], args.repeat)
+        rows.append((f"{size}×{size}", 'RealESRGANer', '-', f"{baseline:.2f}", '1.00×', '-'))
+
+        for workers in args.workers:
+            pool = CPUTilePool(
+                model_name=Config.MODEL_NAME,
+                model_path=Config.get_model_path(),
+                scale=sr.scale,
+                num_workers=workers,
+                num_threads=args.threads,
+                tile_size=Config.TILE_SIZE,
+                tile_pad=Config.TILE_PAD,
+                pre_pad=Config.PRE_PAD
+            )
+            try:
+                pool.upscale(make_test_image(64, 64))  # Start workers and load weights
+                elapsed, output = timed(lambda: pool.upscale(img), args.repeat)
+            finally:
+                pool.shutdown()
+            max_diff = int(np.abs(output.astype(np.int16) - expected.astype(np.int16)).max())
+            rows.append((
+                f"{size}×{size}", 'CPUTilePool', f"{workers}×{args.threads}",
+                f"{elapsed:.2f}", f"{baseline / elapsed:.2f}×", max_diff
+            ))
+
+    print_table(('image', 'path', 'workers×threads', 'seconds', 'speedup', 'max |diff|'), rows)
+
+
+def bench_grading(args):
+    """Fused color grading presets versus chaining the individual functions"""
+    from src.color_grading import ColorGrading
+
+    rows = []
+    for size in args.sizes:
+        img = make_test_image(size, size * 3 // 4)
+        for preset in args.presets or ColorGrading.PRESETS:
+            reference, expected = timed(lambda: ColorGrading.apply_preset_reference(img, preset), args.repeat)
+            fused, output = timed(lambda: ColorGrading.apply_preset(img, preset, args.band_rows), args.repeat)
+            max_diff = int(np.abs(output.astype(np.int16) - expected.astype(np.int16)).max())
+            rows.append((
+                f"{img.shape[1]}×{img.shape[0]}", preset,
+                f"{reference * 1000:.0f}", f"{fused * 1000:.0f}", f"{reference / fused:.2f}×",
+                f"{peak_memory(lambda: ColorGrading.apply_preset_reference(img, preset)):.0f}",
+                f"{peak_memory(lambda: ColorGrading.apply_preset(img, preset, args.band_rows)):.0f}",
+                max_diff
+            ))
+
+    print_table(
+        ('image', 'preset', 'chained ms', 'fused ms', 'speedup', 'chained MB', 'fused MB', 'max |diff|'), rows
+    )
+
+
+def bench_grading_parallel(args):
+    """Band-parallel color grading: wall-clock time by image size and thread count"""
+    from src.color_grading import ColorGrading
+
+    rows = []
+    for size in args.sizes:
+        img = make_test_image(size, size * 3 // 4)
+        compiled = ColorGrading.compile_preset(args.preset)
+        baseline, expected = timed(lambda: ColorGrading.run_pipeline(img, compiled), args.repeat)
+        rows.append((f"{img.shape[1]}×{img.shape[0]}", 1, f"{baseline * 1000:.0f}", '1.00×', '-'))
+        for workers in args.workers:
+            if workers <= 1:
+                continue
+            elapsed, output = timed(
+                lambda: ColorGrading.run_pipeline(img, compiled, args.band_rows, workers), args.repeat
+            )
+            max_diff = int(np.abs(output.astype(np.int16) - expected.astype(np.int16)).max())
+            rows.append((
+                f"{img.shape[1]}×{img.shape[0]}", workers,
+                f"{elapsed * 1000:.0f}", f"{baseline / elapsed:.2f}×", max_diff
+            ))
+
+    print(f"preset: {args.preset}, band rows: {args.band_rows or 'one per worker'}")
+    print_table(('image', 'workers', 'ms', 'speedup', 'max |diff|'), rows)
+
+
+def legacy_compress_for_telegram(image_path, max_size_mb=9.5, quality=95):
+    """The previous re-encode loop (quality steps, then 10% resizes), returning (path, encode count)"""
+    from src.utils import save_cv2_image, get_file_size_mb
+
+    file_size = get_file_size_mb(image_path)
+    if file_size <= max_size_mb:
+        return image_path, 0
+    img = cv2.imread(str(image_path))
+    encodes = 0
+    current_quality = quality
+    while file_size > max_size_mb and current_quality > 40:
+        current_quality -= 10
+        save_cv2_image(img, image_path, quality=current_quality)
+        encodes += 1
+        file_size = get_file_size_mb(image_path)
+    if file_size > max_size_mb:
+        while file_size > max_size_mb and img.shape[0] > 500:
+            img = cv2.resize(img, (int(img.shape[1] * 0.9), int(img.shape[0] * 0.9)), interpolation=cv2.INTER_AREA)
+            save_cv2_image(img, image_path, quality=max(current_quality, 70))
+            encodes += 1
+            file_size = get_file_size_mb(image_path)
+    return image_path, encodes
+
+
+def bench_telegram_encode(args):
+    """Size-targeted in-memory encoder versus the old file re-encode loop"""
+    import tempfile
+    from pathlib import Path
+    from src import utils
+
+    encodes = 0
+    encode_cv2_image = utils.encode_cv2_image
+
+    def counting_encode(*encode_args, **encode_kwargs):
+        nonlocal encodes
+        encodes += 1
+        return encode_cv2_image(*encode_args, **encode_kwargs)
+
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in args.sizes:
+            img = make_test_image(size, size * 3 // 4)
+            png = encode_cv2_image(img, '.png', 95)
+            path = Path(tmp) / 'legacy.png'
+
+            def legacy():
+                path.write_bytes(png)
+                return legacy_compress_for_telegram(path, args.max_mb)
+
+            legacy_time, (legacy_path, legacy_encodes) = timed(legacy, args.repeat)
+            legacy_size = legacy_path.stat().st_size
+
+            def targeted():
+                nonlocal encodes
+                encodes = 0
+                return utils.encode_for_telegram(img, png, args.max_mb)
+
+            utils.encode_cv2_image = counting_encode
+            try:
+                targeted_time, (output, extension) = timed(targeted, args.repeat)
+            finally:
+                utils.encode_cv2_image = encode_cv2_image
+            full_size = cv2.imdecode(np.frombuffer(output.getbuffer(), dtype=np.uint8), cv2.IMREAD_COLOR).shape
+
+            rows.append((
+                f"{img.shape[1]}×{img.shape[0]}", f"{len(png) / 2 ** 20:.1f}",
+                legacy_encodes, f"{legacy_time:.2f}", f"{legacy_size / 2 ** 20:.2f}",
+                encodes, f"{targeted_time:.2f}", f"{output.getbuffer().nbytes / 2 ** 20:.2f}",
+                f"{extension} {full_size[1]}×{full_size[0]}", f"{legacy_time / targeted_time:.1f}×"
+            ))
+
+    print(f"limit: {args.max_mb} MB (targeted encode count includes probe encodes)")
+    print_table((
+        'image', 'PNG MB', 'loop encodes', 'loop s', 'loop MB',
+        'targeted encodes', 'targeted s', 'targeted MB', 'targeted output', 'speedup'
+    ), rows)
+
+
+def bench_encode(args):
+    """Encode time and payload size per output format and profile"""
+    from PIL import Image
+    from src.encoding import FORMATS, PROFILES, encode_image
+    from src.utils import cv2_to_pil
+
+    rows = []
+    for size in args.sizes:
+        img = make_test_image(size, size * 3 // 4)
+        label = f"{img.shape[1]}×{img.shape[0]}"
+        pixels = img.shape[0] * img.shape[1]
+
+        def pil_optimize():
+            buffer = BytesIO()
+            cv2_to_pil(img).save(buffer, format='PNG', optimize=True)
+            return buffer.getbuffer().nbytes
+
+        elapsed, size_bytes = timed(pil_optimize, args.repeat)
+        rows.append((label, 'png (PIL optimize)', '-', f"{elapsed * 1000:.0f}",
+                     f"{size_bytes / 2 ** 20:.2f}", f"{size_bytes * 8 / pixels:.2f}"))
+
+        for fmt in args.formats or FORMATS:
+            for profile in PROFILES:
+                elapsed, encoded = timed(lambda: encode_image(img, fmt, profile), args.repeat)
+                rows.append((label, fmt, profile, f"{elapsed * 1000:.0f}",
+                             f"{encoded.size / 2 ** 20:.2f}", f"{encoded.size * 8 / pixels:.2f}"))
+
+    print_table(('image', 'format', 'profile', 'encode ms', 'MB', 'bits/pixel'), rows)
+
+
+def bench_stream(args):
+    """Time to first byte and peak memory: buffered PNG response versus band streaming"""
+    from src.super_resolution import SuperResolution
+    from src.encoding import PNGStreamEncoder, encode_image
+
+    Config.CPU_WORKERS = 0
+    sr = SuperResolution()
+
+    rows = []
+    for size in args.sizes:
+        img = make_test_image(size, size * 3 // 4)
+        label = f"{img.shape[1]}×{img.shape[0]}"
+
+        def buffered():
+            start = time.perf_counter()
+            data = encode_image(sr.engine.upscale(img), 'png', args.profile).data
+            return time.perf_counter() - start, len(data)
+
+        def streamed():
+            start = time.perf_counter()
+            encoder = PNGStreamEncoder(img.shape[1] * sr.scale, img.shape[0] * sr.scale, args.profile)
+            encoder.header()
+            first_band = None
+            for _, band in sr.upscale_rows(img):
+                encoder.encode_rows(band)
+                if first_band is None:
+                    first_band = time.perf_counter() - start
+            encoder.finish()
+            return first_band, encoder.bytes_written
+
+        for mode, func in (('buffered', buffered), ('streamed', streamed)):
+            tracemalloc.start()
+            start = time.perf_counter()
+            first_data, size_bytes = func()
+            total = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+            tracemalloc.stop()
+            rows.append((label, mode, f"{first_data:.2f}", f"{total:.2f}", f"{peak:.0f}", f"{size_bytes / 2 ** 20:.2f}"))
+
+    print(f"tile size: {Config.TILE_SIZE}, profile: {args.profile} (peak counts numpy/Python allocations, not torch)")
+    print_table(('image', 'mode', 'first data s', 'total s', 'peak MB', 'output MB'), rows)
+
+
+def bench_array_api(args):
+    """Array API: both color orders against RealESRGANer, and per-request overhead outside the network"""
+    from PIL import Image
+
+    from src.super_resolution import SuperResolution
+    from src.inference import decode_image
+    from src.encoding import encode_image
+
+    Config.CPU_WORKERS = 0
+    Config.TILE_BATCH_SIZE = 1  # Batch 1 is exact against RealESRGANer
+    sr = SuperResolution()
+
+    img = make_test_image(args.check_size, args.check_size * 3 // 4)
+    reference, _ = sr.upsampler.enhance(img, outscale=sr.scale)
+    img_rgb = np.ascontiguousarray(img[:, :, ::-1])
+    checks = [
+        ('upscale_array(bgr)', sr.upscale_array(img, color_order='bgr')),
+        ('upscale_array(rgb)', sr.upscale_array(img_rgb, color_order='rgb')[:, :, ::-1]),
+        ('upscale_from_array', sr.upscale_from_array(img_rgb)[:, :, ::-1]),
+        ('upscale_many_arrays(rgb)', sr.upscale_many_arrays([img_rgb, img_rgb], color_order='rgb')[1][:, :, ::-1]),
+    ]
+    print(f"{img.shape[1]}×{img.shape[0]} against RealESRGANer:")
+    print_table(('path', 'identical'), [(name, np.array_equal(output, reference)) for name, output in checks])
+    print()
+
+    rows = []
+    for size in args.sizes:
+        img = make_test_image(size, size * 3 // 4)
+        upload = cv2.imencode('.png', img)[1].tobytes()
+        # Stand-in for the network output: the overhead does not depend on its content
+        output = cv2.resize(img, None, fx=sr.scale, fy=sr.scale, interpolation=cv2.INTER_NEAREST)
+        label = f"{img.shape[1]}×{img.shape[0]}"
+
+        def legacy():
+            # PIL decode, upscale_from_array's two swaps, back to BGR for the encoder
+            decode, _ = timed(lambda: np.asarray(Image.open(BytesIO(upload)).convert('RGB')), args.repeat)
+            swaps, _ = timed(lambda: (
+                cv2.cvtColor(img, cv2.COLOR_RGB2BGR),
+                cv2.cvtColor(cv2.cvtColor(output, cv2.COLOR_BGR2RGB), cv2.COLOR_RGB2BGR),
+            ), args.repeat)
+            return decode, swaps
+
+        def array_api():
+            decode, _ = timed(lambda: decode_image(upload), args.repeat)
+            return decode, 0.0
+
+        encode, _ = timed(lambda: encode_image(output, 'png', 'fast'), args.repeat)
+        for name, func in (('legacy', legacy), ('array API', array_api)):
+            decode, swaps = func()
+            rows.append((label, name, f"{decode * 1000:.1f}", f"{swaps * 1000:.1f}",
+                         f"{encode * 1000:.1f}", f"{(decode + swaps + encode) * 1000:.1f}"))
+
+    print(f"per-request work outside the forward pass (×{sr.scale} output, PNG fast encode)")
+    print_table(('image', 'path', 'decode ms', 'color swaps ms', 'encode ms', 'total ms'), rows)
+
+
+def bench_scale_matrix(args):
+    """Per-request output scale: latency and PSNR of the chosen model and mode against full x4plus"""
+    from src.model_registry import ModelRegistry, select_model
+    from src.super_resolution import network_scale, relative_cost
+
+    Config.CPU_WORKERS = 0
+    Config.MODEL_NAME = args.reference
+    registry = ModelRegistry(max_models=len(Config.MODEL_PATHS), max_bytes=0)
+    img = make_test_image(args.size, args.size * 3 // 4)
+    label = f"{img.shape[1]}×{img.shape[0]}"
+
+    rows = []
+    for scale in args.scales:
+        # Reference: the default model at full quality, resized to the target
+        reference_time, reference = timed(
+            lambda: registry.upscale_array(img, model=args.reference, outscale=scale), args.repeat
+        )
+        rows.append((label, f"{scale:g}×", args.reference, 'quality', f"{relative_cost(args.reference):.2f}",
+                     f"{reference.shape[1]}×{reference.shape[0]}", f"{reference_time * 1000:.0f}", '1.00×', 'ref'))
+        model = select_model(scale)
+        for mode in ('quality', 'fast'):
+            if (model == args.reference and mode == 'quality') or (mode == 'fast' and scale >= network_scale(model)):
+                continue
+            seconds, output = timed(
+                lambda: registry.upscale_array(img, model=model, outscale=scale, fast=mode == 'fast'), args.repeat
+            )
+            rows.append((label, f"{scale:g}×", model, mode, f"{relative_cost(model):.2f}",
+                         f"{output.shape[1]}×{output.shape[0]}", f"{seconds * 1000:.0f}",
+                         f"{reference_time / seconds:.2f}×", f"{cv2.PSNR(output, reference):.1f}"))
+
+    print(f"output scale matrix (reference: {args.reference} at full quality; PSNR in dB against it)")
+    print_table(('image', 'scale', 'model', 'mode', 'net cost', 'output', 'ms', 'speedup', 'PSNR'), rows)
+    registry.close()
+
+
+def bench_tile_tune(args):
+    """Tile auto-tuner: per-size speed and memory, and fixed TILE_SIZE vs per-image tiles"""
+    from src.super_resolution import SuperResolution
+    from src.tile_tuner import machine_key, save_profile, tune
+
+    Config.CPU_WORKERS = 0
+    Config.TILE_AUTOTUNE = False
+    sr = SuperResolution()
+    engine = sr.engine
+    key = machine_key(sr.model_name, engine.device, engine.tile_pad, engine.max_batch_size, sr.precision, sr.backend.name)
+    profile = tune(engine, key, args.candidates, args.memory_fraction, args.repeat)
+
+    rows = []
+    for size, stats in sorted(profile.measurements.items()):
+        side = size + 2 * engine.tile_pad
+        core_mp_per_s = size * size / 1e6 / (stats['seconds_per_mp'] * side * side / 1e6)
+        rows.append((size, f"{stats['seconds_per_mp']:.2f}", f"{core_mp_per_s:.4f}", stats['peak_mb'],
+                     '*' if size == profile.tile_size else ''))
+    print(f"tile sizes for {key}")
+    print_table(('tile', 's per padded MP', 'core MP/s', 'peak MB/tile', 'max'), rows)
+    if args.save:
+        save_profile(profile)
+        print(f"saved to {Config.WEIGHTS_DIR}")
+    print()
+
+    rows = []
+    for size in args.sizes:
+        img = make_test_image(size, size * 3 // 4)
+        engine.tile_planner = None
+        fixed, _ = timed(lambda: sr.upscale_array(img), args.repeat)
+        engine.tile_planner = profile.plan
+        planned_size = engine.tile_size_for(img.shape[0] + engine.pre_pad, img.shape[1] + engine.pre_pad)
+        planned, _ = timed(lambda: sr.upscale_array(img), args.repeat)
+        rows.append((f"{img.shape[1]}×{img.shape[0]}", engine.tile_size, f"{fixed * 1000:.0f}",
+                     planned_size, f"{planned * 1000:.0f}", f"{fixed / planned:.2f}×"))
+    if rows:
+        print(f"upscale time, fixed TILE_SIZE vs planned per image ({sr.model_name})")
+        print_table(('image', 'fixed tile', 'ms', 'planned tile', 'ms', 'speedup'), rows)
+    sr.close()
+
+
+def bench_canvas(args):
+    """Output assembly: peak memory and time of RealESRGANer vs tile-by-tile into RAM or a memmap"""
+    from src.super_resolution import SuperResolution
+    from src.tile_tuner import PeakMemory
+
+    Config.CPU_WORKERS = 0
+    Config.TILE_AUTOTUNE = False
+    Config.TILE_BATCH_SIZE = 1
+    sr = SuperResolution()
+    engine = sr.engine
+    img = make_test_image(args.size, args.size * 3 // 4)
+
+    def run(name, func):
+        with PeakMemory(engine.device) as memory:
+            start = time.perf_counter()
+            output = func()
+            seconds = time.perf_counter() - start
+        peak = 'n/a' if memory.peak is None else f"{memory.peak / (1024 * 1024):.0f}"
+        return name, output, peak, f"{seconds * 1000:.0f}"
+
+    results = [run('RealESRGANer', lambda: sr.upsampler.enhance(img, outscale=sr.scale)[0])]
+    reference = results[0][1]
+    results.append(run('tiles -> RAM', lambda: engine.upscale(img)))
+    Config.OUTPUT_MMAP_MB = 1e-6  # Any size
+    results.append(run('tiles -> memmap', lambda: engine.upscale(img)))
+    engine.blend = args.blend
+    results.append(run(f"tiles -> memmap, blend {args.blend}", lambda: engine.upscale(img)))
+
+    rows = []
+    for name, output, peak, ms in results:
+        identical = np.array_equal(output, reference)
+        psnr = 'inf' if identical else f"{cv2.PSNR(np.asarray(output), reference):.1f}"
+        rows.append((name, type(output).__name__, peak, ms, identical, psnr))
+    out_mb = reference.nbytes / (1024 * 1024)
+    print(f"{img.shape[1]}×{img.shape[0]} -> ×{sr.scale} ({out_mb:.0f} MB output), tile {engine.tile_size}, "
+          f"peak = anonymous memory added while running")
+    print_table(('path', 'output', 'peak MB', 'ms', 'identical', 'PSNR'), rows)
+    sr.close()
+
+
+def make_screenshot(width, height, seed=0):
+    """Synthetic screenshot-like BGR image: flat background with a grid of identical icons"""
+    rng = np.random.default_rng(seed)
+    img = np.full((height, width, 3), 242, dtype=np.uint8)
+    icon = make_test_image(48, 48, seed)
+    for y in range(16, height - 48, 96):
+        for x in range(16, width - 48, 96):
+            img[y:y + 48, x:x + 48] = icon
+    # A text-like strip that differs everywhere
+    img[height // 2:height // 2 + 12] = rng.integers(0, 256, size=(12, width, 3), dtype=np.uint8)
+    return img
+
+
+def bench_tile_dedup(args):
+    """Tile reuse: network tiles, time and PSNR with dedup off, on, on with the flat fast path (2 requests each)"""
+    from src.super_resolution import SuperResolution
+    from src.tile_cache import TileDeduplicator
+
+    Config.CPU_WORKERS = 0
+    Config.TILE_AUTOTUNE = False
+    Config.TILE_SIZE = args.tile
+    Config.TILE_BATCH_SIZE = 1
+    sr = SuperResolution()
+    engine = sr.engine
+
+    images = {
+        'screenshot': make_screenshot(args.size, args.size * 3 // 4),
+        'photo': make_test_image(args.size, args.size * 3 // 4),
+    }
+    modes = (
+        ('off', None),
+        ('dedup', -1),
+        (f"dedup+flat({args.flat_tolerance})", args.flat_tolerance),
+    )
+    rows = []
+    for label, img in images.items():
+        reference = None
+        for mode, tolerance in modes:
+            engine.dedup = None if tolerance is None else TileDeduplicator(
+                sr.scale, args.cache_mb * 1024 * 1024, tolerance
+            )
+            for request in (1, 2):
+                seconds, output = timed(lambda: engine.upscale(img))
+                if reference is None:
+                    reference = output
+                stats = engine.dedup.stats() if engine.dedup is not None else None
+                identical = np.array_equal(output, reference)
+                rows.append((
+                    label, mode, request, f"{seconds * 1000:.0f}",
+                    stats['network'] if stats else '-', stats['hit_rate'] if stats else '-',
+                    'inf' if identical else f"{cv2.PSNR(output, reference):.1f}",
+                ))
+                if tolerance is None:
+                    break  # Nothing carries over between requests
+    engine.dedup = None
+
+    print(f"{args.size}×{args.size * 3 // 4}, tile {args.tile}, {sr.model_name} (counters are cumulative)")
+    print_table(('image', 'mode', 'request', 'ms', 'network tiles', 'hit rate', 'PSNR vs off'), rows)
+    sr.close()
+
+
+def bench_precision(args):
+    """CPU precision modes: load (calibration) time, images/min and PSNR against fp32"""
+    from src.model_registry import model_bytes
+    from src.super_resolution import SuperResolution
+
+    Config.USE_GPU = False
+    Config.USE_FP16 = False
+    Config.CPU_WORKERS = 0
+    Config.TILE_AUTOTUNE = False
+    if args.calibration_dir:
+        Config.CALIBRATION_DIR = Path(args.calibration_dir)
+    images = [make_test_image(args.size, args.size * 3 // 4, seed) for seed in range(args.images)]
+
+    rows = []
+    references = None
+    reference_time = None
+    for precision in args.precisions:
+        Config.CPU_PRECISION = precision
+        load_time, sr = timed(lambda: SuperResolution(args.model))
+        sr.upscale_array(images[0][:64, :64])  # Warm-up
+        seconds, outputs = timed(lambda: [sr.upscale_array(img) for img in images], args.repeat)
+        if references is None:
+            references, reference_time = outputs, seconds
+        psnrs = [cv2.PSNR(output, reference) for output, reference in zip(outputs, references)]
+        identical = all(np.array_equal(output, reference) for output, reference in zip(outputs, references))
+        rows.append((
+            precision, sr.precision, f"{load_time:.1f}", f"{model_bytes(sr) / (1024 * 1024):.0f}",
+            f"{seconds / len(images) * 1000:.0f}", f"{len(images) / seconds * 60:.1f}",
+            f"{reference_time / seconds:.2f}×", 'inf' if identical else f"{min(psnrs):.1f}",
+        ))
+        sr.close()
+
+    print(f"{args.model}, {args.images} images {args.size}×{args.size * 3 // 4}, "
+          f"tile {Config.TILE_SIZE} (PSNR: worst image, in dB against the first precision)")
+    print_table(('precision', 'runs as', 'load s', 'weights MB', 'ms/image', 'images/min', 'speedup', 'PSNR'), rows)
+
+
+def bench_backends(args):
+    """Inference backends on CPU: equivalence with eager PyTorch, export time, cold start and images/min"""
+    from src.export import export_model, export_onnx
+    from src.super_resolution import SuperResolution
+
+    Config.USE_GPU = False
+    Config.USE_FP16 = False
+    Config.CPU_WORKERS = 0
+    Config.CPU_PRECISION = 'fp32'
+    Config.TILE_AUTOTUNE = False
+    exporters = {'torchscript': export_model, 'onnxruntime': export_onnx}
+    # Several tiles and an odd height, so TILE_PAD, PRE_PAD and mod-scale padding are all exercised
+    check = make_test_image(args.check_size, args.check_size * 3 // 4 + 1, seed=100)
+    images = [make_test_image(args.size, args.size * 3 // 4, seed) for seed in range(args.images)]
+
+    rows = []
+    reference_check = references = reference_time = None
+    for backend in ['pytorch'] + [name for name in args.backends if name != 'pytorch']:
+        export_time = None
+        if backend in exporters:
+            export_time, _ = timed(lambda: exporters[backend](args.model))
+        Config.MODEL_BACKEND = backend
+        load_time, sr = timed(lambda: SuperResolution(args.model))
+        if sr.backend.name != backend:
+            rows.append((backend, 'unavailable', '-', '-', '-', '-', '-', '-', '-'))
+            sr.close()
+            continue
+
+        tile_size = sr.engine.tile_size
+        sr.engine.tile_size = args.check_tile
+        check_output = sr.upscale_array(check)
+        sr.engine.tile_size = tile_size
+        first_time, _ = timed(lambda: sr.upscale_array(images[0]))
+        seconds, outputs = timed(lambda: [sr.upscale_array(img) for img in images], args.repeat)
+        if references is None:
+            reference_check, references, reference_time = check_output, outputs, seconds
+
+        max_diff = max(int(np.abs(output.astype(np.int16) - reference).max())
+                       for output, reference in zip([check_output] + outputs, [reference_check] + references))
+        rows.append((
+            backend, 'ok' if max_diff <= args.tolerance else 'MISMATCH', max_diff,
+            '-' if export_time is None else f"{export_time:.1f}", f"{load_time:.2f}", f"{first_time * 1000:.0f}",
+            f"{seconds / len(images) * 1000:.0f}", f"{len(images) / seconds * 60:.1f}", f"{reference_time / seconds:.2f}×",
+        ))
+        sr.close()
+
+    print(f"{args.model}: equivalence on {check.shape[1]}×{check.shape[0]} (tile {args.check_tile}, max diff "
+          f"≤ {args.tolerance}) and the timed images; {args.images} images {args.size}×{args.size * 3 // 4}, "
+          f"tile {Config.TILE_SIZE}")
+    print_table(('backend', 'vs pytorch', 'max diff', 'export s', 'load s', 'first image ms', 'ms/image',
+                 'images/min', 'speedup'), rows)
+
+
+def bench_load_test(args):
+    """Throughput and latency of a running API server under concurrent clients"""
+    from concurrent.futures import ThreadPoolExecutor
+
+    import requests
+
+    url = args.url.rstrip('/') + '/api/upscale'
+
+    def post(index):
+        # A distinct image per request, so the result cache never answers
+        img = make_test_image(args.size, args.size * 3 // 4, seed=index)
+        payload = cv2.imencode('.png', img)[1].tobytes()
+        start = time.perf_counter()
+        try:
+            response = requests.post(
+                url, files={'image': (f'load{index}.png', payload, 'image/png')},
+                data={'format': args.format}, timeout=args.timeout
+            )
+            status = response.status_code
+        except requests.RequestException:
+            status = None
+        return status, time.perf_counter() - start
+
+    rows = []
+    offset = 0
+    for clients in args.clients:
+        total = clients * args.requests
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=clients) as executor:
+            results = list(executor.map(post, range(offset, offset + total)))
+        elapsed = time.perf_counter() - start
+        offset += total
+
+        latencies = sorted(seconds for status, seconds in results if status == 200)
+        ok = len(latencies)
+        rejected = sum(1 for status, _ in results if status == 429)
+        failed = total - ok - rejected
+        p50 = f"{latencies[ok // 2]:.2f}" if ok else '-'
+        p95 = f"{latencies[min(ok - 1, int(ok * 0.95))]:.2f}" if ok else '-'
+        rows.append((clients, total, ok, rejected, failed, f"{ok / elapsed:.2f}", p50, p95))
+
+    print(f"{url}: {args.size}×{args.size * 3 // 4} PNG uploads, format {args.format}")
+    print_table(('clients', 'requests', 'ok', '429', 'errors', 'ok req/s', 'p50 s', 'p95 s'), rows)
+
+
+def main():
+    """Parse arguments and run the selected benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    cpu_pool = subparsers.add_parser('cpu-pool', help=bench_cpu_pool.__doc__)
+    cpu_pool.add_argument('--sizes', type=int, nargs='+', default=[256, 512])
+    cpu_pool.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    cpu_pool.add_argument('--threads', type=int, default=1, help='torch threads per worker')
+    cpu_pool.add_argument('--repeat', type=int, default=1)
+    cpu_pool.set_defaults(func=bench_cpu_pool)
+
+    grading = subparsers.add_parser('grading', help=bench_grading.__doc__)
+    grading.add_argument('--sizes', type=int, nargs='+', default=[1024, 4096], help='image widths')
+    grading.add_argument('--presets', nargs='+')
+    grading.add_argument('--band-rows', type=int, default=Config.GRADING_BAND_ROWS, help='0 = whole image')
+    grading.add_argument('--repeat', type=int, default=3)
+    grading.set_defaults(func=bench_grading)
+
+    grading_parallel = subparsers.add_parser('grading-parallel', help=bench_grading_parallel.__doc__)
+    grading_parallel.add_argument('--sizes', type=int, nargs='+', default=[2048, 4096, 8192], help='image widths')
+    grading_parallel.add_argument('--workers', type=int, nargs='+', default=[2, 4, 8])
+    grading_parallel.add_argument('--preset', default='vibrant')
+    grading_parallel.add_argument('--band-rows', type=int, default=0, help='0 = one band per worker')
+    grading_parallel.add_argument('--repeat', type=int, default=3)
+    grading_parallel.set_defaults(func=bench_grading_parallel)
+
+    telegram_encode = subparsers.add_parser('telegram-encode', help=bench_telegram_encode.__doc__)
+    telegram_encode.add_argument('--sizes', type=int, nargs='+', default=[2048, 4096], help='image widths')
+    telegram_encode.add_argument('--max-mb', type=float, default=9.5)
+    telegram_encode.add_argument('--repeat', type=int, default=1)
+    telegram_encode.set_defaults(func=bench_telegram_encode)
+
+    encode = subparsers.add_parser('encode', help=bench_encode.__doc__)
+    encode.add_argument('--sizes', type=int, nargs='+', default=[2048, 4096], help='image widths')
+    encode.add_argument('--formats', nargs='+')
+    encode.add_argument('--repeat', type=int, default=1)
+    encode.set_defaults(func=bench_encode)
+
+    stream = subparsers.add_parser('stream', help=bench_stream.__doc__)
+    stream.add_argument('--sizes', type=int, nargs='+', default=[512, 1024], help='input widths')
+    stream.add_argument('--profile', default='fast', choices=('fast', 'small'))
+    stream.set_defaults(func=bench_stream)
+
+    array_api = subparsers.add_parser('array-api', help=bench_array_api.__doc__)
+    array_api.add_argument('--sizes', type=int, nargs='+', default=[1024, 2048], help='input widths')
+    array_api.add_argument('--check-size', type=int, default=96, help='input width for the equivalence check')
+    array_api.add_argument('--repeat', type=int, default=3)
+    array_api.set_defaults(func=bench_array_api)
+
+    scale_matrix = subparsers.add_parser('scale-matrix', help=bench_scale_matrix.__doc__)
+    scale_matrix.add_argument('--size', type=int, default=512, help='input width')
+    scale_matrix.add_argument('--scales', type=float, nargs='+', default=[1.5, 2, 3, 4])
+    scale_matrix.add_argument('--reference', default='RealESRGAN_x4plus', help='default model')
+    scale_matrix.add_argument('--repeat', type=int, default=1)
+    scale_matrix.set_defaults(func=bench_scale_matrix)
+
+    tile_tune = subparsers.add_parser('tile-tune', help=bench_tile_tune.__doc__)
+    tile_tune.add_argument('--candidates', type=int, nargs='+', default=Config.TILE_CANDIDATES)
+    tile_tune.add_argument('--memory-fraction', type=float, default=Config.TILE_MEMORY_FRACTION)
+    tile_tune.add_argument('--sizes', type=int, nargs='*', default=[300, 1200], help='input widths to compare')
+    tile_tune.add_argument('--save', action='store_true', help='store the profile for TILE_AUTOTUNE')
+    tile_tune.add_argument('--repeat', type=int, default=1)
+    tile_tune.set_defaults(func=bench_tile_tune)
+
+    canvas = subparsers.add_parser('canvas', help=bench_canvas.__doc__)
+    canvas.add_argument('--size', type=int, default=1024, help='input width')
+    canvas.add_argument('--blend', type=int, default=16)
+    canvas.set_defaults(func=bench_canvas)
+
+    tile_dedup = subparsers.add_parser('tile-dedup', help=bench_tile_dedup.__doc__)
+    tile_dedup.add_argument('--size', type=int, default=512, help='input width')
+    tile_dedup.add_argument('--tile', type=int, default=128)
+    tile_dedup.add_argument('--flat-tolerance', type=int, default=2)
+    tile_dedup.add_argument('--cache-mb', type=int, default=64)
+    tile_dedup.set_defaults(func=bench_tile_dedup)
+
+    precision = subparsers.add_parser('precision', help=bench_precision.__doc__)
+    precision.add_argument('--model', default=Config.MODEL_NAME)
+    precision.add_argument('--precisions', nargs='+', default=['fp32', 'bf16', 'int8'])
+    precision.add_argument('--size', type=int, default=256, help='input width')
+    precision.add_argument('--images', type=int, default=4)
+    precision.add_argument('--calibration-dir', help='sample images for int8 calibration (default CALIBRATION_DIR)')
+    precision.add_argument('--repeat', type=int, default=1)
+    precision.set_defaults(func=bench_precision)
+
+    backends = subparsers.add_parser('backends', help=bench_backends.__doc__)
+    backends.add_argument('--model', default=Config.MODEL_NAME)
+    backends.add_argument('--backends', nargs='+', default=['pytorch', 'torchscript', 'onnxruntime'])
+    backends.add_argument('--size', type=int, default=256, help='input width')
+    backends.add_argument('--images', type=int, default=4)
+    backends.add_argument('--check-size', type=int, default=150, help='input width for the equivalence check')
+    backends.add_argument('--check-tile', type=int, default=64, help='tile size for the equivalence check')
+    backends.add_argument('--tolerance', type=int, default=1, help='max difference in levels')
+    backends.add_argument('--repeat', type=int, default=1)
+    backends.set_defaults(func=bench_backends)
+
+    load_test = subparsers.add_parser('load-test', help=bench_load_test.__doc__)
+    load_test.add_argument('--url', default='http://localhost:5000')
+    load_test.add_argument('--clients', type=int, nargs='+', default=[1, 8, 32])
+    load_test.add_argument('--requests', type=int, default=2, help='requests per client')
+    load_test.add_argument('--size', type=int, default=256, help='upload width')
+    load_test.add_argument('--format', default='png')
+    load_test.add_argument('--timeout', type=float, default=600)
+    load_test.set_defaults(func=bench_load_test)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
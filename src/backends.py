@@ -0,0 +1,181 @@
+"""
+Inference backends for SuperResolution
+
+A backend loads one model's network for a device and exposes it as a
+callable on (N, 3, h, w) float tensors. The tiling engine (TILE_PAD,
+PRE_PAD, batching), the CPU pool and the array API sit on top of it, so
+every backend produces tiles the same way:
+
+- pytorch: eager RRDBNet from the .pth through RealESRGANer (CPU precisions apply)
+- torchscript: frozen TorchScript export (CPU, float32)
+- onnxruntime: ONNX export run by ONNX Runtime's CPU execution provider (float32)
+"""
+import json
+import logging
+
+import torch
+
+from .export import export_onnx, export_path, load_or_export, source_stamp
+from .precision import apply_precision, weight_bytes
+
+logger = logging.getLogger(__name__)
+
+try:
+    import onnxruntime
+    ONNXRUNTIME_AVAILABLE = True
+except ImportError:
+    ONNXRUNTIME_AVAILABLE = False
+
+BACKENDS = ('pytorch', 'torchscript', 'onnxruntime')
+
+
+def resolve_backend(backend, device, precision):
+    """
+    Backend that will actually run: exports are float32 CPU graphs, so other
+    devices, reduced precisions and a missing onnxruntime fall back to eager
+    PyTorch
+
+    Raises:
+        ValueError: Unknown backend name
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend '{backend}'. Available: {', '.join(BACKENDS)}")
+    if backend == 'pytorch':
+        return backend
+    if device.type != 'cpu':
+        logger.warning(f"The {backend} backend is CPU-only, running eager PyTorch on the GPU")
+        return 'pytorch'
+    if precision != 'fp32':
+        logger.warning(f"Exported networks are float32, running eager PyTorch for {precision}")
+        return 'pytorch'
+    if backend == 'onnxruntime' and not ONNXRUNTIME_AVAILABLE:
+        logger.warning("onnxruntime is not installed (pip install onnx onnxruntime), running eager PyTorch")
+        return 'pytorch'
+    return backend
+
+
+class Backend:
+    """
+    A model's network, loaded for one device
+
+    Attributes:
+        name: Backend name (see BACKENDS)
+        device: torch.device of the network's input and output
+        network: Callable (N, 3, h, w) float tensor -> (N, 3, h*scale, w*scale) tensor
+        dtype: Input dtype the network expects
+        autocast: dtype to run the network under autocast, or None
+        weight_bytes: Approximate memory held by the weights
+    """
+
+    name = None
+
+    def __init__(self, device):
+        self.device = device
+        self.network = None
+        self.dtype = torch.float32
+        self.autocast = None
+        self.weight_bytes = 0
+
+
+class PyTorchBackend(Backend):
+    """Eager network of a RealESRGANer, with the CPU precision applied (shared with the upsampler)"""
+
+    name = 'pytorch'
+
+    def __init__(self, upsampler, precision='fp32'):
+        """
+        Args:
+            upsampler: RealESRGANer holding the loaded network
+            precision: Resolved CPU precision (see precision.resolve_precision)
+        """
+        super().__init__(upsampler.device)
+        upsampler.model, self.autocast = apply_precision(upsampler.model, precision)
+        self.network = upsampler.model
+        self.dtype = next(self.network.parameters(), torch.empty(0)).dtype
+        self.weight_bytes = weight_bytes(self.network)
+
+
+class TorchScriptBackend(Backend):
+    """Frozen TorchScript export, created beside the weights on first use"""
+
+    name = 'torchscript'
+
+    def __init__(self, model_name, model_path, device):
+        super().__init__(device)
+        self.network = load_or_export(model_name, model_path, device)
+        self.weight_bytes = export_path(model_name).stat().st_size
+
+
+class OnnxRuntimeNetwork:
+    """ONNX Runtime session behind the network interface (torch tensors in and out)"""
+
+    def __init__(self, session):
+        self.session = session
+        self.input_name = session.get_inputs()[0].name
+
+    def __call__(self, batch):
+        output = self.session.run(None, {self.input_name: batch.detach().cpu().numpy()})[0]
+        return torch.from_numpy(output)
+
+
+class OnnxRuntimeBackend(Backend):
+    """ONNX export on ONNX Runtime's CPU execution provider, created beside the weights on first use"""
+
+    name = 'onnxruntime'
+
+    def __init__(self, model_name, model_path, device, num_threads=None):
+        """
+        Args:
+            model_name, model_path: Model to load (exported if missing or stale)
+            device: CPU torch.device
+            num_threads: Intra-op threads of the session (default: torch's thread count)
+        """
+        super().__init__(device)
+        self.num_threads = num_threads or torch.get_num_threads()
+        session = self._load(model_name, model_path)
+        if session is None:
+            logger.info(f"Exporting {model_name} to ONNX...")
+            export_onnx(model_name, model_path)
+            session = self._load(model_name, model_path)
+        self.network = OnnxRuntimeNetwork(session)
+        self.weight_bytes = export_path(model_name, 'onnx').stat().st_size
+
+    def _load(self, model_name, model_path):
+        """Session for the model's ONNX export, or None if missing or stale"""
+        path = export_path(model_name, 'onnx')
+        if not path.exists():
+            return None
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = self.num_threads
+        session = onnxruntime.InferenceSession(str(path), options, providers=['CPUExecutionProvider'])
+        try:
+            stamp = json.loads(session.get_modelmeta().custom_metadata_map.get('source', ''))
+        except ValueError:
+            stamp = None
+        if stamp != source_stamp(model_path):
+            logger.info(f"{path.name} was built from other weights or another torch version")
+            return None
+        return session
+
+
+def create_backend(backend, model_name, model_path, device, num_threads=None):
+    """
+    Load a model with an export-based backend ('torchscript' or 'onnxruntime')
+
+    The pytorch backend wraps an existing RealESRGANer instead (see PyTorchBackend).
+
+    Args:
+        backend: Resolved backend name (see resolve_backend)
+        model_name, model_path: Model to load
+        device: torch.device
+        num_threads: Intra-op threads (ONNX Runtime; default torch's thread count)
+
+    Returns:
+        Backend
+    """
+    if backend == 'torchscript':
+        return TorchScriptBackend(model_name, model_path, device)
+    if backend == 'onnxruntime':
+        return OnnxRuntimeBackend(model_name, model_path, device, num_threads)
+    raise ValueError(f"No export-based backend '{backend}'")
@@ -1,8 +1,8 @@
 """
 Main Telegram Bot for Image Super-Resolution and Color Grading
 """
+import asyncio
 import logging
-import os
 from io import BytesIO
 from pathlib import Path
 from functools import wraps
@@ -10,18 +10,20 @@ from functools import wraps
 from telegram import Update
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
 from telegram.constants import ParseMode
-from PIL import Image
+import cv2
+import numpy as np
 
 from .config import Config
-from .super_resolution import SuperResolution
+from .scheduler import QueueFullError
+from .inference import decode_image, get_service
+from .model_registry import parse_scale_mode, parse_target_scale, resolve_model_name, select_model
+from .super_resolution import network_scale
+from .pixel_store import PixelStore
 from .color_grading import ColorGrading
+from .encoding import encode_image, negotiate_format
 from .utils import (
     generate_unique_filename,
-    pil_to_cv2,
-    cv2_to_pil,
-    save_cv2_image,
-    compress_for_telegram,
-    get_file_size_mb
+    encode_for_telegram
 )
 
 # Configure logging
@@ -31,6 +33,13 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Seconds between queue position updates while a job is waiting
+QUEUE_POLL_INTERVAL = 3
+
+# Largest upload sent as a photo, and the formats Telegram accepts as photos
+PHOTO_MAX_BYTES = 10 * 1024 * 1024
+PHOTO_EXTENSIONS = ('.png', '.jpg')
+
 
 class ImageBot:
     """Telegram bot for image super-resolution and color grading"""
@@ -39,17 +48,34 @@ class ImageBot:
         """Initialize bot"""
         # Validate configuration
         Config.validate()
+        negotiate_format(Config.OUTPUT_FORMAT)  # Fail early on an unsupported format
         
-        # Initialize super-resolution model
-        logger.info("Loading super-resolution model...")
-        self.sr_model = SuperResolution()
-        logger.info("Model loaded successfully!")
+        # Model, inference queue and result cache, shared with the HTTP servers
+        self.service = get_service()
+        self.scheduler = self.service.scheduler
+        self.result_cache = self.service.result_cache
+        
+        # Decoded upscaled images awaiting color grading, keyed by user
+        self.pixel_store = PixelStore()
         
         # User processing state
         self.user_states = {}
         
-        # Initialize application (without job queue since we don't need it)
-        self.application = Application.builder().token(Config.BOT_TOKEN).job_queue(None).build()
+        # Model chosen with /model, by user (default Config.MODEL_NAME)
+        self.user_models = {}
+        
+        # Output scale chosen with /scale, by user: (scale, fast mode)
+        self.user_scales = {}
+        
+        # Initialize application (without job queue since we don't need it).
+        # Updates are handled concurrently so a long upscale never blocks other users.
+        self.application = (
+            Application.builder()
+            .token(Config.BOT_TOKEN)
+            .job_queue(None)
+            .concurrent_updates(True)
+            .build()
+        )
         
         # Register handlers
         self._register_handlers()
@@ -61,6 +87,8 @@ class ImageBot:
         self.application.add_handler(CommandHandler('presets', self.cmd_presets))
         self.application.add_handler(CommandHandler('status', self.cmd_status))
         self.application.add_handler(CommandHandler('cancel', self.cmd_cancel))
+        self.application.add_handler(CommandHandler('model', self.cmd_model))
+        self.application.add_handler(CommandHandler('scale', self.cmd_scale))
         self.application.add_handler(MessageHandler(filters.PHOTO, self.handle_photo))
         self.application.add_handler(MessageHandler(filters.Document.IMAGE, self.handle_document_image))
         self.application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_text))
@@ -96,6 +124,8 @@ class ImageBot:
             "/help - Detailed usage guide\n"
             "/presets - List color grading options\n"
             "/status - Check current processing state\n"
+            "/model - Choose the upscaling model\n"
+            "/scale - Choose the output size (e.g. 1.5×)\n"
             "/cancel - Cancel and clear queue\n\n"
             "⚠️ IMPORTANT RULES:\n"
             "• Send images as PHOTO (compress option)\n"
@@ -197,7 +227,15 @@ class ImageBot:
         """Handle /status command - check if image is being processed"""
         user_id = update.effective_user.id
         
-        if user_id in self.user_states:
+        queued_jobs = self.scheduler.jobs_for(user_id)
+        if queued_jobs:
+            stats = self.scheduler.stats()
+            status_msg = (
+                f"🔄 You have {queued_jobs} image(s) being upscaled.\n\n"
+                f"📊 Queue: {stats['running']} running, {stats['queued']} waiting "
+                f"({stats['workers']} worker(s))"
+            )
+        elif user_id in self.user_states:
             status_msg = (
                 "⏳ You have an image waiting for color grading!\n\n"
                 "📝 Next steps:\n"
@@ -219,11 +257,65 @@ class ImageBot:
         """Handle /cancel command"""
         user_id = update.effective_user.id
         if user_id in self.user_states:
-            del self.user_states[user_id]
+            self._clear_state(user_id)
             await update.message.reply_text("✅ Operation cancelled.")
         else:
             await update.message.reply_text("ℹ️ No active operation to cancel.")
     
+    @restricted
+    async def cmd_model(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle /model command - show or choose the model used for your images"""
+        user_id = update.effective_user.id
+        
+        if context.args:
+            try:
+                model = resolve_model_name(context.args[0])
+            except ValueError as e:
+                await update.message.reply_text(f"❌ {e}")
+                return
+            self.user_models[user_id] = model
+            await update.message.reply_text(f"✅ Your images will be upscaled with {model} ({network_scale(model)}×).")
+            return
+        
+        current = self.user_models.get(user_id, Config.MODEL_NAME)
+        lines = [f"🧠 Current model: {current} ({network_scale(current)}×)\n", "Available models:"]
+        for alias, model in Config.MODEL_ALIASES.items():
+            lines.append(f"• {alias} - {model} ({network_scale(model)}×)")
+        lines.append("\n💡 Use /model <name>, e.g. /model anime (faster, made for drawings and cartoons)")
+        await update.message.reply_text("\n".join(lines))
+    
+    @restricted
+    async def cmd_scale(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle /scale command - show or choose the output size of your images"""
+        user_id = update.effective_user.id
+        
+        if context.args:
+            if context.args[0].lower() in ('off', 'default'):
+                self.user_scales.pop(user_id, None)
+                await update.message.reply_text("✅ Your images will be upscaled at the model's own scale.")
+                return
+            try:
+                scale = parse_target_scale(context.args[0])
+                fast = parse_scale_mode(context.args[1] if len(context.args) > 1 else None)
+            except ValueError as e:
+                await update.message.reply_text(f"❌ {e}")
+                return
+            self.user_scales[user_id] = (scale, fast)
+            model = select_model(scale, self.user_models.get(user_id))
+            await update.message.reply_text(
+                f"✅ Your images will be upscaled {scale:g}× with {model}{' (fast mode)' if fast else ''}."
+            )
+            return
+        
+        scale, fast = self.user_scales.get(user_id, (None, False))
+        current = f"{scale:g}×{' (fast mode)' if fast else ''}" if scale else "model scale"
+        await update.message.reply_text(
+            f"📐 Current output size: {current}\n\n"
+            "💡 Use /scale <factor> [fast], e.g. /scale 1.5 or /scale 2 fast, and /scale off to reset.\n"
+            "Without /model, small factors use the faster 2× model. "
+            "Fast mode shrinks your image before upscaling: much quicker, slightly less detail."
+        )
+    
     @restricted
     async def handle_photo(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle incoming photo"""
@@ -239,82 +331,18 @@ class ImageBot:
             photo = update.message.photo[-1]  # Get highest resolution
             photo_file = await photo.get_file()
             
-            # Download to memory
-            bio = BytesIO()
-            await photo_file.download_to_memory(bio)
-            bio.seek(0)
-            
-            # Open with PIL
-            img = Image.open(bio).convert('RGB')
-            
-            # Save temporarily
-            input_filename = generate_unique_filename('png')
-            input_path = Config.TEMP_DIR / input_filename
-            img.save(input_path)
-            
-            logger.info(f"Processing image for user {user_id}: {input_filename}")
-            
-            # Convert to OpenCV format
-            img_cv2 = pil_to_cv2(img)
-            
-            # Upscale
-            await processing_msg.edit_text("🚀 Upscaling image with AI...")
-            upscaled = self.sr_model.upscale_from_array(img_cv2)
-            
-            # Save upscaled image
-            output_filename = f"upscaled_{input_filename}"
-            output_path = Config.TEMP_DIR / output_filename
-            save_cv2_image(upscaled, output_path, quality=95)
-            
-            # Compress if needed
-            output_path = compress_for_telegram(output_path)
-            
-            # Store state for possible color grading
-            self.user_states[user_id] = {
-                'upscaled_path': output_path,
-                'input_path': input_path
-            }
-            
-            # Send result
-            await processing_msg.edit_text("✨ Upscaling complete! Sending image...")
-            
-            # Check file size and decide if sending as photo or document
-            file_size = os.path.getsize(output_path)
-            
-            with open(output_path, 'rb') as f:
-                if file_size <= 10 * 1024 * 1024:  # 10MB limit for photos
-                    await update.message.reply_photo(
-                        photo=f,
-                        caption=(
-                            f"✅ Image upscaled {Config.MODEL_SCALE}× successfully!\n\n"
-                            "💡 Want to apply color grading? Reply with a preset name.\n"
-                            "Use /presets to see available options, or send another image."
-                        )
-                    )
-                else:
-                    # File too large for photo, send as document
-                    await update.message.reply_document(
-                        document=f,
-                        caption=(
-                            f"✅ Image upscaled {Config.MODEL_SCALE}× successfully!\n\n"
-                            "⚠️ Image sent as file due to size (>10MB)\n\n"
-                            "💡 Want to apply color grading? Reply with a preset name.\n"
-                            "Use /presets to see available options, or send another image."
-                        )
-                    )
-            
-            # Delete processing message
-            await processing_msg.delete()
+            await self._upscale_and_reply(update, processing_msg, photo_file)
             
             logger.info(f"Successfully processed image for user {user_id}")
             
+        except QueueFullError as e:
+            await processing_msg.edit_text(f"⏳ Server is busy: {e}\nPlease try again in a minute.")
         except Exception as e:
             logger.error(f"Error processing image: {e}", exc_info=True)
             await processing_msg.edit_text(f"❌ Error processing image: {str(e)}")
             
             # Cleanup
-            if user_id in self.user_states:
-                del self.user_states[user_id]
+            self._clear_state(user_id)
     
     @restricted
     async def handle_document_image(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -335,82 +363,179 @@ class ImageBot:
             document = update.message.document
             doc_file = await document.get_file()
             
-            # Download to memory
-            bio = BytesIO()
-            await doc_file.download_to_memory(bio)
-            bio.seek(0)
-            
-            # Open with PIL
-            img = Image.open(bio).convert('RGB')
-            
-            # Save temporarily
-            input_filename = generate_unique_filename('png')
-            input_path = Config.TEMP_DIR / input_filename
-            img.save(input_path)
-            
-            logger.info(f"Processing image document for user {user_id}: {input_filename}")
-            
-            # Convert to OpenCV format
-            img_cv2 = pil_to_cv2(img)
-            
-            # Upscale
-            await processing_msg.edit_text("🚀 Upscaling image with AI...")
-            upscaled = self.sr_model.upscale_from_array(img_cv2)
-            
-            # Save upscaled image
-            output_filename = f"upscaled_{input_filename}"
-            output_path = Config.TEMP_DIR / output_filename
-            save_cv2_image(upscaled, output_path, quality=95)
-            
-            # Compress if needed
-            output_path = compress_for_telegram(output_path)
-            
-            # Store state for possible color grading
-            self.user_states[user_id] = {
-                'upscaled_path': output_path,
-                'input_path': input_path
-            }
-            
-            # Send result
-            await processing_msg.edit_text("✨ Upscaling complete! Sending image...")
-            
-            # Check file size and decide if sending as photo or document
-            file_size = os.path.getsize(output_path)
-            
-            with open(output_path, 'rb') as f:
-                if file_size <= 10 * 1024 * 1024:  # 10MB limit for photos
-                    await update.message.reply_photo(
-                        photo=f,
-                        caption=(
-                            f"✅ Image upscaled {Config.MODEL_SCALE}× successfully!\n\n"
-                            "💡 Want to apply color grading? Reply with a preset name.\n"
-                            "Use /presets to see available options, or send another image."
-                        )
-                    )
-                else:
-                    # File too large for photo, send as document
-                    await update.message.reply_document(
-                        document=f,
-                        caption=(
-                            f"✅ Image upscaled {Config.MODEL_SCALE}× successfully!\n\n"
-                            "⚠️ Image sent as file due to size (>10MB)\n\n"
-                            "💡 Want to apply color grading? Reply with a preset name.\n"
-                            "Use /presets to see available options, or send another image."
-                        )
-                    )
-            
-            # Delete processing message
-            await processing_msg.delete()
+            await self._upscale_and_reply(update, processing_msg, doc_file)
             
             logger.info(f"Successfully processed image document for user {user_id}")
             
+        except QueueFullError as e:
+            await processing_msg.edit_text(f"⏳ Server is busy: {e}\nPlease try again in a minute.")
         except Exception as e:
             logger.error(f"Error processing image document: {e}", exc_info=True)
             await processing_msg.edit_text(f"❌ Error processing image: {str(e)}")
             
             # Cleanup
-            if user_id in self.user_states:
-                del self.user_states[user_id]
+            self._clear_state(user_id)
+    
+    async def _upscale_and_reply(self, update: Update, processing_msg, telegram_file):
+        """Download an image, run it through the inference queue and send the result"""
+        user_id = update.effective_user.id
+        
+        # Download to memory
+        bio = BytesIO()
+        await telegram_file.download_to_memory(bio)
+        bio.seek(0)
+        
+        # Decode straight to BGR (the model's and the encoder's channel order)
+        img_cv2 = decode_image(bio)
+        del bio
+        
+        name = generate_unique_filename('png')
+        logger.info(f"Processing image for user {user_id}: {name}")
+        
+        # Re-sent images are served from the result cache (lossless PNG entries)
+        scale, fast = self.user_scales.get(user_id, (None, False))
+        model = select_model(scale, self.user_models.get(user_id))
+        cache_key, cached = self.service.lookup(img_cv2, 'png', Config.ENCODE_PROFILE, model, scale, fast)
+        state = {'cache_key': cache_key, 'name': name}
+        if cached is not None:
+            logger.info(f"Result cache hit for user {user_id}: {name}")
+            self.pixel_store.discard(user_id)  # Decoded lazily if a preset is requested
+            output, extension = await asyncio.to_thread(self._encode_reply, lossless=cached)
+        else:
+            # Upscale on the inference workers; raises QueueFullError when saturated
+            future = self.service.submit(user_id, img_cv2, model, scale, fast)
+            del img_cv2
+            upscaled = await self._wait_for_job(future, processing_msg)
+            
+            # Lossless encoding: the cache entry, and sent as-is if small enough
+            encoded, cached = await asyncio.to_thread(
+                self.service.encode_result, cache_key, upscaled, 'png', Config.ENCODE_PROFILE
+            )
+            encoded = encoded.data
+            
+            # Keep the pixels so color grading never re-decodes the image (mmap mode writes a file)
+            stored = await asyncio.to_thread(self.pixel_store.put, user_id, upscaled)
+            if not (stored or cached):
+                # Nothing else keeps this image for color grading: persist it
+                state['upscaled_path'] = Config.TEMP_DIR / f"upscaled_{name}"
+                await asyncio.to_thread(state['upscaled_path'].write_bytes, encoded)
+            
+            output, extension = await asyncio.to_thread(self._encode_reply, upscaled, encoded)
+        
+        # Store state for possible color grading (replacing any previous image)
+        self._clear_state(user_id, keep_pixels=True)
+        self.user_states[user_id] = state
+        
+        # Send result
+        await processing_msg.edit_text("✨ Upscaling complete! Sending image...")
+        
+        factor = f"{scale:g}" if scale else network_scale(model)
+        
+        # Check size and decide if sending as photo or document
+        if output.getbuffer().nbytes <= PHOTO_MAX_BYTES and extension in PHOTO_EXTENSIONS:
+            await update.message.reply_photo(
+                photo=output,
+                filename=f"upscaled_{Path(name).stem}{extension}",
+                caption=(
+                    f"✅ Image upscaled {factor}× successfully!\n\n"
+                    "💡 Want to apply color grading? Reply with a preset name.\n"
+                    "Use /presets to see available options, or send another image."
+                )
+            )
+        else:
+            # File too large for photo, send as document
+            await update.message.reply_document(
+                document=output,
+                filename=f"upscaled_{Path(name).stem}{extension}",
+                caption=(
+                    f"✅ Image upscaled {factor}× successfully!\n\n"
+                    "⚠️ Image sent as file (over 10MB or not a photo format)\n\n"
+                    "💡 Want to apply color grading? Reply with a preset name.\n"
+                    "Use /presets to see available options, or send another image."
+                )
+            )
+        
+        # Delete processing message
+        await processing_msg.delete()
+    
+    def _encode_reply(self, img=None, lossless=None):
+        """
+        Encode an image for sending, in Config.OUTPUT_FORMAT if it fits Telegram's limits
+        
+        Args:
+            img: numpy array in BGR format (decoded from lossless if omitted)
+            lossless: Existing PNG encoding of the image
+        
+        Returns:
+            Tuple of (BytesIO, file extension)
+        """
+        if Config.OUTPUT_FORMAT != 'png':
+            if img is None:
+                img = cv2.imdecode(np.frombuffer(lossless, dtype=np.uint8), cv2.IMREAD_COLOR)
+            encoded = encode_image(img, Config.OUTPUT_FORMAT, Config.ENCODE_PROFILE)
+            if encoded.size <= 9.5 * 1024 * 1024:
+                return BytesIO(encoded.data), encoded.extension
+        return encode_for_telegram(img, lossless)
+    
+    def _clear_state(self, user_id, keep_pixels=False):
+        """Forget a user's pending image and delete its temp file, if any"""
+        state = self.user_states.pop(user_id, None)
+        if not keep_pixels:
+            self.pixel_store.discard(user_id)
+        if state is None or 'upscaled_path' not in state:
+            return
+        try:
+            state['upscaled_path'].unlink()
+        except OSError:
+            pass
+    
+    def _load_upscaled(self, user_id, state):
+        """
+        Decoded upscaled image for color grading
+        
+        Tries the pixel store, then the result cache, then the temp file.
+        
+        Returns:
+            numpy array in BGR format, or None if the image is gone
+        """
+        img_cv2 = self.pixel_store.get(user_id)
+        if img_cv2 is not None:
+            return img_cv2
+        
+        encoded = self.result_cache.get(state['cache_key'])
+        if encoded is None and 'upscaled_path' in state:
+            try:
+                encoded = state['upscaled_path'].read_bytes()
+            except OSError:
+                pass
+        if encoded is None:
+            return None
+        
+        img_cv2 = cv2.imdecode(np.frombuffer(encoded, dtype=np.uint8), cv2.IMREAD_COLOR)
+        self.pixel_store.put(user_id, img_cv2)
+        return img_cv2
+    
+    async def _wait_for_job(self, future, processing_msg):
+        """Await an inference job, keeping the user informed of its queue position"""
+        wrapped = asyncio.wrap_future(future)
+        last_position = None
+        
+        while True:
+            position = self.scheduler.position(future)
+            if position != last_position:
+                if position > 0:
+                    await processing_msg.edit_text(
+                        f"⏳ Waiting in queue... position {position}.\n"
+                        "Your image will be upscaled as soon as a worker is free."
+                    )
+                else:
+                    await processing_msg.edit_text("🚀 Upscaling image with AI...")
+                last_position = position
+            
+            try:
+                return await asyncio.wait_for(asyncio.shield(wrapped), timeout=QUEUE_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                continue
     
     @restricted
     async def handle_text(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -427,63 +552,59 @@ class ImageBot:
         
         preset_name = update.message.text.strip().lower()
         state = self.user_states[user_id]
-        upscaled_path = state['upscaled_path']
         
         # Notify user
         processing_msg = await update.message.reply_text(f"🎨 Applying '{preset_name}' preset...")
         
         try:
-            # Load upscaled image
-            img = Image.open(upscaled_path)
-            img_cv2 = pil_to_cv2(img)
-            
-            # Apply color grading
-            graded = ColorGrading.apply_preset(img_cv2, preset_name)
+            # Reuse the decoded upscaled image; decode the cached encoding only if it was evicted
+            img_cv2 = await asyncio.to_thread(self._load_upscaled, user_id, state)
+            if img_cv2 is None:
+                self._clear_state(user_id)
+                await processing_msg.edit_text(
+                    "⌛ The upscaled image has expired.\n"
+                    "Please send it again to apply a preset."
+                )
+                return
             
-            # Save result
-            output_filename = f"graded_{preset_name}_{upscaled_path.name}"
-            output_path = Config.TEMP_DIR / output_filename
-            save_cv2_image(graded, output_path, quality=95)
+            # Apply color grading off the event loop
+            graded = await asyncio.to_thread(
+                ColorGrading.apply_preset, img_cv2, preset_name,
+                Config.GRADING_BAND_ROWS, Config.GRADING_WORKERS
+            )
             
-            # Compress if needed
-            output_path = compress_for_telegram(output_path)
+            # Encode within Telegram's limits, in memory
+            output, extension = await asyncio.to_thread(self._encode_reply, graded)
             
             # Send result
             await processing_msg.edit_text("✨ Color grading complete! Sending image...")
             
-            # Check file size and decide if sending as photo or document
-            file_size = os.path.getsize(output_path)
-            
-            with open(output_path, 'rb') as f:
-                if file_size <= 10 * 1024 * 1024:  # 10MB limit for photos
-                    await update.message.reply_photo(
-                        photo=f,
-                        caption=f"✅ Applied '{preset_name}' preset successfully!"
+            # Check size and decide if sending as photo or document
+            output_filename = f"graded_{preset_name}_{Path(state['name']).stem}{extension}"
+            if output.getbuffer().nbytes <= PHOTO_MAX_BYTES and extension in PHOTO_EXTENSIONS:
+                await update.message.reply_photo(
+                    photo=output,
+                    filename=output_filename,
+                    caption=(
+                        f"✅ Applied '{preset_name}' preset successfully!\n\n"
+                        "💡 Reply with another preset to try it on the same image."
                     )
-                else:
-                    # File too large for photo, send as document
-                    await update.message.reply_document(
-                        document=f,
-                        caption=(
-                            f"✅ Applied '{preset_name}' preset successfully!\n\n"
-                            "⚠️ Image sent as file due to size (>10MB)"
-                        )
+                )
+            else:
+                # File too large for photo, send as document
+                await update.message.reply_document(
+                    document=output,
+                    filename=output_filename,
+                    caption=(
+                        f"✅ Applied '{preset_name}' preset successfully!\n\n"
+                        "⚠️ Image sent as file (over 10MB or not a photo format)\n\n"
+                        "💡 Reply with another preset to try it on the same image."
                     )
+                )
             
             # Delete processing message
             await processing_msg.delete()
             
-            # Cleanup temp files
-            try:
-                upscaled_path.unlink()
-                output_path.unlink()
-                state['input_path'].unlink()
-            except:
-                pass
-            
-            # Clear state
-            del self.user_states[user_id]
-            
             logger.info(f"Applied preset '{preset_name}' for user {user_id}")
             
         except ValueError as e:
@@ -507,7 +628,10 @@ class ImageBot:
     def run(self):
         """Start the bot"""
         logger.info("Starting bot...")
-        self.application.run_polling(allowed_updates=Update.ALL_TYPES)
+        try:
+            self.application.run_polling(allowed_updates=Update.ALL_TYPES)
+        finally:
+            self.service.shutdown(wait=False)
         logger.info("Bot stopped.")
 
 
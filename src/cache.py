@@ -0,0 +1,168 @@
+"""
+Content-addressed on-disk cache for upscale results
+"""
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+from .config import Config
+
+logger = logging.getLogger(__name__)
+
+
+def result_key(img, **options):
+    """
+    Cache key for upscaling an image with the current model settings
+
+    Args:
+        img: Decoded input image (numpy array, BGR format)
+        **options: Per-request settings that change the output
+
+    Returns:
+        Hex digest identifying the input pixels and everything that affects the output
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    settings = (
+        Config.MODEL_NAME,
+        Config.TILE_SIZE,
+        Config.TILE_AUTOTUNE,
+        Config.TILE_BLEND,
+        Config.TILE_DEDUP and Config.TILE_FLAT_TOLERANCE,
+        Config.TILE_PAD,
+        Config.PRE_PAD,
+        Config.USE_FP16,
+        Config.CPU_PRECISION,
+        Config.MODEL_BACKEND,
+        sorted(options.items()),
+    )
+    digest.update(repr(settings).encode())
+    digest.update(repr((img.shape, img.dtype.str)).encode())
+    digest.update(np.ascontiguousarray(img))
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    Size-bounded LRU cache of encoded outputs, one file per entry
+
+    Recency survives restarts through file modification times, which are
+    refreshed on every hit.
+    """
+
+    SUFFIX = '.png'
+
+    def __init__(self, directory=None, max_bytes=None):
+        """
+        Args:
+            directory: Where entries are stored (default Config.CACHE_DIR)
+            max_bytes: Total size limit (default Config.CACHE_MAX_MB); 0 disables the cache
+        """
+        self.directory = Path(directory or Config.CACHE_DIR)
+        self.max_bytes = Config.CACHE_MAX_MB * 1024 * 1024 if max_bytes is None else max_bytes
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> size, least recently used first
+        self._total_bytes = 0
+
+        if self.enabled:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self._load_index()
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def _path(self, key):
+        return self.directory / f"{key}{self.SUFFIX}"
+
+    def _load_index(self):
+        """Rebuild the LRU order from the files on disk"""
+        files = []
+        for path in self.directory.glob(f"*{self.SUFFIX}"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            files.append((stat.st_mtime, path.stem, stat.st_size))
+        for _, key, size in sorted(files):
+            self._entries[key] = size
+            self._total_bytes += size
+        self._evict()
+        logger.info(f"Result cache: {len(self._entries)} entries, {self._total_bytes / (1024 * 1024):.1f} MB")
+
+    def get(self, key):
+        """
+        Look up an entry
+
+        Returns:
+            Encoded bytes, or None on a miss
+        """
+        if not self.enabled:
+            return None
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            path = self._path(key)
+            try:
+                data = path.read_bytes()
+                os.utime(path)
+            except OSError:
+                # Removed behind our back
+                self._total_bytes -= self._entries.pop(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def put(self, key, data):
+        """
+        Store encoded bytes under a key, evicting old entries if needed
+
+        Returns:
+            True if the entry was written
+        """
+        if not self.enabled or len(data) > self.max_bytes:
+            return False
+        path = self._path(key)
+        tmp_path = path.with_name(f"{path.name}.{threading.get_ident()}.tmp")
+        with self._lock:
+            try:
+                tmp_path.write_bytes(data)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                logger.warning(f"Could not write cache entry {key}: {e}")
+                tmp_path.unlink(missing_ok=True)
+                return False
+            if key in self._entries:
+                self._total_bytes -= self._entries.pop(key)
+            self._entries[key] = len(data)
+            self._total_bytes += len(data)
+            self._evict()
+        return True
+
+    def _evict(self):
+        """Drop least recently used entries until under the size limit (lock held)"""
+        while self._total_bytes > self.max_bytes and self._entries:
+            key, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            self._path(key).unlink(missing_ok=True)
+
+    def stats(self):
+        """Snapshot of cache usage"""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._total_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
@@ -3,7 +3,9 @@ Color grading and stylization module
 """
 import cv2
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
+from functools import lru_cache
 
 
 class ColorMapStyle(Enum):
@@ -130,6 +132,15 @@ class ColorGrading:
         if temperature == 0:
             return img
         
+        # 8-bit images: one table lookup per channel instead of float math
+        if img.dtype == np.uint8:
+            return cv2.LUT(img, ColorGrading.point_lut('adjust_temperature', temperature=temperature))
+        
+        return ColorGrading._temperature_float(img, temperature)
+    
+    @staticmethod
+    def _temperature_float(img, temperature):
+        """Temperature math on float32 (defines the lookup table values)"""
         # Create adjustment matrix
         adjusted = img.copy().astype(np.float32)
         
@@ -145,6 +156,29 @@ class ColorGrading:
         adjusted = np.clip(adjusted, 0, 255).astype(np.uint8)
         return adjusted
     
+    @staticmethod
+    def point_lut(op, **params):
+        """
+        Lookup table for a per-channel point operation
+        
+        Tables are computed once per parameter set and shared (read-only).
+        
+        Args:
+            op: 'adjust_brightness_contrast' or 'adjust_temperature'
+            **params: The operation's keyword arguments
+        
+        Returns:
+            uint8 array (256, 1, 3) usable with cv2.LUT on BGR images
+        """
+        return _point_table(op, tuple(sorted(params.items())))
+    
+    @staticmethod
+    def compose_luts(first, second):
+        """Table equivalent to applying first, then second"""
+        composed = cv2.LUT(first, second)
+        composed.setflags(write=False)
+        return composed
+    
     @staticmethod
     def apply_vignette(img, strength=0.5):
         """
@@ -163,13 +197,7 @@ class ColorGrading:
         rows, cols = img.shape[:2]
         
         # Create radial gradient mask
-        X_resultant_kernel = cv2.getGaussianKernel(cols, cols / 2)
-        Y_resultant_kernel = cv2.getGaussianKernel(rows, rows / 2)
-        kernel = Y_resultant_kernel * X_resultant_kernel.T
-        mask = kernel / kernel.max()
-        
-        # Apply strength
-        mask = np.power(mask, strength)
+        mask = ColorGrading._vignette_mask(rows, cols, strength)
         
         # Apply mask to each channel
         output = img.copy().astype(np.float32)
@@ -195,59 +223,293 @@ class ColorGrading:
             return img
         
         # Sharpening kernel
+        kernel = ColorGrading._sharpen_kernel(strength)
+        
+        sharpened = cv2.filter2D(img, -1, kernel)
+        return sharpened
+    
+    # Presets as declarative op lists: (operation, parameters), applied in order.
+    # Operation names are ColorGrading methods; compile_preset() fuses them.
+    PRESETS = {
+        'warm': [
+            ('adjust_brightness_contrast', {'brightness': 5, 'contrast': 10}),
+            ('adjust_temperature', {'temperature': 30}),
+        ],
+        'cool': [
+            ('adjust_brightness_contrast', {'brightness': -5, 'contrast': 10}),
+            ('adjust_temperature', {'temperature': -30}),
+        ],
+        'vibrant': [
+            ('adjust_brightness_contrast', {'contrast': 20}),
+            ('adjust_saturation', {'saturation': 30}),
+            ('sharpen', {'strength': 0.5}),
+        ],
+        'cinematic': [
+            ('adjust_brightness_contrast', {'brightness': -10, 'contrast': 15}),
+            ('apply_vignette', {'strength': 0.7}),
+        ],
+        'vintage': [
+            ('adjust_temperature', {'temperature': 20}),
+            ('adjust_saturation', {'saturation': -20}),
+        ],
+        'magma': [('apply_colormap', {'colormap_style': ColorMapStyle.MAGMA})],
+        'plasma': [('apply_colormap', {'colormap_style': ColorMapStyle.PLASMA})],
+        'viridis': [('apply_colormap', {'colormap_style': ColorMapStyle.VIRIDIS})],
+        'turbo': [('apply_colormap', {'colormap_style': ColorMapStyle.TURBO})],
+    }
+    
+    # Per-channel point operations: output channel value depends only on the
+    # same channel's input value, so any run of them collapses into one LUT
+    POINT_OPS = ('adjust_brightness_contrast', 'adjust_temperature')
+    
+    # Rows per chunk when an op needs a float temporary
+    CHUNK_ROWS = 256
+    
+    @staticmethod
+    def compile_preset(preset_name):
+        """
+        Compile a preset into fused operations
+        
+        Consecutive point operations are composed into a single 3×256 lookup
+        table and saturation becomes a lookup table on the S channel, so the
+        compiled pipeline is bit-exact with chaining the individual functions.
+        
+        Args:
+            preset_name: Name of preset
+        
+        Returns:
+            List of (kind, argument) tuples for run_pipeline()
+        """
+        preset_name = preset_name.lower()
+        if preset_name not in ColorGrading.PRESETS:
+            available = ', '.join(ColorGrading.PRESETS.keys())
+            raise ValueError(f"Unknown preset '{preset_name}'. Available: {available}")
+        
+        compiled = []
+        lut = None  # Composition of the pending point ops
+        for op, params in ColorGrading.PRESETS[preset_name]:
+            if op in ColorGrading.POINT_OPS:
+                table = ColorGrading.point_lut(op, **params)
+                lut = table if lut is None else ColorGrading.compose_luts(lut, table)
+                continue
+            if lut is not None:
+                compiled.append(('lut', lut))
+                lut = None
+            
+            if op == 'adjust_saturation':
+                if params['saturation'] != 0:
+                    compiled.append(('saturation', ColorGrading._saturation_table(params['saturation'])))
+            elif op == 'sharpen':
+                if params['strength'] > 0:
+                    compiled.append(('sharpen', ColorGrading._sharpen_kernel(params['strength'])))
+            elif op == 'apply_vignette':
+                if params['strength'] > 0:
+                    compiled.append(('vignette', params['strength']))
+            elif op == 'apply_colormap':
+                compiled.append(('colormap', params))
+            else:
+                raise ValueError(f"Unknown operation '{op}' in preset '{preset_name}'")
+        if lut is not None:
+            compiled.append(('lut', lut))
+        return compiled
+    
+    @staticmethod
+    def _saturation_table(saturation):
+        """S-channel table matching adjust_saturation's float32 math (H and V unchanged)"""
+        identity = np.arange(256, dtype=np.uint8)
+        s = np.clip(identity.astype(np.float32) * (1 + saturation / 100.0), 0, 255).astype(np.uint8)
+        return np.stack([identity, s, identity], axis=1).reshape(256, 1, 3)
+    
+    @staticmethod
+    def _sharpen_kernel(strength):
+        """3×3 sharpening kernel for a given strength"""
         kernel = np.array([[-1, -1, -1],
                           [-1,  9, -1],
                           [-1, -1, -1]]) * strength / 9.0
         kernel[1, 1] = kernel[1, 1] + (1 - strength)
-        
-        sharpened = cv2.filter2D(img, -1, kernel)
-        return sharpened
+        return kernel
     
     @staticmethod
-    def apply_preset(img, preset_name):
+    def _vignette_mask(rows, cols, strength):
+        """Float64 radial mask with strength applied"""
+        X_resultant_kernel = cv2.getGaussianKernel(cols, cols / 2)
+        Y_resultant_kernel = cv2.getGaussianKernel(rows, rows / 2)
+        kernel = Y_resultant_kernel * X_resultant_kernel.T
+        mask = kernel / kernel.max()
+        return np.power(mask, strength)
+    
+    @staticmethod
+    def run_pipeline(img, compiled, band_rows=0, workers=1):
         """
-        Apply predefined color grading preset
+        Execute compiled operations
+        
+        The first operation allocates the output; later ones work in place on
+        it where OpenCV allows, and float math is done in row chunks, so no
+        full-size float copy of the image is ever made.
+        
+        In striped mode the image is processed in horizontal bands of
+        band_rows rows (plus one halo row per sharpen on each side), so the
+        extra memory beyond the output is bounded by the band size. With
+        workers > 1 the bands are graded concurrently on a thread pool
+        (OpenCV and numpy release the GIL). Either way the result is
+        identical to the unstriped pipeline.
         
         Args:
-            img: Input image (BGR format)
-            preset_name: Name of preset ('warm', 'cool', 'vibrant', 'cinematic', etc.)
+            img: Input image (BGR format, uint8); never modified
+            compiled: Output of compile_preset()
+            band_rows: Rows per band (0 = whole image, or one band per worker)
+            workers: Number of threads grading bands in parallel
         
         Returns:
             Styled image
         """
-        presets = {
-            'warm': lambda x: ColorGrading.adjust_temperature(
-                ColorGrading.adjust_brightness_contrast(x, brightness=5, contrast=10),
-                temperature=30
-            ),
-            'cool': lambda x: ColorGrading.adjust_temperature(
-                ColorGrading.adjust_brightness_contrast(x, brightness=-5, contrast=10),
-                temperature=-30
-            ),
-            'vibrant': lambda x: ColorGrading.sharpen(
-                ColorGrading.adjust_saturation(
-                    ColorGrading.adjust_brightness_contrast(x, contrast=20),
-                    saturation=30
-                ),
-                strength=0.5
-            ),
-            'cinematic': lambda x: ColorGrading.apply_vignette(
-                ColorGrading.adjust_brightness_contrast(x, brightness=-10, contrast=15),
-                strength=0.7
-            ),
-            'vintage': lambda x: ColorGrading.adjust_saturation(
-                ColorGrading.adjust_temperature(x, temperature=20),
-                saturation=-20
-            ),
-            'magma': lambda x: ColorGrading.apply_colormap(x, ColorMapStyle.MAGMA),
-            'plasma': lambda x: ColorGrading.apply_colormap(x, ColorMapStyle.PLASMA),
-            'viridis': lambda x: ColorGrading.apply_colormap(x, ColorMapStyle.VIRIDIS),
-            'turbo': lambda x: ColorGrading.apply_colormap(x, ColorMapStyle.TURBO),
-        }
+        rows = img.shape[0]
+        if workers > 1 and band_rows <= 0:
+            band_rows = -(-rows // workers)
+        if band_rows <= 0 or band_rows >= rows:
+            return ColorGrading._run_ops(img, compiled, 0, img.shape)
+        
+        out = np.empty_like(img)
+        bands = [(y0, min(y0 + band_rows, rows)) for y0 in range(0, rows, band_rows)]
+        if workers > 1:
+            pool = _band_pool(workers)
+            # list() waits for every band and re-raises the first error
+            list(pool.map(lambda band: ColorGrading._run_band(img, compiled, out, *band), bands))
+        else:
+            for y0, y1 in bands:
+                ColorGrading._run_band(img, compiled, out, y0, y1)
+        return out
+    
+    @staticmethod
+    def _run_band(img, compiled, out, y0, y1):
+        """Grade rows [y0, y1) of img into the same rows of out"""
+        halo = sum(1 for kind, _ in compiled if kind == 'sharpen')
+        if halo == 0:
+            # Bands are independent: write straight into the output rows
+            ColorGrading._run_ops(img[y0:y1], compiled, y0, img.shape, dst=out[y0:y1])
+            return
+        top, bottom = max(0, y0 - halo), min(img.shape[0], y1 + halo)
+        band = ColorGrading._run_ops(img[top:bottom], compiled, top, img.shape)
+        out[y0:y1] = band[y0 - top:y1 - top]
+    
+    @staticmethod
+    def _run_ops(img, compiled, row_offset, full_shape, dst=None):
+        """
+        Execute compiled operations on an image or a band of rows
         
+        Args:
+            img: Rows to process
+            compiled: Output of compile_preset()
+            row_offset: Index of img's first row in the full image
+            full_shape: Shape of the full image (for position-dependent ops)
+            dst: Optional array (same shape as img) that receives the result
+        """
+        target = dst
+        out = img
+        owned = False  # Whether out is ours to modify in place
+        for kind, arg in compiled:
+            dst = out if owned else target
+            if kind == 'lut':
+                out = cv2.LUT(out, arg, dst=dst)
+            elif kind == 'saturation':
+                hsv = cv2.cvtColor(out, cv2.COLOR_BGR2HSV)
+                cv2.LUT(hsv, arg, dst=hsv)
+                out = cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR, dst=dst)
+                del hsv
+            elif kind == 'sharpen':
+                out = cv2.filter2D(out, -1, arg)
+            elif kind == 'vignette':
+                out = ColorGrading._vignette_into(out, arg, dst, row_offset, full_shape)
+            elif kind == 'colormap':
+                out = ColorGrading.apply_colormap(out, **arg)
+            owned = out is not img
+        if target is None:
+            return out if owned else img.copy()
+        if out is not target:
+            target[...] = out
+        return target
+    
+    @staticmethod
+    def _vignette_into(img, strength, dst=None, row_offset=0, full_shape=None):
+        """
+        apply_vignette() on a band of rows, computed in row chunks
+        
+        Mask rows come from the separable 1-D Gaussian kernels of the full
+        image, so no full-size mask is built. The maximum of the outer product
+        equals the product of the maxima (all entries are positive and float
+        rounding is monotonic), which keeps the mask bit-identical.
+        """
+        full_rows, full_cols = (full_shape or img.shape)[:2]
+        y_kernel = cv2.getGaussianKernel(full_rows, full_rows / 2)
+        x_kernel = cv2.getGaussianKernel(full_cols, full_cols / 2).T
+        kernel_max = y_kernel.max() * x_kernel.max()
+        
+        if dst is None:
+            dst = np.empty_like(img)
+        rows = img.shape[0]
+        for y in range(0, rows, ColorGrading.CHUNK_ROWS):
+            y1 = min(y + ColorGrading.CHUNK_ROWS, rows)
+            mask = y_kernel[row_offset + y:row_offset + y1] * x_kernel
+            mask = np.power(mask / kernel_max, strength)
+            # Same rounding as the reference: float64 product stored as float32, then truncated
+            chunk = img[y:y1] * mask[:, :, None]
+            dst[y:y1] = np.clip(chunk.astype(np.float32), 0, 255).astype(np.uint8)
+        return dst
+    
+    @staticmethod
+    def apply_preset_reference(img, preset_name):
+        """
+        Apply a preset by chaining the individual functions (unfused)
+        
+        Slower than apply_preset(); kept as the reference its output is checked against.
+        """
         preset_name = preset_name.lower()
-        if preset_name not in presets:
-            available = ', '.join(presets.keys())
+        if preset_name not in ColorGrading.PRESETS:
+            available = ', '.join(ColorGrading.PRESETS.keys())
             raise ValueError(f"Unknown preset '{preset_name}'. Available: {available}")
         
-        return presets[preset_name](img)
+        for op, params in ColorGrading.PRESETS[preset_name]:
+            img = getattr(ColorGrading, op)(img, **params)
+        return img
+    
+    @staticmethod
+    def apply_preset(img, preset_name, band_rows=0, workers=1):
+        """
+        Apply predefined color grading preset
+        
+        Args:
+            img: Input image (BGR format)
+            preset_name: Name of preset ('warm', 'cool', 'vibrant', 'cinematic', etc.)
+            band_rows: Process in horizontal bands of this many rows (0 = off)
+            workers: Threads grading bands in parallel (1 = sequential)
+        
+        Returns:
+            Styled image
+        """
+        return ColorGrading.run_pipeline(img, ColorGrading.compile_preset(preset_name), band_rows, workers)
+
+
+@lru_cache(maxsize=256)
+def _point_table(op, params):
+    """Build (and memoize) the lookup table for ColorGrading.point_lut()"""
+    params = dict(params)
+    ramp = np.repeat(np.arange(256, dtype=np.uint8).reshape(256, 1, 1), 3, axis=2)
+    
+    if op == 'adjust_brightness_contrast':
+        # adjust_brightness_contrast itself keeps convertScaleAbs (SIMD, faster
+        # than cv2.LUT for a single op); the table pays off once composed
+        table = ColorGrading.adjust_brightness_contrast(ramp, **params)
+    elif op == 'adjust_temperature':
+        table = ColorGrading._temperature_float(ramp, **params)
+    else:
+        raise ValueError(f"'{op}' is not a point operation")
+    
+    table = np.ascontiguousarray(table)
+    table.setflags(write=False)
+    return table
+
+
+@lru_cache(maxsize=None)
+def _band_pool(workers):
+    """Thread pool shared by all parallel run_pipeline() calls with this worker count"""
+    return ThreadPoolExecutor(max_workers=workers, thread_name_prefix='grading')
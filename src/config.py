@@ -21,15 +21,84 @@ class Config:
     TILE_SIZE = int(os.getenv('TILE_SIZE', '1024'))
     TILE_PAD = int(os.getenv('TILE_PAD', '64'))
     PRE_PAD = int(os.getenv('PRE_PAD', '10'))
+    TILE_BATCH_SIZE = int(os.getenv('TILE_BATCH_SIZE', '4'))
+    
+    # Tile size auto-tuning: measured once per model and machine (profile kept in WEIGHTS_DIR),
+    # then chosen per image instead of TILE_SIZE. Candidates are tried until memory runs short.
+    TILE_AUTOTUNE = os.getenv('TILE_AUTOTUNE', 'false').lower() == 'true'
+    TILE_CANDIDATES = [int(size) for size in os.getenv('TILE_CANDIDATES', '128,192,256,384,512,768,1024').split(',') if size.strip()]
+    TILE_MEMORY_FRACTION = float(os.getenv('TILE_MEMORY_FRACTION', '0.5'))
+    # Cross-fade tile seams over this many input pixels each side (0 = hard seams, like RealESRGANer)
+    TILE_BLEND = int(os.getenv('TILE_BLEND', '0'))
+    
+    # Reuse tiles: identical tiles are computed once and kept in an LRU cache of this size across
+    # requests; tiles whose channels vary by at most TILE_FLAT_TOLERANCE levels are interpolated
+    # instead (-1 = never)
+    TILE_DEDUP = os.getenv('TILE_DEDUP', 'false').lower() == 'true'
+    TILE_CACHE_MB = int(os.getenv('TILE_CACHE_MB', '64'))
+    TILE_FLAT_TOLERANCE = int(os.getenv('TILE_FLAT_TOLERANCE', '-1'))
+    
+    # Upscaled images larger than this are assembled in a memory-mapped file in TEMP_DIR (0 = in RAM)
+    OUTPUT_MMAP_MB = int(os.getenv('OUTPUT_MMAP_MB', '0'))
+    
+    # Models loaded on demand per inference worker: at most this many, within this much weight memory
+    MAX_LOADED_MODELS = int(os.getenv('MAX_LOADED_MODELS', '2'))
+    MODELS_MAX_MB = int(os.getenv('MODELS_MAX_MB', '1024'))
     
     # Processing options
     USE_FP16 = os.getenv('USE_FP16', 'true').lower() == 'true'
     USE_GPU = os.getenv('USE_GPU', 'true').lower() == 'true'
     
+    # CPU tile sharding (0 workers = disabled, tiles run in-process)
+    CPU_WORKERS = int(os.getenv('CPU_WORKERS', '0'))
+    CPU_THREADS_PER_WORKER = int(os.getenv('CPU_THREADS_PER_WORKER', '1'))
+    
+    # CPU inference precision: fp32, bf16 (autocast, needs native bfloat16) or int8 (static
+    # quantization, calibrated at load on CALIBRATION_TILES crops of the images in CALIBRATION_DIR)
+    CPU_PRECISION = os.getenv('CPU_PRECISION', 'fp32').lower()
+    CALIBRATION_TILES = int(os.getenv('CALIBRATION_TILES', '8'))
+    
+    # CPU inference backend: pytorch (eager, from the .pth), torchscript (frozen export) or
+    # onnxruntime (ONNX export on ONNX Runtime). Exports are saved beside the weights on first load,
+    # or ahead of time with `python -m src.export --format all`
+    MODEL_BACKEND = os.getenv('MODEL_BACKEND', 'pytorch').lower()
+    
+    # Inference queue
+    INFERENCE_WORKERS = int(os.getenv('INFERENCE_WORKERS', '1'))
+    MAX_QUEUE_SIZE = int(os.getenv('MAX_QUEUE_SIZE', '8'))
+    MAX_JOBS_PER_USER = int(os.getenv('MAX_JOBS_PER_USER', '2'))
+    BATCH_IMAGES = int(os.getenv('BATCH_IMAGES', '1'))
+    
+    # HTTP job API: max queued + running jobs, and how long / how much finished results are kept
+    JOBS_MAX_IN_FLIGHT = int(os.getenv('JOBS_MAX_IN_FLIGHT', '16'))
+    JOB_RESULT_TTL = int(os.getenv('JOB_RESULT_TTL', '600'))
+    JOB_RESULTS_MAX_MB = int(os.getenv('JOB_RESULTS_MAX_MB', '512'))
+    JOB_WEBHOOKS = os.getenv('JOB_WEBHOOKS', 'false').lower() == 'true'
+    JOB_ENCODE_WORKERS = int(os.getenv('JOB_ENCODE_WORKERS', '1'))
+    
     # Paths
     BASE_DIR = Path(__file__).parent.parent
     WEIGHTS_DIR = BASE_DIR / os.getenv('WEIGHTS_DIR', 'weights')
     TEMP_DIR = BASE_DIR / os.getenv('TEMP_DIR', 'temp')
+    CACHE_DIR = BASE_DIR / os.getenv('CACHE_DIR', 'temp/cache')
+    CALIBRATION_DIR = BASE_DIR / os.getenv('CALIBRATION_DIR') if os.getenv('CALIBRATION_DIR') else None
+    
+    # Result cache size limit (0 = disabled)
+    CACHE_MAX_MB = int(os.getenv('CACHE_MAX_MB', '1024'))
+    
+    # Decoded images kept for color grading
+    PIXEL_STORE_MAX_MB = int(os.getenv('PIXEL_STORE_MAX_MB', '1024'))
+    PIXEL_STORE_TTL = int(os.getenv('PIXEL_STORE_TTL', '1800'))
+    PIXEL_STORE_MMAP = os.getenv('PIXEL_STORE_MMAP', 'false').lower() == 'true'
+    
+    # Color grading works in horizontal bands of this many rows (0 = whole image)
+    GRADING_BAND_ROWS = int(os.getenv('GRADING_BAND_ROWS', '1024'))
+    # Threads grading bands in parallel (1 = sequential)
+    GRADING_WORKERS = int(os.getenv('GRADING_WORKERS', '1'))
+    
+    # Output encoding: default format (png, jpeg, webp, avif) and profile (fast or small)
+    OUTPUT_FORMAT = os.getenv('OUTPUT_FORMAT', 'png').lower()
+    ENCODE_PROFILE = os.getenv('ENCODE_PROFILE', 'fast').lower()
     
     # Model paths
     MODEL_PATHS = {
@@ -38,10 +107,17 @@ class Config:
         'RealESRGAN_x2plus': 'RealESRGAN_x2plus.pth',
     }
     
+    # Short names accepted for per-request model choice
+    MODEL_ALIASES = {
+        'x4plus': 'RealESRGAN_x4plus',
+        'anime': 'RealESRGAN_x4plus_anime_6B',
+        'x2plus': 'RealESRGAN_x2plus',
+    }
+    
     @classmethod
-    def get_model_path(cls):
-        """Get full path to model weights"""
-        model_file = cls.MODEL_PATHS.get(cls.MODEL_NAME, 'RealESRGAN_x4plus.pth')
+    def get_model_path(cls, model_name=None):
+        """Get full path to model weights (default: MODEL_NAME)"""
+        model_file = cls.MODEL_PATHS.get(model_name or cls.MODEL_NAME, 'RealESRGAN_x4plus.pth')
         return cls.WEIGHTS_DIR / model_file
     
     @classmethod
@@ -0,0 +1,133 @@
+"""
+Process-pool tile sharding for CPU-only super-resolution
+
+RealESRGANer runs tiles one after another in a single process. On CPU hosts
+this module spreads the tiles of one image over several worker processes,
+each holding its own copy of the network with a fixed torch thread count.
+"""
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import torch
+
+from .tiling import OutputCanvas, allocate_output, network_input, pad_input, tile_grid, to_output_tile
+
+logger = logging.getLogger(__name__)
+
+# Smallest tile the pool will shrink to when looking for parallelism
+MIN_TILE_SIZE = 128
+
+# Network owned by the current worker process, and the dtype it runs under autocast (or None)
+_worker_model = None
+_worker_autocast = None
+
+
+def _init_worker(model_name, model_path, num_threads, precision='fp32', backend='pytorch'):
+    """Load the network once per worker process (calibrated the same way in every worker for int8)"""
+    global _worker_model, _worker_autocast
+    from .utils import patch_torchvision_compat
+    patch_torchvision_compat()
+
+    torch.set_num_threads(num_threads)
+
+    if backend != 'pytorch':
+        # Exported by the parent before the pool starts
+        from .backends import create_backend
+        _worker_model = create_backend(backend, model_name, Path(model_path), torch.device('cpu'), num_threads).network
+        return
+
+    from .precision import apply_precision
+    from .super_resolution import load_network
+    model, _ = load_network(model_name, model_path)
+    _worker_model, _worker_autocast = apply_precision(model, precision)
+
+
+def _run_tile(tile_input, crop_box, scale, color_order):
+    """Upscale one padded tile and return its core area as uint8 in color_order"""
+    with torch.no_grad(), torch.autocast('cpu', dtype=_worker_autocast, enabled=_worker_autocast is not None):
+        output = _worker_model(torch.from_numpy(tile_input).unsqueeze(0))
+    return to_output_tile(output[0].float().numpy(), crop_box, scale, color_order)
+
+
+class CPUTilePool:
+    """Upscale images by running their tiles across a pool of processes"""
+
+    def __init__(self, model_name, model_path, scale, num_workers, num_threads,
+                 tile_size, tile_pad, pre_pad, blend=0, precision='fp32',
+                 backend='pytorch'):
+        """
+        Args:
+            model_name: Config.MODEL_PATHS key (selects the architecture)
+            model_path: Path to the .pth weights
+            scale: Network scale
+            num_workers: Number of worker processes
+            num_threads: torch intra-op threads per worker
+            tile_size, tile_pad, pre_pad: Same meaning as for RealESRGANer
+            blend: Seam cross-fade half-width in input pixels (see tiling.OutputCanvas)
+            precision: Resolved CPU precision of the workers' networks (see precision.resolve_precision)
+            backend: Resolved backend name (see backends.resolve_backend)
+        """
+        self.scale = scale
+        self.num_workers = num_workers
+        self.tile_size = tile_size
+        self.tile_pad = tile_pad
+        self.pre_pad = pre_pad
+        self.blend = blend
+
+        # spawn, not fork: a forked child deadlocks in OpenMP once the parent
+        # has run any parallel torch op
+        self.executor = ProcessPoolExecutor(
+            max_workers=num_workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(model_name, str(model_path), num_threads, precision, backend)
+        )
+        logger.info(f"CPU tile pool: {num_workers} workers × {num_threads} threads")
+
+    def _tile_size_for(self, height, width):
+        """Configured tile size, shrunk until every worker has a tile"""
+        tile_size = self.tile_size if self.tile_size > 0 else max(height, width)
+        while (tile_size // 2 >= MIN_TILE_SIZE
+               and len(tile_grid(height, width, tile_size, 0)) < self.num_workers):
+            tile_size //= 2
+        return tile_size
+
+    def upscale(self, img, color_order='bgr'):
+        """
+        Upscale a uint8 image
+
+        Args:
+            img: numpy array (H, W, 3)
+            color_order: Channel order of img and of the result, 'bgr' or 'rgb'
+
+        Returns:
+            Upscaled image as numpy array (same color order)
+        """
+        height, width = img.shape[:2]
+        padded = pad_input(img, self.pre_pad, self.scale)
+        tile_size = self._tile_size_for(*padded.shape[:2])
+        canvas = OutputCanvas(
+            allocate_output((height * self.scale, width * self.scale, 3)),
+            padded.shape[:2], tile_size, self.tile_pad, self.scale, self.blend
+        )
+
+        futures = [
+            (tile, self.executor.submit(
+                _run_tile,
+                network_input(padded[tile.pad_y0:tile.pad_y1, tile.pad_x0:tile.pad_x1], color_order),
+                canvas.source_box(tile),
+                self.scale,
+                color_order
+            ))
+            for tile in canvas.tiles
+        ]
+
+        for tile, future in futures:
+            canvas.paste(tile, future.result())
+        return canvas.array
+
+    def shutdown(self):
+        """Stop the worker processes"""
+        self.executor.shutdown(wait=True, cancel_futures=True)
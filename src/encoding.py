@@ -0,0 +1,270 @@
+"""
+Output format negotiation and image encoding profiles
+"""
+import logging
+import struct
+import threading
+import time
+import zlib
+from typing import NamedTuple
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class ImageFormat(NamedTuple):
+    """An output format and its encoder parameters per profile"""
+    mimetype: str
+    extension: str
+    profiles: dict
+
+
+def _avif_profiles():
+    """AVIF encoder parameters, or None if this OpenCV build cannot write AVIF"""
+    if not hasattr(cv2, 'IMWRITE_AVIF_QUALITY') or not cv2.haveImageWriter('.avif'):
+        return None
+    return {
+        'fast': [cv2.IMWRITE_AVIF_QUALITY, 80, cv2.IMWRITE_AVIF_SPEED, 10],
+        'small': [cv2.IMWRITE_AVIF_QUALITY, 70, cv2.IMWRITE_AVIF_SPEED, 6],
+    }
+
+
+# 'fast' favours encode time, 'small' favours payload size
+FORMATS = {
+    'png': ImageFormat('image/png', '.png', {
+        'fast': [cv2.IMWRITE_PNG_COMPRESSION, 1, cv2.IMWRITE_PNG_STRATEGY, cv2.IMWRITE_PNG_STRATEGY_RLE],
+        'small': [cv2.IMWRITE_PNG_COMPRESSION, 9],
+    }),
+    'jpeg': ImageFormat('image/jpeg', '.jpg', {
+        'fast': [cv2.IMWRITE_JPEG_QUALITY, 92],
+        'small': [cv2.IMWRITE_JPEG_QUALITY, 85, cv2.IMWRITE_JPEG_OPTIMIZE, 1, cv2.IMWRITE_JPEG_PROGRESSIVE, 1],
+    }),
+    'webp': ImageFormat('image/webp', '.webp', {
+        'fast': [cv2.IMWRITE_WEBP_QUALITY, 90],
+        'small': [cv2.IMWRITE_WEBP_QUALITY, 80],
+    }),
+}
+_avif = _avif_profiles()
+if _avif:
+    FORMATS['avif'] = ImageFormat('image/avif', '.avif', _avif)
+
+PROFILES = ('fast', 'small')
+
+# Accepted spellings in form fields
+_ALIASES = {'jpg': 'jpeg'}
+
+
+class EncodedImage(NamedTuple):
+    """Result of encode_image()"""
+    data: bytes
+    format: str
+    profile: str
+    seconds: float
+
+    @property
+    def mimetype(self):
+        return FORMATS[self.format].mimetype
+
+    @property
+    def extension(self):
+        return FORMATS[self.format].extension
+
+    @property
+    def size(self):
+        return len(self.data)
+
+
+def negotiate_format(requested=None, accept=None, default='png'):
+    """
+    Pick the output format for a request
+
+    An explicit format (form field) wins; otherwise the supported type with
+    the highest q-value in the Accept header is used, preferring the default
+    on ties and for wildcards.
+
+    Args:
+        requested: Format name ('png', 'jpeg'/'jpg', 'webp', 'avif'), or None
+        accept: HTTP Accept header value, or None
+        default: Format used when neither asks for anything specific
+
+    Returns:
+        Key of FORMATS
+
+    Raises:
+        ValueError: If the requested format is not supported
+    """
+    if requested:
+        name = _ALIASES.get(requested.strip().lower(), requested.strip().lower())
+        if name not in FORMATS:
+            raise ValueError(f"Unsupported format '{requested}'. Available: {', '.join(FORMATS)}")
+        return name
+
+    if not accept:
+        return default
+
+    by_mimetype = {fmt.mimetype: name for name, fmt in FORMATS.items()}
+    best, best_q = None, 0.0
+    for item in accept.split(','):
+        mimetype, _, params = item.strip().partition(';')
+        mimetype = mimetype.strip().lower()
+        q = 1.0
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if mimetype in ('*/*', 'image/*'):
+            name = default
+        else:
+            name = by_mimetype.get(mimetype)
+        if name is None or q <= 0:
+            continue
+        if q > best_q or (q == best_q and name == default):
+            best, best_q = name, q
+    return best or default
+
+
+def encode_image(img, fmt='png', profile='fast'):
+    """
+    Encode a BGR image in memory
+
+    Args:
+        img: numpy array in BGR format
+        fmt: Key of FORMATS
+        profile: 'fast' or 'small'
+
+    Returns:
+        EncodedImage (also recorded in encode_stats)
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unsupported format '{fmt}'. Available: {', '.join(FORMATS)}")
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown encode profile '{profile}'. Available: {', '.join(PROFILES)}")
+
+    image_format = FORMATS[fmt]
+    start = time.perf_counter()
+    success, buffer = cv2.imencode(image_format.extension, img, image_format.profiles[profile])
+    if not success:
+        raise ValueError(f"Could not encode image as {fmt}")
+    encoded = EncodedImage(buffer.tobytes(), fmt, profile, time.perf_counter() - start)
+
+    encode_stats.record(fmt, profile, encoded.size, encoded.seconds, img.shape[0] * img.shape[1])
+    logger.info(
+        f"Encoded {img.shape[1]}×{img.shape[0]} as {fmt}/{profile}: "
+        f"{encoded.size / (1024 * 1024):.2f} MB in {encoded.seconds * 1000:.0f} ms"
+    )
+    return encoded
+
+
+class PNGStreamEncoder:
+    """
+    Encode a PNG incrementally from bands of rows
+
+    Each band becomes one IDAT chunk (zlib-flushed, so it can be sent right
+    away), which lets a response start before the image is complete. Rows use
+    the Sub filter, computed with numpy.
+    """
+
+    SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+    # zlib (level, strategy) per profile
+    PROFILES = {
+        'fast': (1, zlib.Z_RLE),
+        'small': (9, zlib.Z_DEFAULT_STRATEGY),
+    }
+
+    def __init__(self, width, height, profile='fast'):
+        """
+        Args:
+            width, height: Image dimensions
+            profile: 'fast' or 'small'
+        """
+        if profile not in self.PROFILES:
+            raise ValueError(f"Unknown encode profile '{profile}'. Available: {', '.join(PROFILES)}")
+        self.width = width
+        self.height = height
+        self.profile = profile
+        self.rows_written = 0
+        self.bytes_written = 0
+        self.seconds = 0.0
+        level, strategy = self.PROFILES[profile]
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 15, 9, strategy)
+
+    def header(self):
+        """Signature and IHDR (8-bit RGB, no interlace)"""
+        ihdr = struct.pack('>IIBBBBB', self.width, self.height, 8, 2, 0, 0, 0)
+        return self._emit(self.SIGNATURE + self._chunk(b'IHDR', ihdr))
+
+    def encode_rows(self, band_bgr):
+        """
+        Compress the next band of rows
+
+        Args:
+            band_bgr: uint8 array (rows, width, 3) in BGR format
+
+        Returns:
+            IDAT chunk bytes (empty if the compressor produced nothing)
+        """
+        start = time.perf_counter()
+        rgb = band_bgr[:, :, ::-1].reshape(band_bgr.shape[0], -1)
+        filtered = np.empty((rgb.shape[0], rgb.shape[1] + 1), dtype=np.uint8)
+        filtered[:, 0] = 1  # Sub: each byte minus the byte one pixel to the left
+        filtered[:, 1:4] = rgb[:, :3]
+        np.subtract(rgb[:, 3:], rgb[:, :-3], out=filtered[:, 4:])
+        data = self._compressor.compress(filtered.tobytes())
+        data += self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        self.rows_written += band_bgr.shape[0]
+        self.seconds += time.perf_counter() - start
+        return self._emit(self._chunk(b'IDAT', data) if data else b'')
+
+    def finish(self):
+        """Final IDAT and IEND"""
+        if self.rows_written != self.height:
+            raise ValueError(f"PNG stream got {self.rows_written} rows, expected {self.height}")
+        data = self._compressor.flush()
+        return self._emit((self._chunk(b'IDAT', data) if data else b'') + self._chunk(b'IEND', b''))
+
+    def _emit(self, data):
+        self.bytes_written += len(data)
+        return data
+
+    @staticmethod
+    def _chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+
+class EncodeStats:
+    """Running totals of encode time and output size per format and profile"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals = {}  # (format, profile) -> [count, bytes, seconds, pixels]
+
+    def record(self, fmt, profile, size, seconds, pixels):
+        with self._lock:
+            totals = self._totals.setdefault((fmt, profile), [0, 0, 0.0, 0])
+            totals[0] += 1
+            totals[1] += size
+            totals[2] += seconds
+            totals[3] += pixels
+
+    def snapshot(self):
+        """Totals keyed by 'format/profile', with bits per pixel and throughput"""
+        with self._lock:
+            return {
+                f"{fmt}/{profile}": {
+                    'count': count,
+                    'bytes': size,
+                    'seconds': round(seconds, 3),
+                    'bits_per_pixel': round(size * 8 / pixels, 3) if pixels else None,
+                    'megapixels_per_second': round(pixels / seconds / 1e6, 1) if seconds else None,
+                }
+                for (fmt, profile), (count, size, seconds, pixels) in self._totals.items()
+            }
+
+
+encode_stats = EncodeStats()
@@ -0,0 +1,184 @@
+"""
+Ahead-of-time export of the upscaling networks (TorchScript and ONNX)
+
+Each model is traced once and saved beside its weights. TorchScript exports
+are frozen (weights become constants, so the JIT folds and fuses the ops
+around the convolutions it can); ONNX exports have dynamic batch and tile
+sizes for ONNX Runtime. Loading an artifact skips building RRDBNet and
+reading the .pth. Export every downloaded model with `python -m src.export`.
+"""
+import argparse
+import inspect
+import json
+import logging
+import warnings
+
+import torch
+
+from .config import Config
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = ('torchscript', 'onnx')
+
+EXPORT_SUFFIXES = {'torchscript': '.torchscript.pt', 'onnx': '.onnx'}
+
+# Side of the example input used for tracing (a multiple of 8 suits every network scale)
+TRACE_SIZE = 64
+
+# Operator set of ONNX exports (supported by ONNX Runtime 1.12+)
+ONNX_OPSET = 17
+
+
+def export_path(model_name, export_format='torchscript'):
+    """Exported artifact beside the model's weights"""
+    model_path = Config.get_model_path(model_name)
+    return model_path.with_name(model_path.stem + EXPORT_SUFFIXES[export_format])
+
+
+def source_stamp(model_path):
+    """What an artifact was built from: the weights file and the torch version"""
+    stat = model_path.stat()
+    return {'weights': model_path.name, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'torch': torch.__version__}
+
+
+def export_model(model_name, model_path=None):
+    """
+    Trace, freeze and save a model's network (float32, CPU)
+
+    Args:
+        model_name: Config.MODEL_PATHS key
+        model_path: Weights to export (default Config.get_model_path(model_name))
+
+    Returns:
+        Path of the saved artifact
+    """
+    from .super_resolution import load_network
+
+    model_path = model_path or Config.get_model_path(model_name)
+    model, _ = load_network(model_name, model_path)
+    example = torch.rand(1, 3, TRACE_SIZE, TRACE_SIZE)
+    with warnings.catch_warnings(), torch.no_grad():
+        warnings.simplefilter('ignore')  # Shape asserts fixed at trace time; TorchScript deprecations
+        traced = torch.jit.trace(model, example)
+        frozen = torch.jit.freeze(traced.eval())
+
+        path = export_path(model_name)
+        tmp = path.with_suffix('.tmp')
+        torch.jit.save(frozen, str(tmp), _extra_files={'source.json': json.dumps(source_stamp(model_path))})
+    tmp.replace(path)
+    return path
+
+
+def export_onnx(model_name, model_path=None):
+    """
+    Export a model's network to ONNX (float32, dynamic batch and tile size)
+
+    The source stamp is stored in the model's metadata ('source').
+
+    Args:
+        model_name: Config.MODEL_PATHS key
+        model_path: Weights to export (default Config.get_model_path(model_name))
+
+    Returns:
+        Path of the saved artifact
+    """
+    import onnx
+    from .super_resolution import load_network
+
+    model_path = model_path or Config.get_model_path(model_name)
+    model, _ = load_network(model_name, model_path)
+    example = torch.rand(1, 3, TRACE_SIZE, TRACE_SIZE)
+    # The TorchScript-based exporter handles the dynamic tile size without onnxscript
+    options = {'dynamo': False} if 'dynamo' in inspect.signature(torch.onnx.export).parameters else {}
+
+    path = export_path(model_name, 'onnx')
+    tmp = path.with_suffix('.tmp')
+    with warnings.catch_warnings(), torch.no_grad():
+        warnings.simplefilter('ignore')  # Shape asserts fixed at trace time; exporter deprecations
+        torch.onnx.export(
+            model, (example,), str(tmp),
+            input_names=['input'],
+            output_names=['output'],
+            dynamic_axes={'input': {0: 'batch', 2: 'height', 3: 'width'},
+                          'output': {0: 'batch', 2: 'out_height', 3: 'out_width'}},
+            opset_version=ONNX_OPSET,
+            **options
+        )
+    exported = onnx.load(str(tmp))
+    onnx.helper.set_model_props(exported, {'source': json.dumps(source_stamp(model_path))})
+    onnx.save(exported, str(tmp))
+    tmp.replace(path)
+    return path
+
+
+def load_exported(model_name, model_path, device):
+    """
+    Load a model's artifact if it exists and was built from the current weights
+
+    Returns:
+        TorchScript network on device, or None if missing or stale
+    """
+    path = export_path(model_name)
+    if not path.exists():
+        return None
+    extra_files = {'source.json': ''}
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')  # TorchScript deprecation notice
+        network = torch.jit.load(str(path), map_location=device, _extra_files=extra_files)
+    try:
+        stamp = json.loads(extra_files['source.json'])
+    except ValueError:
+        stamp = None
+    if stamp != source_stamp(model_path):
+        logger.info(f"{path.name} was built from other weights or another torch version")
+        return None
+    # torch.jit.optimize_for_inference (MKLDNN conv + activation fusion) is left out: the layout
+    # conversions between RRDB's dense-block concatenations made it slower on CPU
+    return network
+
+
+def load_or_export(model_name, model_path, device):
+    """
+    Exported network for a model, exporting (and saving) it on first use
+
+    Returns:
+        TorchScript network on device
+    """
+    network = load_exported(model_name, model_path, device)
+    if network is not None:
+        return network
+
+    logger.info(f"Exporting {model_name} to TorchScript...")
+    export_model(model_name, model_path)
+    return load_exported(model_name, model_path, device)
+
+
+def main(argv=None):
+    """Export every registered model whose weights are downloaded (or the given ones)"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('models', nargs='*', help='model names or aliases (default: all)')
+    parser.add_argument('--format', choices=EXPORT_FORMATS + ('all',), default='torchscript')
+    args = parser.parse_args(argv)
+
+    from .utils import patch_torchvision_compat
+    patch_torchvision_compat()
+
+    exporters = {'torchscript': export_model, 'onnx': export_onnx}
+    formats = EXPORT_FORMATS if args.format == 'all' else (args.format,)
+    for model_name in args.models or Config.MODEL_PATHS:
+        model_name = Config.MODEL_ALIASES.get(model_name, model_name)
+        if model_name not in Config.MODEL_PATHS:
+            print(f"{model_name}: unknown model, skipped")
+            continue
+        model_path = Config.get_model_path(model_name)
+        if not model_path.exists():
+            print(f"{model_name}: no weights at {model_path}, skipped")
+            continue
+        for export_format in formats:
+            path = exporters[export_format](model_name, model_path)
+            print(f"{model_name}: {path} ({path.stat().st_size / (1024 * 1024):.0f} MB)")
+
+
+if __name__ == '__main__':
+    main()
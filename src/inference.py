@@ -0,0 +1,278 @@
+"""
+Inference service shared by the HTTP servers and the Telegram bot
+
+One place owns the model (behind the inference scheduler), input decoding,
+the result cache and output encoding, so every front end gets the same
+pipeline.
+"""
+import logging
+import queue
+import threading
+import time
+from io import BytesIO
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from .cache import ResultCache, result_key
+from .encoding import EncodedImage, PNGStreamEncoder, encode_image, encode_stats
+from .jobs import JobManager
+from .model_registry import ModelRegistry, resolve_model_name
+from .scheduler import InferenceScheduler
+from .super_resolution import network_scale
+from .utils import pil_to_cv2
+
+logger = logging.getLogger(__name__)
+
+# Upscaled bands a streaming job may get ahead of the response
+STREAM_BUFFER_BANDS = 4
+
+# A streaming job gives up (freeing its worker) when the reader takes no band for this long
+STREAM_STALL_SECONDS = 60
+
+
+def decode_image(source):
+    """
+    Decode an uploaded image straight to the model's channel order
+
+    OpenCV decodes to BGR directly (EXIF orientation is ignored, like PIL);
+    formats it cannot read go through PIL.
+
+    Args:
+        source: Encoded image bytes or a binary file object
+
+    Returns:
+        numpy array (H, W, 3) in BGR format
+    """
+    data = source.read() if hasattr(source, 'read') else source
+    img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION)
+    if img is not None:
+        return img
+    return pil_to_cv2(Image.open(BytesIO(data)))
+
+
+class InferenceService:
+    """
+    Model, queue, result cache and encoding for every front end
+
+    Upscales run on the InferenceScheduler's workers, each with its own
+    ModelRegistry, so any registered model can be chosen per request (None
+    means Config.MODEL_NAME). Encoded results are kept in the ResultCache
+    keyed by input pixels, model and output encoding.
+    """
+
+    def __init__(self, model_factory=ModelRegistry):
+        """
+        Args:
+            model_factory: Callable creating one model registry per inference worker
+        """
+        logger.info("Loading Real-ESRGAN model...")
+        self.scheduler = InferenceScheduler(model_factory)
+        logger.info(f"Model loaded successfully! ({self.scheduler.num_workers} inference worker(s))")
+        self.result_cache = ResultCache()
+        self.jobs = JobManager(self.scheduler)
+
+    @property
+    def model(self):
+        """Model registry of the first inference worker"""
+        return self.scheduler.model
+
+    def cache_key(self, image_bgr, output_format, profile, model=None, scale=None, fast=False):
+        """Result cache key of an input image (BGR), the model, the output scale and the output encoding"""
+        options = {'model': resolve_model_name(model), 'format': output_format, 'profile': profile}
+        if scale:
+            options.update(scale=scale, fast=bool(fast))
+        return result_key(image_bgr, **options)
+
+    def lookup(self, image_bgr, output_format, profile, model=None, scale=None, fast=False):
+        """
+        Check the result cache
+
+        Returns:
+            Tuple of (cache key, encoded bytes or None)
+        """
+        key = self.cache_key(image_bgr, output_format, profile, model, scale, fast)
+        return key, self.result_cache.get(key)
+
+    def submit(self, client_id, image_bgr, model=None, scale=None, fast=False):
+        """
+        Queue an upscale (see InferenceScheduler.submit)
+
+        Args:
+            client_id: Caller identity for scheduler fairness
+            image_bgr: Input image (numpy array, BGR format)
+            model: Model name (None for Config.MODEL_NAME; see model_registry.select_model)
+            scale: Output scale (None for the model's own scale)
+            fast: Shrink the input rather than the output when scale is below the model's
+
+        Returns:
+            concurrent.futures.Future resolving to the upscaled array (BGR format)
+        """
+        return self.scheduler.submit(
+            client_id, image_bgr, color_order='bgr', model=resolve_model_name(model), outscale=scale, fast=bool(fast)
+        )
+
+    def encode_result(self, key, output_bgr, output_format, profile):
+        """
+        Encode an upscaled image and store it in the result cache
+
+        Args:
+            key: Cache key from lookup()
+            output_bgr: Upscaled image (numpy array, BGR format)
+            output_format, profile: Encoding (see encoding.encode_image)
+
+        Returns:
+            Tuple of (EncodedImage, whether the cache kept it)
+        """
+        encoded = encode_image(output_bgr, output_format, profile)
+        return encoded, self.result_cache.put(key, encoded.data)
+
+    def upscale(self, client_id, image_bgr, output_format, profile, model=None, scale=None, fast=False):
+        """
+        Upscale and encode an image, blocking until done (cached results are reused)
+
+        See submit() for model, scale and fast.
+
+        Returns:
+            Tuple of (EncodedImage, whether it came from the cache)
+
+        Raises:
+            QueueFullError: If the scheduler cannot accept the job
+        """
+        key, data = self.lookup(image_bgr, output_format, profile, model, scale, fast)
+        if data is not None:
+            logger.info("Result cache hit")
+            return EncodedImage(data, output_format, profile, 0.0), True
+
+        output_bgr = self.submit(client_id, image_bgr, model, scale, fast).result()
+        logger.info(f"Upscaling complete. Output size: {output_bgr.shape[1]}×{output_bgr.shape[0]}")
+        return self.encode_result(key, output_bgr, output_format, profile)[0], False
+
+    def stream_png(self, client_id, image_bgr, profile, key, model=None):
+        """
+        Upscale an image and encode it as a PNG band by band
+
+        The bands are produced by a job on an inference worker (queued like
+        any other upscale) and handed to the caller's thread through a queue
+        of STREAM_BUFFER_BANDS bands; the worker waits while it is full, so
+        only a few bands of output pixels are held at a time. The first chunk
+        (signature and header) needs no upscaling. The encoded bytes are kept
+        for the result cache (if enabled) and stored once the image is done.
+        Closing the generator early (client gone) cancels or stops the job.
+        Output is always at the model's own scale.
+
+        Args:
+            client_id: Caller identity for scheduler fairness
+            image_bgr: Input image (numpy array, BGR format)
+            profile: 'fast' or 'small'
+            key: Cache key from lookup()
+            model: Model name (None for Config.MODEL_NAME)
+
+        Returns:
+            Generator of the PNG file's chunks
+
+        Raises:
+            QueueFullError: If the scheduler cannot accept the job
+        """
+        model = resolve_model_name(model)
+        scale = network_scale(model)
+        bands = queue.Queue(maxsize=STREAM_BUFFER_BANDS)
+        stopped = threading.Event()
+
+        def put(item):
+            """Hand an item to the reader; False once it has gone away"""
+            deadline = time.monotonic() + STREAM_STALL_SECONDS
+            while not stopped.is_set():
+                if time.monotonic() >= deadline:
+                    raise RuntimeError(f"Stream reader stalled for {STREAM_STALL_SECONDS}s")
+                try:
+                    bands.put(item, timeout=0.5)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def produce(registry):
+            for _, band in registry.upscale_rows(image_bgr, model):
+                if not put(band):
+                    logger.info("Stream reader went away, stopping")
+                    return
+            put(None)
+
+        future = self.scheduler.submit_call(client_id, produce)
+
+        def chunks():
+            height, width = image_bgr.shape[:2]
+            encoder = PNGStreamEncoder(width * scale, height * scale, profile)
+            encoded_parts = [] if self.result_cache.enabled else None
+
+            def emit(part):
+                if part and encoded_parts is not None:
+                    encoded_parts.append(part)
+                return part
+
+            try:
+                yield emit(encoder.header())
+                logger.info("Starting streamed upscaling...")
+                while True:
+                    try:
+                        band = bands.get(timeout=0.5)
+                    except queue.Empty:
+                        if not future.done():
+                            continue
+                        try:
+                            band = bands.get_nowait()  # Queued just before the job ended
+                        except queue.Empty:
+                            future.result()  # Raises the job's error
+                            raise RuntimeError("Streaming job ended before the image was done")
+                    if band is None:
+                        break
+                    part = emit(encoder.encode_rows(band))
+                    if part:
+                        yield part
+                yield emit(encoder.finish())
+            finally:
+                stopped.set()
+                future.cancel()
+
+            encode_stats.record('png', profile, encoder.bytes_written, encoder.seconds, encoder.width * encoder.height)
+            if encoded_parts is not None:
+                self.result_cache.put(key, b''.join(encoded_parts))
+            logger.info(
+                f"Streamed {encoder.width}×{encoder.height}: {encoder.bytes_written / (1024 * 1024):.2f} MB, "
+                f"{encoder.seconds * 1000:.0f} ms encoding"
+            )
+
+        return chunks()
+
+    def stats(self):
+        """Device, cache, encoding, queue and job state (for health endpoints)"""
+        return {
+            'gpu_available': self.model.device.type == 'cuda',
+            'models': self.model.stats(),
+            'cache': self.result_cache.stats(),
+            'encoding': encode_stats.snapshot(),
+            'queue': self.scheduler.stats(),
+            'jobs': self.jobs.stats(),
+        }
+
+    def shutdown(self, wait=True):
+        """Stop the inference workers (see InferenceScheduler.shutdown), then the job encoder"""
+        self.scheduler.shutdown(wait=wait)
+        self.jobs.shutdown(wait=wait)
+
+
+# The service is created on first use. Keeping module import cheap matters:
+# CPU tile-pool workers are spawned processes that re-import the entry module.
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_service():
+    """Return the process-wide inference service, loading the model on first call"""
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = InferenceService()
+    return _service
@@ -0,0 +1,248 @@
+"""
+Asynchronous upscale jobs for the HTTP API, run on the inference scheduler
+"""
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from .config import Config
+from .encoding import encode_image
+from .model_registry import resolve_model_name
+from .scheduler import QueueFullError
+
+logger = logging.getLogger(__name__)
+
+
+class UpscaleJob:
+    """State of one submitted image, from queue to encoded result"""
+
+    def __init__(self, client_id, megapixels, output_format, profile, callback_url=None, model=None,
+                 scale=None, fast=False):
+        self.id = uuid.uuid4().hex
+        self.client_id = client_id
+        self.model = model
+        self.scale = scale
+        self.fast = fast
+        self.megapixels = megapixels
+        self.output_format = output_format
+        self.profile = profile
+        self.callback_url = callback_url
+        self.status = 'queued'
+        self.error = None
+        self.result = None  # EncodedImage once done
+        self.future = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.run_seconds = None
+
+    @property
+    def finished(self):
+        return self.status in ('done', 'failed')
+
+    @property
+    def running(self):
+        # A finished upscale counts as running until its result is encoded
+        return not self.finished and (self.future.running() or self.future.done())
+
+
+class JobManager:
+    """
+    Track upscale jobs submitted over HTTP
+
+    Jobs run on the shared InferenceScheduler; results are encoded on a
+    separate encoder pool (so encoding never holds up an inference worker)
+    and kept until they expire. At most max_in_flight jobs may be
+    queued or running at once. Finished jobs are dropped after result_ttl
+    seconds, and the oldest finished results go first when their total size
+    exceeds max_result_bytes.
+    """
+
+    # Weight of the newest job in the seconds-per-megapixel estimate
+    ETA_SMOOTHING = 0.3
+
+    def __init__(self, scheduler, max_in_flight=None, result_ttl=None, max_result_bytes=None, webhooks=None,
+                 encode_workers=None):
+        """
+        Args:
+            scheduler: InferenceScheduler the jobs run on
+            max_in_flight: Maximum queued + running jobs (default Config.JOBS_MAX_IN_FLIGHT)
+            result_ttl: Seconds a finished job is kept (default Config.JOB_RESULT_TTL)
+            max_result_bytes: Total size of kept results (default Config.JOB_RESULTS_MAX_MB)
+            webhooks: Whether callback URLs are honoured (default Config.JOB_WEBHOOKS)
+            encode_workers: Threads encoding results (default Config.JOB_ENCODE_WORKERS)
+        """
+        self.scheduler = scheduler
+        self.max_in_flight = max_in_flight or Config.JOBS_MAX_IN_FLIGHT
+        self.result_ttl = Config.JOB_RESULT_TTL if result_ttl is None else result_ttl
+        self.max_result_bytes = Config.JOB_RESULTS_MAX_MB * 1024 * 1024 if max_result_bytes is None else max_result_bytes
+        self.webhooks = Config.JOB_WEBHOOKS if webhooks is None else webhooks
+        self._encoder = ThreadPoolExecutor(
+            max_workers=max(1, encode_workers or Config.JOB_ENCODE_WORKERS), thread_name_prefix='job-encode'
+        )
+
+        self._lock = threading.Lock()
+        self._jobs = OrderedDict()  # job id -> job, oldest first
+        self._result_bytes = 0
+        self._seconds_per_megapixel = None
+
+    def submit(self, client_id, image_bgr, output_format, profile, callback_url=None, model=None,
+               scale=None, fast=False):
+        """
+        Queue an image
+
+        Args:
+            client_id: Caller identity for scheduler fairness
+            image_bgr: Input image (numpy array, BGR format)
+            output_format, profile: Encoding of the result (see encoding.encode_image)
+            callback_url: URL notified with the final status (if webhooks are enabled)
+            model: Model name (None for Config.MODEL_NAME)
+            scale: Output scale (None for the model's own scale)
+            fast: Shrink the input rather than the output when scale is below the model's
+
+        Returns:
+            UpscaleJob
+
+        Raises:
+            QueueFullError: If too many jobs are in flight or the scheduler is full
+        """
+        megapixels = image_bgr.shape[0] * image_bgr.shape[1] / 1e6
+        model = resolve_model_name(model)
+        job = UpscaleJob(
+            client_id, megapixels, output_format, profile, callback_url if self.webhooks else None, model, scale, fast
+        )
+        with self._lock:
+            self._purge()
+            in_flight = sum(1 for existing in self._jobs.values() if not existing.finished)
+            if in_flight >= self.max_in_flight:
+                raise QueueFullError(f"Too many jobs in progress ({self.max_in_flight})")
+            job.future = self.scheduler.submit(
+                client_id, image_bgr, color_order='bgr', model=model, outscale=scale, fast=bool(fast)
+            )
+            self._jobs[job.id] = job
+        job.future.add_done_callback(lambda future: self._finish(job, future))
+        logger.info(f"Job {job.id} submitted by {client_id} ({megapixels:.2f} MP)")
+        return job
+
+    def get(self, job_id):
+        """Job by id, or None if unknown or expired"""
+        with self._lock:
+            self._purge()
+            return self._jobs.get(job_id)
+
+    def status(self, job):
+        """JSON-ready status of a job, with queue position, progress and ETA"""
+        status = 'running' if job.running else job.status
+        info = {
+            'job_id': job.id,
+            'status': status,
+            'model': job.model,
+            'scale': job.scale,
+            'scale_mode': 'fast' if job.fast else 'quality',
+            'created_at': job.created_at,
+            'position': 0,
+            'progress': 0.0,
+            'eta_seconds': None,
+        }
+        estimate = self._estimate(job)
+        if status == 'queued':
+            position = self.scheduler.position(job.future)
+            info['position'] = position
+            if estimate is not None:
+                rounds = -(-position // self.scheduler.num_workers)
+                info['eta_seconds'] = round(estimate * (rounds + 1), 1)
+        elif status == 'running':
+            elapsed = time.monotonic() - job.future.job.started_at
+            if estimate:
+                info['progress'] = round(min(0.99, elapsed / estimate), 2)
+                info['eta_seconds'] = round(max(0.0, estimate - elapsed), 1)
+        elif status == 'done':
+            info['progress'] = 1.0
+            info['finished_at'] = job.finished_at
+            info['run_seconds'] = round(job.run_seconds, 2)
+            info['format'] = job.result.format
+            info['bytes'] = job.result.size
+        else:
+            info['finished_at'] = job.finished_at
+            info['error'] = job.error
+        return info
+
+    def stats(self):
+        """Snapshot of job counts by status"""
+        with self._lock:
+            self._purge()
+            counts = {'queued': 0, 'running': 0, 'done': 0, 'failed': 0}
+            for job in self._jobs.values():
+                counts['running' if job.running else job.status] += 1
+            return dict(counts, max_in_flight=self.max_in_flight, result_bytes=self._result_bytes)
+
+    def _estimate(self, job):
+        """Expected run time of a job in seconds, from past jobs"""
+        if self._seconds_per_megapixel is None:
+            return None
+        return self._seconds_per_megapixel * job.megapixels
+
+    def _finish(self, job, future):
+        """Record the upscale time and queue the result for encoding (on the worker thread that ran the job)"""
+        started_at = future.job.started_at
+        job.run_seconds = time.monotonic() - started_at if started_at is not None else 0.0
+        self._encoder.submit(self._encode, job, future)
+
+    def _encode(self, job, future):
+        """Encode a job's result, then record it and its timing (on an encoder thread)"""
+        try:
+            job.result = encode_image(future.result(), job.output_format, job.profile)
+            status = 'done'
+        except Exception as e:
+            logger.error(f"Job {job.id} failed: {e}", exc_info=True)
+            job.error = str(e)
+            status = 'failed'
+        job.finished_at = time.time()
+        job.status = status  # Last, so a finished job always has its timestamps
+
+        with self._lock:
+            if job.status == 'done':
+                self._result_bytes += job.result.size
+                if job.megapixels and job.run_seconds:
+                    seconds = job.run_seconds / job.megapixels
+                    if self._seconds_per_megapixel is None:
+                        self._seconds_per_megapixel = seconds
+                    else:
+                        self._seconds_per_megapixel += self.ETA_SMOOTHING * (seconds - self._seconds_per_megapixel)
+            self._purge()
+
+        if job.callback_url:
+            threading.Thread(target=self._notify, args=(job,), daemon=True).start()
+
+    def shutdown(self, wait=True):
+        """Stop the encoder pool once queued results are encoded"""
+        self._encoder.shutdown(wait=wait)
+
+    def _notify(self, job):
+        """POST the final status to the job's callback URL"""
+        try:
+            requests.post(job.callback_url, json=self.status(job), timeout=10)
+        except requests.RequestException as e:
+            logger.warning(f"Webhook for job {job.id} failed: {e}")
+
+    def _purge(self):
+        """Drop expired jobs, then the oldest results while over the size limit (lock held)"""
+        now = time.time()
+        for job_id, job in list(self._jobs.items()):
+            if job.finished and now - job.finished_at > self.result_ttl:
+                self._remove(job_id)
+        for job_id, job in list(self._jobs.items()):
+            if self._result_bytes <= self.max_result_bytes:
+                break
+            if job.result is not None:
+                self._remove(job_id)
+
+    def _remove(self, job_id):
+        """Forget a job and its result (lock held)"""
+        job = self._jobs.pop(job_id)
+        if job.result is not None:
+            self._result_bytes -= job.result.size
@@ -0,0 +1,252 @@
+"""
+Registry of super-resolution models, loaded on first use with LRU eviction
+"""
+import logging
+import threading
+from collections import OrderedDict
+
+from .config import Config
+from .super_resolution import SuperResolution, network_scale, relative_cost
+
+logger = logging.getLogger(__name__)
+
+
+def resolve_model_name(name=None):
+    """
+    Canonical model name for a per-request choice
+
+    Args:
+        name: Key of Config.MODEL_PATHS, an alias from Config.MODEL_ALIASES
+            (case-insensitive), or None for Config.MODEL_NAME
+
+    Returns:
+        Key of Config.MODEL_PATHS
+
+    Raises:
+        ValueError: If the model is not registered
+    """
+    if not name:
+        return Config.MODEL_NAME
+    name = name.strip()
+    lowered = name.lower()
+    if lowered in Config.MODEL_ALIASES:
+        return Config.MODEL_ALIASES[lowered]
+    for registered in Config.MODEL_PATHS:
+        if registered.lower() == lowered:
+            return registered
+    available = ', '.join(list(Config.MODEL_ALIASES) + list(Config.MODEL_PATHS))
+    raise ValueError(f"Unknown model '{name}'. Available: {available}")
+
+
+# Per-request output scale: 'quality' resizes the network output, 'fast'
+# shrinks the input first (see SuperResolution.upscale_array)
+SCALE_MODES = ('quality', 'fast')
+MAX_TARGET_SCALE = 4
+
+
+def parse_target_scale(value):
+    """
+    Output scale requested by a client
+
+    Args:
+        value: Factor as a number or string (e.g. '1.5'), or None/'' for the
+            model's own scale
+
+    Returns:
+        float, or None for the model's own scale
+
+    Raises:
+        ValueError: If the factor is not a number between 1 and MAX_TARGET_SCALE
+    """
+    if value is None or (isinstance(value, str) and not value.strip()):
+        return None
+    try:
+        scale = float(str(value).strip().lower().rstrip('x'))
+    except ValueError:
+        raise ValueError(f"Invalid scale '{value}'. Use a factor between 1 and {MAX_TARGET_SCALE}") from None
+    if not 1 <= scale <= MAX_TARGET_SCALE:
+        raise ValueError(f"Invalid scale '{value}'. Use a factor between 1 and {MAX_TARGET_SCALE}")
+    return scale
+
+
+def parse_scale_mode(value):
+    """
+    Whether a request asked for the fast scale mode
+
+    Args:
+        value: One of SCALE_MODES, or None/'' for 'quality'
+
+    Raises:
+        ValueError: If the mode is unknown
+    """
+    mode = (value or 'quality').strip().lower()
+    if mode not in SCALE_MODES:
+        raise ValueError(f"Unknown scale mode '{value}'. Available: {', '.join(SCALE_MODES)}")
+    return mode == 'fast'
+
+
+def select_model(target_scale=None, model_name=None):
+    """
+    Model to run for a request
+
+    An explicitly chosen model is always used. Otherwise the cheapest model
+    of the default's kind (anime or general) whose network scale reaches the
+    target is picked, e.g. RealESRGAN_x2plus for 2× and below when the
+    default is RealESRGAN_x4plus; the default wins ties.
+
+    Args:
+        target_scale: Requested output scale (None for the default model's scale)
+        model_name: Model chosen by the client (see resolve_model_name)
+
+    Returns:
+        Key of Config.MODEL_PATHS
+
+    Raises:
+        ValueError: If the model is not registered
+    """
+    if model_name or not target_scale:
+        return resolve_model_name(model_name)
+    default = Config.MODEL_NAME
+    anime = 'anime' in default.lower()
+    candidates = [
+        name for name in Config.MODEL_PATHS
+        if ('anime' in name.lower()) == anime and network_scale(name) >= target_scale
+    ]
+    if not candidates:
+        return default
+    return min(candidates, key=lambda name: (relative_cost(name), name != default))
+
+
+def model_bytes(model):
+    """Approximate memory held by a loaded model's weights (all CPU pool copies included)"""
+    size = model.backend.weight_bytes
+    if model.cpu_pool is not None:
+        # Each worker process loads its own copy, at the same precision
+        size += model.cpu_pool.num_workers * size
+    return size
+
+
+class ModelRegistry:
+    """
+    The models of one inference worker, loaded on first request
+
+    The default model is loaded up front; others are loaded when a job asks
+    for them. At most max_models stay resident, and their weights stay within
+    max_bytes; the least recently used model is released first (the model
+    being loaded is always kept). A registry belongs to one worker, like a
+    SuperResolution instance, and offers the same upscale methods with an
+    extra model argument.
+    """
+
+    def __init__(self, model_factory=SuperResolution, max_models=None, max_bytes=None):
+        """
+        Args:
+            model_factory: Callable taking a model name and returning a loaded model
+            max_models: Resident model limit (default Config.MAX_LOADED_MODELS)
+            max_bytes: Weight memory limit (default Config.MODELS_MAX_MB; 0 = no limit)
+        """
+        self.model_factory = model_factory
+        self.max_models = max(1, max_models or Config.MAX_LOADED_MODELS)
+        self.max_bytes = Config.MODELS_MAX_MB * 1024 * 1024 if max_bytes is None else max_bytes
+        self.loads = 0
+        self.evictions = 0
+
+        self._lock = threading.Lock()
+        self._models = OrderedDict()  # name -> model, least recently used first
+        self._sizes = {}
+        self.get()
+
+    @property
+    def device(self):
+        """torch.device the models run on (without loading or touching any)"""
+        with self._lock:
+            return next(iter(self._models.values())).device
+
+    def get(self, model_name=None):
+        """
+        Loaded model by name, loading it (and evicting others) if needed
+
+        Raises:
+            ValueError: If the model is not registered
+        """
+        name = resolve_model_name(model_name)
+        with self._lock:
+            model = self._models.get(name)
+            if model is not None:
+                self._models.move_to_end(name)
+                return model
+
+        # Loaded outside the lock so stats() stays responsive
+        logger.info(f"Loading model {name}...")
+        model = self.model_factory(name)
+        size = model_bytes(model)
+        with self._lock:
+            if name in self._models:
+                # Loaded meanwhile by another caller: keep that one
+                loaded = self._models[name]
+            else:
+                self._models[name] = loaded = model
+                self._sizes[name] = size
+                self.loads += 1
+                self._evict()
+        if loaded is not model and hasattr(model, 'close'):
+            model.close()
+        return loaded
+
+    def _evict(self):
+        """Release least recently used models while over a limit (lock held)"""
+        while len(self._models) > 1 and (
+            len(self._models) > self.max_models
+            or (self.max_bytes and sum(self._sizes.values()) > self.max_bytes)
+        ):
+            name, model = self._models.popitem(last=False)
+            size = self._sizes.pop(name)
+            if hasattr(model, 'close'):
+                model.close()
+            self.evictions += 1
+            logger.info(f"Evicted model {name} ({size / (1024 * 1024):.0f} MB)")
+
+    def upscale_array(self, img, color_order='bgr', model=None, outscale=None, fast=False):
+        """SuperResolution.upscale_array() on the chosen model"""
+        return self.get(model).upscale_array(img, color_order, outscale, fast)
+
+    def upscale_many_arrays(self, images, color_order='bgr', model=None, outscale=None, fast=False):
+        """SuperResolution.upscale_many_arrays() on the chosen model"""
+        return self.get(model).upscale_many_arrays(images, color_order, outscale, fast)
+
+    def upscale_rows(self, img_bgr, model=None):
+        """SuperResolution.upscale_rows() on the chosen model"""
+        return self.get(model).upscale_rows(img_bgr)
+
+    def upscale_from_array(self, img_array, model=None):
+        """SuperResolution.upscale_from_array() on the chosen model"""
+        return self.get(model).upscale_from_array(img_array)
+
+    def stats(self):
+        """Snapshot of resident models, load/eviction counts and tile reuse (if enabled)"""
+        with self._lock:
+            stats = {
+                'loaded': list(self._models),
+                'weights_mb': round(sum(self._sizes.values()) / (1024 * 1024), 1),
+                'max_models': self.max_models,
+                'max_mb': self.max_bytes // (1024 * 1024),
+                'loads': self.loads,
+                'evictions': self.evictions,
+            }
+            tiles = {}
+            for name, model in self._models.items():
+                tile_stats = model.tile_stats() if hasattr(model, 'tile_stats') else None
+                if tile_stats is not None:
+                    tiles[name] = tile_stats
+        if tiles:
+            stats['tile_reuse'] = tiles
+        return stats
+
+    def close(self):
+        """Release every model"""
+        with self._lock:
+            for model in self._models.values():
+                if hasattr(model, 'close'):
+                    model.close()
+            self._models.clear()
+            self._sizes.clear()
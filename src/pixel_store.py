@@ -0,0 +1,119 @@
+"""
+Short-lived store of decoded images awaiting color grading
+"""
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+from .config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class PixelStore:
+    """
+    Keep decoded BGR arrays by key with a TTL and a global byte budget
+
+    Entries expire after ttl seconds without access; when the budget is
+    exceeded the least recently used entries are dropped. In mmap mode arrays
+    are written once to .npy files and read back memory-mapped, so idle
+    entries cost page cache instead of process memory.
+    """
+
+    def __init__(self, max_bytes=None, ttl=None, use_mmap=None, spill_dir=None):
+        """
+        Args:
+            max_bytes: Total size limit (default Config.PIXEL_STORE_MAX_MB)
+            ttl: Seconds an unused entry is kept (default Config.PIXEL_STORE_TTL)
+            use_mmap: Store arrays as memory-mapped .npy files (default Config.PIXEL_STORE_MMAP)
+            spill_dir: Directory for .npy files (default Config.TEMP_DIR)
+        """
+        self.max_bytes = Config.PIXEL_STORE_MAX_MB * 1024 * 1024 if max_bytes is None else max_bytes
+        self.ttl = Config.PIXEL_STORE_TTL if ttl is None else ttl
+        self.use_mmap = Config.PIXEL_STORE_MMAP if use_mmap is None else use_mmap
+        self.spill_dir = Path(spill_dir or Config.TEMP_DIR)
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (array, last access time), least recent first
+        self._total_bytes = 0
+
+    def put(self, key, img):
+        """
+        Store an image, replacing any previous entry for key
+
+        Returns:
+            False if the image alone exceeds the budget and was not stored
+        """
+        if img.nbytes > self.max_bytes:
+            logger.info(f"Image for {key} ({img.nbytes / (1024 * 1024):.0f} MB) exceeds pixel store budget")
+            self.discard(key)
+            return False
+
+        if self.use_mmap:
+            # A fresh file per put: readers may still be mapping the previous entry's file
+            path = self.spill_dir / f"pixels_{key}_{uuid.uuid4().hex}.npy"
+            np.save(path, img)
+            img = np.load(path, mmap_mode='r')
+
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (img, time.monotonic())
+            self._total_bytes += img.nbytes
+            self._expire()
+            while self._total_bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+        return True
+
+    def get(self, key):
+        """
+        Fetch a stored image (read-only in mmap mode)
+
+        Returns:
+            numpy array, or None if missing or expired
+        """
+        with self._lock:
+            self._expire()
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries[key] = (entry[0], time.monotonic())
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def discard(self, key):
+        """Remove an entry if present"""
+        with self._lock:
+            self._remove(key)
+
+    def _expire(self):
+        """Drop entries unused for longer than the TTL (lock held)"""
+        now = time.monotonic()
+        expired = [key for key, (_, accessed) in self._entries.items() if now - accessed > self.ttl]
+        for key in expired:
+            self._remove(key)
+
+    def _remove(self, key):
+        """Drop one entry and its backing file (lock held)"""
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        img = entry[0]
+        self._total_bytes -= img.nbytes
+        if isinstance(img, np.memmap):
+            path = Path(img.filename)
+            del img, entry
+            path.unlink(missing_ok=True)
+
+    def stats(self):
+        """Snapshot of store usage"""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._total_bytes,
+                'max_bytes': self.max_bytes,
+            }
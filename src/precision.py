@@ -0,0 +1,192 @@
+"""
+Reduced-precision inference on CPU
+
+bf16 runs the network under bfloat16 autocast (fast on CPUs with AVX512-BF16
+or AMX). int8 statically quantizes the convolutions: observers record
+activation ranges on calibration tiles, then the layers are converted to
+quantized kernels. Both trade a little accuracy for throughput; compare with
+`python benchmark.py precision`.
+"""
+import copy
+import logging
+import warnings
+
+import cv2
+import numpy as np
+import torch
+
+from .config import Config
+from .tiling import network_input
+
+logger = logging.getLogger(__name__)
+
+PRECISIONS = ('fp32', 'bf16', 'int8')
+
+# Quantized kernel backends, preferred first
+QUANTIZED_ENGINES = ('x86', 'fbgemm', 'qnnpack')
+
+# Side of the square tiles fed to the observers
+CALIBRATION_TILE = 64
+
+IMAGE_SUFFIXES = ('.png', '.jpg', '.jpeg', '.webp', '.bmp')
+
+
+def bf16_supported():
+    """Whether this CPU has native bfloat16 support (otherwise autocast would be slower)"""
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except (AttributeError, RuntimeError):
+        return False
+
+
+def quantized_engine():
+    """First available quantized kernel backend, or None"""
+    for engine in QUANTIZED_ENGINES:
+        if engine in torch.backends.quantized.supported_engines:
+            return engine
+    return None
+
+
+def resolve_precision(precision, device):
+    """
+    Precision that will actually run: CPU_PRECISION applies to CPU only and
+    falls back to fp32 when the machine cannot run it
+
+    Raises:
+        ValueError: Unknown precision name
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision '{precision}'. Available: {', '.join(PRECISIONS)}")
+    if device.type != 'cpu' or precision == 'fp32':
+        return 'fp32'
+    if precision == 'bf16' and not bf16_supported():
+        logger.warning("CPU has no native bfloat16 support, running in fp32")
+        return 'fp32'
+    if precision == 'int8' and quantized_engine() is None:
+        logger.warning("No quantized CPU backend available, running in fp32")
+        return 'fp32'
+    return precision
+
+
+def _synthetic_tile(rng, size):
+    """Photo-like BGR tile: smooth gradients plus fine texture"""
+    coarse = rng.integers(0, 256, size=(max(2, size // 16), max(2, size // 16), 3), dtype=np.uint8)
+    tile = cv2.resize(coarse, (size, size), interpolation=cv2.INTER_CUBIC)
+    noise = rng.integers(-12, 13, size=tile.shape)
+    return np.clip(tile.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+
+
+def calibration_tiles(count=None, directory=None, size=CALIBRATION_TILE, seed=0):
+    """
+    uint8 BGR tiles for calibration: random crops of the images in directory
+    (default Config.CALIBRATION_DIR), or synthetic tiles if there are none
+
+    Args:
+        count: Number of tiles (default Config.CALIBRATION_TILES)
+        directory: Folder of sample images (None/empty = synthetic only)
+        size: Tile side in pixels
+    """
+    count = count or Config.CALIBRATION_TILES
+    directory = Config.CALIBRATION_DIR if directory is None else directory
+    rng = np.random.default_rng(seed)
+
+    images = []
+    if directory and directory.is_dir():
+        for path in sorted(directory.iterdir()):
+            if path.suffix.lower() in IMAGE_SUFFIXES:
+                img = cv2.imread(str(path), cv2.IMREAD_COLOR)
+                if img is not None:
+                    images.append(img)
+        if not images:
+            logger.warning(f"No sample images in {directory}, calibrating on synthetic tiles")
+
+    tiles = []
+    for index in range(count):
+        if not images:
+            tiles.append(_synthetic_tile(rng, size))
+            continue
+        img = images[index % len(images)]
+        if min(img.shape[:2]) < size:
+            img = cv2.resize(img, (max(size, img.shape[1]), max(size, img.shape[0])), interpolation=cv2.INTER_CUBIC)
+        y = rng.integers(0, img.shape[0] - size + 1)
+        x = rng.integers(0, img.shape[1] - size + 1)
+        tiles.append(np.ascontiguousarray(img[y:y + size, x:x + size]))
+    return tiles
+
+
+def quantize_int8(model, tiles):
+    """
+    Statically quantize a network's convolutions to int8
+
+    RRDBNet's forward has shape checks FX cannot trace, so each top-level
+    submodule with weights (conv_first, the RRDB trunk, the upsampling convs)
+    is quantized separately; activations are quantized on entry and
+    dequantized on exit of each, which keeps the network's interface float.
+
+    Args:
+        model: Float network in eval mode, on CPU
+        tiles: uint8 BGR calibration tiles (see calibration_tiles)
+
+    Returns:
+        Quantized copy of the network
+    """
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+    engine = quantized_engine()
+    torch.backends.quantized.engine = engine
+    qconfig_mapping = get_default_qconfig_mapping(engine)
+    batches = [torch.from_numpy(network_input(tile)).unsqueeze(0) for tile in tiles]
+
+    quantized = copy.deepcopy(model).eval()
+    for module in quantized.modules():
+        if isinstance(module, torch.nn.LeakyReLU):
+            module.inplace = False  # Not supported by the quantized kernel (warns on every call)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')  # torch.ao.quantization deprecation notices
+        children = [name for name, child in quantized.named_children() if next(child.parameters(), None) is not None]
+        # Trace every submodule on the input it actually receives
+        inputs = {}
+        hooks = [
+            getattr(quantized, name).register_forward_pre_hook(
+                lambda module, args, name=name: inputs.setdefault(name, args)
+            )
+            for name in children
+        ]
+        with torch.no_grad():
+            quantized(batches[0])
+        for hook in hooks:
+            hook.remove()
+
+        for name in children:
+            setattr(quantized, name, prepare_fx(getattr(quantized, name), qconfig_mapping, inputs[name]))
+        with torch.no_grad():
+            for batch in batches:
+                quantized(batch)
+        for name in children:
+            setattr(quantized, name, convert_fx(getattr(quantized, name)))
+    return quantized
+
+
+def apply_precision(model, precision, tiles=None):
+    """
+    Prepare a CPU network for a precision (see resolve_precision)
+
+    Args:
+        model: Float network in eval mode, on CPU
+        precision: 'fp32', 'bf16' or 'int8'
+        tiles: Calibration tiles for int8 (default calibration_tiles())
+
+    Returns:
+        Tuple of (network to run, autocast dtype or None)
+    """
+    if precision == 'bf16':
+        return model, torch.bfloat16
+    if precision == 'int8':
+        return quantize_int8(model, calibration_tiles() if tiles is None else tiles), None
+    return model, None
+
+
+def weight_bytes(model):
+    """Memory held by a network's weights, float or quantized"""
+    return sum(t.numel() * t.element_size() for t in model.state_dict().values() if isinstance(t, torch.Tensor))
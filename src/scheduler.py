@@ -0,0 +1,290 @@
+"""
+Inference scheduler: a bounded, per-user fair job queue in front of the model
+"""
+import itertools
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+
+from .config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """Raised when the scheduler cannot accept another job"""
+
+
+class InferenceJob:
+    """A single queued upscale request"""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, user_id, image, options, func=None):
+        self.id = next(self._ids)
+        self.user_id = user_id
+        self.image = image
+        self.options = options
+        self.func = func
+        self.future = Future()
+        self.submitted_at = time.monotonic()
+        self.started_at = None
+
+
+class InferenceScheduler:
+    """
+    Run upscales on dedicated worker threads, away from the event loop
+
+    Each worker owns its own model instance (RealESRGANer keeps per-call state
+    on the object, so instances are never shared between threads). Jobs are
+    queued per user and workers pick users round-robin, so one user sending a
+    burst of images cannot starve everyone else.
+    """
+
+    def __init__(self, model_factory, num_workers=None, max_queue_size=None, max_jobs_per_user=None,
+                 batch_images=None):
+        """
+        Args:
+            model_factory: Callable returning a model with upscale_array()
+                and upscale_many_arrays()
+            num_workers: Number of worker threads (one model each)
+            max_queue_size: Maximum number of queued (not yet running) jobs
+            max_jobs_per_user: Maximum queued + running jobs per user
+            batch_images: Maximum queued images a worker runs in one batch
+        """
+        self.num_workers = max(1, num_workers or Config.INFERENCE_WORKERS)
+        self.max_queue_size = max_queue_size or Config.MAX_QUEUE_SIZE
+        self.max_jobs_per_user = max_jobs_per_user or Config.MAX_JOBS_PER_USER
+        self.batch_images = max(1, batch_images or Config.BATCH_IMAGES)
+
+        # Load models up front so startup fails fast on bad weights
+        self.models = [model_factory() for _ in range(self.num_workers)]
+
+        self._lock = threading.Condition()
+        self._queues = OrderedDict()  # user_id -> deque of jobs, in round-robin order
+        self._running = {}            # job id -> job
+        self._queued_count = 0
+        self._closed = False
+
+        self._workers = []
+        for index, model in enumerate(self.models):
+            worker = threading.Thread(
+                target=self._worker_loop,
+                args=(model,),
+                name=f"inference-worker-{index}",
+                daemon=True
+            )
+            worker.start()
+            self._workers.append(worker)
+
+    @property
+    def model(self):
+        """Model of the first worker (for reporting device/scale info)"""
+        return self.models[0]
+
+    def submit(self, user_id, image, **options):
+        """
+        Queue an image for upscaling
+
+        Args:
+            user_id: Owner of the job (used for fairness and limits)
+            image: Input image array passed to upscale_array()
+            **options: Extra keyword arguments for upscale_array() (e.g. color_order)
+
+        Returns:
+            concurrent.futures.Future resolving to the upscaled array (same color order)
+
+        Raises:
+            QueueFullError: If the queue or the user's quota is full
+        """
+        return self._enqueue(InferenceJob(user_id, image, options))
+
+    def submit_call(self, user_id, func):
+        """
+        Queue a function to run on a worker's model (e.g. a streamed upscale)
+
+        The job counts against the queue and per-user limits like an image
+        and is never batched with other jobs.
+
+        Args:
+            user_id: Owner of the job (used for fairness and limits)
+            func: Callable taking the worker's model
+
+        Returns:
+            concurrent.futures.Future resolving to func's return value
+
+        Raises:
+            QueueFullError: If the queue or the user's quota is full
+        """
+        return self._enqueue(InferenceJob(user_id, None, {}, func))
+
+    def _enqueue(self, job):
+        """Add a job to its user's queue (see submit)"""
+        user_id = job.user_id
+        with self._lock:
+            if self._closed:
+                raise QueueFullError("Scheduler is shutting down")
+            if self._queued_count >= self.max_queue_size:
+                raise QueueFullError(f"Queue is full ({self.max_queue_size} jobs waiting)")
+            if self.jobs_for(user_id) >= self.max_jobs_per_user:
+                raise QueueFullError(f"You already have {self.max_jobs_per_user} images in progress")
+
+            self._queues.setdefault(user_id, deque()).append(job)
+            self._queued_count += 1
+            job.future.job = job
+            self._lock.notify()
+
+        logger.info(f"Queued job {job.id} for user {user_id} (queue length {self._queued_count})")
+        return job.future
+
+    def position(self, future):
+        """
+        Number of jobs that will start before this one
+
+        Returns:
+            0 if the job is running or finished, otherwise its 1-based queue position
+        """
+        job = getattr(future, 'job', None)
+        with self._lock:
+            if job is None or job.user_id not in self._queues:
+                return 0
+            user_queue = self._queues[job.user_id]
+            if job not in user_queue:
+                return 0
+            depth = user_queue.index(job)
+
+            # Simulate the round-robin order: users before ours in the rotation
+            # get depth + 1 turns ahead of us, users after ours get depth turns
+            ahead = depth
+            before = True
+            for user_id, queue in self._queues.items():
+                if user_id == job.user_id:
+                    before = False
+                    continue
+                ahead += min(len(queue), depth + 1 if before else depth)
+            return ahead + 1
+
+    def jobs_for(self, user_id):
+        """Number of queued + running jobs belonging to a user"""
+        with self._lock:
+            queued = len(self._queues.get(user_id, ()))
+            running = sum(1 for job in self._running.values() if job.user_id == user_id)
+            return queued + running
+
+    def stats(self):
+        """Snapshot of queue state"""
+        with self._lock:
+            return {
+                'workers': self.num_workers,
+                'queued': self._queued_count,
+                'running': len(self._running),
+                'max_queue_size': self.max_queue_size,
+            }
+
+    def _next_job(self):
+        """Pop the next job in round-robin user order (lock must be held)"""
+        user_id, queue = next(iter(self._queues.items()))
+        job = queue.popleft()
+        # Move this user to the back of the rotation, or drop them if done
+        del self._queues[user_id]
+        if queue:
+            self._queues[user_id] = queue
+        self._queued_count -= 1
+        return job
+
+    def _next_batch(self):
+        """
+        Pop up to batch_images jobs with identical options (lock must be held)
+
+        Jobs keep their round-robin order; batching stops at the first job
+        whose options differ. Function jobs (see submit_call) run alone.
+        """
+        jobs = [self._next_job()]
+        while len(jobs) < self.batch_images and self._queues and jobs[0].func is None:
+            next_job = next(iter(self._queues.values()))[0]
+            if next_job.func is not None or next_job.options != jobs[0].options:
+                break
+            jobs.append(self._next_job())
+        return jobs
+
+    def _worker_loop(self, model):
+        """Worker thread body: take jobs and run them on this worker's model"""
+        while True:
+            with self._lock:
+                while not self._queues and not self._closed:
+                    self._lock.wait()
+                if self._closed and not self._queues:
+                    return
+                jobs = self._next_batch()
+                for job in jobs:
+                    self._running[job.id] = job
+
+            # Drop jobs cancelled while waiting in the queue (started_at is set
+            # first: a running future always has its start time)
+            started = []
+            for job in jobs:
+                job.started_at = time.monotonic()
+                if job.future.set_running_or_notify_cancel():
+                    started.append(job)
+                else:
+                    with self._lock:
+                        del self._running[job.id]
+
+            if not started:
+                continue
+
+            try:
+                self._run_batch(model, started)
+            finally:
+                with self._lock:
+                    for job in started:
+                        del self._running[job.id]
+
+            for job in started:
+                logger.info(
+                    f"Job {job.id} for user {job.user_id} finished in "
+                    f"{time.monotonic() - job.started_at:.1f}s "
+                    f"(waited {job.started_at - job.submitted_at:.1f}s, batch of {len(started)})"
+                )
+
+    def _run_batch(self, model, jobs):
+        """
+        Run started jobs on a worker's model and resolve their futures
+
+        A batch mixes images from different users, so when it fails the jobs
+        are retried one at a time and only the ones that fail again get the error.
+        """
+        if len(jobs) > 1:
+            try:
+                results = model.upscale_many_arrays([job.image for job in jobs], **jobs[0].options)
+            except Exception as e:
+                logger.warning(f"Batch of {len(jobs)} jobs failed ({e}), retrying them one at a time")
+            else:
+                for job, result in zip(jobs, results):
+                    job.future.set_result(result)
+                return
+
+        for job in jobs:
+            try:
+                if job.func is not None:
+                    result = job.func(model)
+                else:
+                    result = model.upscale_array(job.image, **job.options)
+            except Exception as e:
+                job.future.set_exception(e)
+            else:
+                job.future.set_result(result)
+
+    def shutdown(self, wait=True):
+        """Stop accepting jobs; workers exit once the queue is drained"""
+        with self._lock:
+            self._closed = True
+            self._lock.notify_all()
+        if wait:
+            for worker in self._workers:
+                worker.join()
+            for model in self.models:
+                if hasattr(model, 'close'):
+                    model.close()
@@ -6,6 +6,12 @@ import numpy as np
 from pathlib import Path
 
 from .config import Config
+from .cpu_pool import CPUTilePool
+from .backends import PyTorchBackend, create_backend, resolve_backend
+from .precision import resolve_precision
+from .tile_cache import TileDeduplicator
+from .tiling import TileEngine
+from .tile_tuner import load_or_tune
 
 try:
     from realesrgan import RealESRGANer
@@ -17,23 +23,148 @@ except ImportError as e:
     print("Install with: pip install realesrgan basicsr")
 
 
+def network_scale(model_name):
+    """Upscaling factor of a model, from its name (no weights are loaded)"""
+    return 2 if 'x2' in model_name.lower() and 'anime' not in model_name.lower() else 4
+
+
+def relative_cost(model_name):
+    """
+    Approximate network compute per input pixel, relative to RealESRGAN_x4plus
+    
+    Cost follows the number of RRDB blocks (6 for anime, 23 otherwise); x2
+    models run their body on a 2×2 pixel-unshuffled input, a quarter of the
+    positions.
+    """
+    cost = (6 if 'anime' in model_name.lower() else 23) / 23
+    if network_scale(model_name) == 2:
+        cost /= 4
+    return cost
+
+
+def target_size(img, outscale):
+    """(width, height) of an image resized by outscale, at least 1×1"""
+    height, width = img.shape[:2]
+    return max(1, round(width * outscale)), max(1, round(height * outscale))
+
+
+def resize_to(img, size):
+    """Resize to (width, height): area averaging when shrinking, Lanczos when enlarging"""
+    if (img.shape[1], img.shape[0]) == size:
+        return img
+    shrinking = size[0] < img.shape[1]
+    return cv2.resize(img, size, interpolation=cv2.INTER_AREA if shrinking else cv2.INTER_LANCZOS4)
+
+
+def build_network(model_name):
+    """
+    Create the RRDBNet architecture matching a model name
+    
+    Args:
+        model_name: Model name (e.g. 'RealESRGAN_x4plus')
+    
+    Returns:
+        Tuple of (untrained RRDBNet, network scale)
+    """
+    netscale = network_scale(model_name)
+    
+    if 'anime' in model_name.lower():
+        # Anime model uses 6 blocks
+        model = RRDBNet(num_in_ch=3, num_out_ch=3, num_feat=64, num_block=6, num_grow_ch=32, scale=netscale)
+    else:
+        # x4plus and x2plus (23 blocks)
+        model = RRDBNet(num_in_ch=3, num_out_ch=3, num_feat=64, num_block=23, num_grow_ch=32, scale=netscale)
+    
+    return model, netscale
+
+
+def load_network(model_name, model_path):
+    """
+    Create a network and load its weights on CPU (same rules as RealESRGANer)
+    
+    Returns:
+        Tuple of (RRDBNet in eval mode, network scale)
+    """
+    import torch
+    
+    model, netscale = build_network(model_name)
+    loadnet = torch.load(str(model_path), map_location=torch.device('cpu'))
+    
+    # Prefer EMA weights when present
+    keyname = 'params_ema' if 'params_ema' in loadnet else 'params'
+    model.load_state_dict(loadnet[keyname], strict=True)
+    model.eval()
+    return model, netscale
+
+
+# Channel orders accepted by the array API
+COLOR_ORDERS = ('bgr', 'rgb')
+
+
+def is_standard_image(img):
+    """Whether an array is a 3-channel 8-bit image (the tiling engine's input)"""
+    return img.dtype == np.uint8 and img.ndim == 3 and img.shape[2] == 3
+
+
+def swap_red_blue(img):
+    """BGR(A) <-> RGB(A) for 3/4-channel images of any depth; grayscale is returned as-is"""
+    if img.ndim == 3 and img.shape[2] in (3, 4):
+        return np.ascontiguousarray(img[:, :, [2, 1, 0, 3][:img.shape[2]]])
+    return img
+
+
 class SuperResolution:
     """Handle image super-resolution using Real-ESRGAN"""
     
-    def __init__(self):
+    def __init__(self, model_name=None):
+        """
+        Args:
+            model_name: Key of Config.MODEL_PATHS (default Config.MODEL_NAME)
+        """
         if not OFFICIAL_REALESRGAN:
             raise ImportError(
                 "Official Real-ESRGAN package not installed. "
                 "Install with: pip install realesrgan basicsr facexlib gfpgan"
             )
         
-        self.upsampler = None
+        self.model_name = model_name or Config.MODEL_NAME
+        self._upsampler = None
+        self._gpu_id = None
+        self.backend = None
+        self.device = None
+        self.engine = None
+        self.cpu_pool = None
+        self.tile_profile = None
+        self.precision = 'fp32'
         self.scale = Config.MODEL_SCALE
         self._load_model()
     
+    @property
+    def upsampler(self):
+        """RealESRGANer for images the tiling engine does not handle (created on first use with an exported network)"""
+        if self._upsampler is None:
+            self._upsampler = self._create_upsampler(self._gpu_id)
+        return self._upsampler
+    
+    def _create_upsampler(self, gpu_id):
+        """RealESRGANer loading the model's .pth weights"""
+        model, netscale = build_network(self.model_name)
+        
+        # Create upsampler with optimal settings for quality
+        return RealESRGANer(
+            scale=netscale,
+            model_path=str(Config.get_model_path(self.model_name)),
+            model=model,
+            tile=Config.TILE_SIZE,           # Tile size for processing
+            tile_pad=Config.TILE_PAD,        # Padding to reduce seams
+            pre_pad=Config.PRE_PAD,          # Pre-padding for border handling
+            half=Config.USE_FP16 and self.device.type == 'cuda',  # FP16 on GPU only (CPU runs fp32, as the tile pool does)
+            gpu_id=gpu_id
+        )
+    
     def _load_model(self):
-        """Load Real-ESRGAN model using official RealESRGANer"""
-        model_path = Config.get_model_path()
+        """Load the network through the configured backend, and the tiling engine around it"""
+        model_path = Config.get_model_path(self.model_name)
         
         # Check if model exists
         if not model_path.exists():
@@ -41,22 +172,7 @@ class SuperResolution:
             print("Downloading model... (this may take a while)")
             self._download_model(model_path)
         
-        # Select appropriate architecture based on model name
-        model_name = Config.MODEL_NAME.lower()
-        
-        if 'anime' in model_name:
-            # Anime model uses 6 blocks
-            model = RRDBNet(num_in_ch=3, num_out_ch=3, num_feat=64, num_block=6, num_grow_ch=32, scale=4)
-            netscale = 4
-        elif 'x2' in model_name:
-            # x2 model
-            model = RRDBNet(num_in_ch=3, num_out_ch=3, num_feat=64, num_block=23, num_grow_ch=32, scale=2)
-            netscale = 2
-        else:
-            # Default x4plus model (23 blocks)
-            model = RRDBNet(num_in_ch=3, num_out_ch=3, num_feat=64, num_block=23, num_grow_ch=32, scale=4)
-            netscale = 4
-        
+        netscale = network_scale(self.model_name)
         self.scale = netscale
         
         # Determine GPU settings
@@ -68,32 +184,95 @@ class SuperResolution:
                 gpu_id = None
         else:
             gpu_id = None
+        self._gpu_id = gpu_id
         
-        # Create upsampler with optimal settings for quality
-        self.upsampler = RealESRGANer(
+        # Same device RealESRGANer picks
+        import torch
+        device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+        self.device = device
+        self.precision = resolve_precision(Config.CPU_PRECISION, device)
+        backend = resolve_backend(Config.MODEL_BACKEND, device, self.precision)
+        
+        if backend == 'pytorch':
+            # RealESRGANer (grayscale, alpha, 16-bit) shares the network, int8 included
+            self._upsampler = self._create_upsampler(gpu_id)
+            if self.precision == 'int8':
+                print(f"Calibrating int8 quantization on {Config.CALIBRATION_TILES} tiles...")
+            self.backend = PyTorchBackend(self._upsampler, self.precision)
+        else:
+            # Exported network: no RRDBNet construction or .pth loading (RealESRGANer is built on first use)
+            self.backend = create_backend(backend, self.model_name, model_path, device)
+        
+        # Batched tiling engine around the backend's network
+        self.engine = TileEngine(
+            model=self.backend.network,
             scale=netscale,
-            model_path=str(model_path),
-            model=model,
-            tile=Config.TILE_SIZE,           # Tile size for processing
-            tile_pad=Config.TILE_PAD,        # Padding to reduce seams
-            pre_pad=Config.PRE_PAD,          # Pre-padding for border handling
-            half=Config.USE_FP16,            # FP16 for speed on GPU
-            gpu_id=gpu_id
+            device=device,
+            tile_size=Config.TILE_SIZE,
+            tile_pad=Config.TILE_PAD,
+            pre_pad=Config.PRE_PAD,
+            max_batch_size=Config.TILE_BATCH_SIZE,
+            blend=Config.TILE_BLEND,
+            autocast=self.backend.autocast,
+            dtype=self.backend.dtype
         )
+        if Config.TILE_DEDUP:
+            self.engine.dedup = TileDeduplicator(
+                scale=netscale,
+                max_bytes=Config.TILE_CACHE_MB * 1024 * 1024,
+                flat_tolerance=Config.TILE_FLAT_TOLERANCE
+            )
+        
+        # Measured tile sizes replace the fixed TILE_SIZE (tuned once per machine)
+        if Config.TILE_AUTOTUNE:
+            self.tile_profile = load_or_tune(self.engine, self.model_name, self.precision, self.backend.name)
+            self.engine.tile_planner = self.tile_profile.plan
+        
+        # On CPU, optionally shard tiles across worker processes
+        if device.type == 'cpu' and Config.CPU_WORKERS > 0:
+            self.cpu_pool = CPUTilePool(
+                model_name=self.model_name,
+                model_path=model_path,
+                scale=netscale,
+                num_workers=Config.CPU_WORKERS,
+                num_threads=Config.CPU_THREADS_PER_WORKER,
+                tile_size=Config.TILE_SIZE,
+                tile_pad=Config.TILE_PAD,
+                pre_pad=Config.PRE_PAD,
+                blend=Config.TILE_BLEND,
+                precision=self.precision,
+                backend=self.backend.name
+            )
         
         device_name = "GPU" if gpu_id is not None else "CPU"
-        print(f"Model loaded: {Config.MODEL_NAME} on {device_name}")
-        print(f"Settings: tile={Config.TILE_SIZE}, tile_pad={Config.TILE_PAD}, pre_pad={Config.PRE_PAD}, half={Config.USE_FP16}")
+        print(f"Model loaded: {self.model_name} on {device_name}")
+        print(f"Settings: tile={Config.TILE_SIZE}, tile_pad={Config.TILE_PAD}, pre_pad={Config.PRE_PAD}, half={Config.USE_FP16 and device.type == 'cuda'}, tile_batch={Config.TILE_BATCH_SIZE}, precision={self.precision}, backend={self.backend.name}")
+        if self.tile_profile is not None:
+            print(f"Tile auto-tuning: up to {self.tile_profile.tile_size}px, chosen per image ({self.tile_profile.key})")
+        if self.cpu_pool is not None:
+            print(f"CPU tile pool: {Config.CPU_WORKERS} workers × {Config.CPU_THREADS_PER_WORKER} threads")
+    
+    def tile_stats(self):
+        """Tile reuse counters (None unless Config.TILE_DEDUP)"""
+        if self.engine is None or self.engine.dedup is None:
+            return None
+        return self.engine.dedup.stats()
+    
+    def close(self):
+        """Release worker processes (if any)"""
+        if self.cpu_pool is not None:
+            self.cpu_pool.shutdown()
+            self.cpu_pool = None
     
     def _download_model(self, model_path):
         """Download model weights from GitHub releases"""
         import urllib.request
         
-        base_url = "https://github.com/xinntao/Real-ESRGAN/releases/download/v0.1.0/"
+        base_url = "https://github.com/xinntao/Real-ESRGAN/releases/download/"
         model_urls = {
-            'RealESRGAN_x4plus.pth': base_url + 'RealESRGAN_x4plus.pth',
-            'RealESRGAN_x4plus_anime_6B.pth': base_url + 'RealESRGAN_x4plus_anime_6B.pth',
-            'RealESRGAN_x2plus.pth': base_url + 'RealESRGAN_x2plus.pth',
+            'RealESRGAN_x4plus.pth': base_url + 'v0.1.0/RealESRGAN_x4plus.pth',
+            'RealESRGAN_x4plus_anime_6B.pth': base_url + 'v0.2.2.4/RealESRGAN_x4plus_anime_6B.pth',
+            'RealESRGAN_x2plus.pth': base_url + 'v0.2.1/RealESRGAN_x2plus.pth',
         }
         
         model_file = model_path.name
@@ -135,6 +314,47 @@ class SuperResolution:
         except Exception as e:
             raise RuntimeError(f"Failed to download model: {e}")
     
+    def _enhance(self, img, color_order='bgr'):
+        """
+        Run the network on an image in the given channel order
+        
+        Uses the CPU tile pool when enabled, otherwise the batched tiling
+        engine; both read and write either channel order directly. Images the
+        engine does not handle (grayscale, alpha, 16-bit) go through
+        RealESRGANer, which needs BGR.
+        """
+        if not is_standard_image(img):
+            if color_order == 'rgb':
+                output, _ = self.upsampler.enhance(swap_red_blue(img), outscale=self.scale)
+                return swap_red_blue(output)
+            output, _ = self.upsampler.enhance(img, outscale=self.scale)
+            return output
+        if self.cpu_pool is not None:
+            return self.cpu_pool.upscale(img, color_order)
+        return self.engine.upscale(img, color_order)
+    
+    def upscale_rows(self, img_bgr):
+        """
+        Upscale a BGR image, producing the output in horizontal bands
+        
+        With the tiling engine each band is released as soon as its row of
+        tiles is done; other paths upscale the whole image and then slice it.
+        
+        Args:
+            img_bgr: numpy array in BGR format
+        
+        Yields:
+            (first output row, band as numpy array in BGR format), top to bottom
+        """
+        if self.cpu_pool is None and is_standard_image(img_bgr):
+            yield from self.engine.upscale_rows(img_bgr)
+            return
+        
+        output = self._enhance(img_bgr)
+        band_rows = max(Config.TILE_SIZE, 64) * self.scale
+        for y in range(0, output.shape[0], band_rows):
+            yield y, output[y:y + band_rows]
+    
     def upscale(self, image_path, output_path=None):
         """
         Upscale an image using Real-ESRGAN
@@ -151,19 +371,8 @@ class SuperResolution:
         if img is None:
             raise ValueError(f"Failed to read image: {image_path}")
         
-        # Run super-resolution (automatic tiling with Gaussian blending)
-        try:
-            output, _ = self.upsampler.enhance(img, outscale=self.scale)
-        except RuntimeError as e:
-            if 'out of memory' in str(e).lower():
-                # Retry with smaller tile size
-                print("GPU out of memory, retrying with smaller tiles...")
-                original_tile = self.upsampler.tile
-                self.upsampler.tile = max(256, original_tile // 2)
-                output, _ = self.upsampler.enhance(img, outscale=self.scale)
-                self.upsampler.tile = original_tile  # Restore original
-            else:
-                raise e
+        # Run super-resolution
+        output = self._enhance(img)
         
         # Save if output path provided
         if output_path:
@@ -171,6 +380,63 @@ class SuperResolution:
         
         return output
     
+    def upscale_array(self, img, color_order='bgr', outscale=None, fast=False):
+        """
+        Upscale a decoded image without copying it into another channel order
+        
+        The channel order is handled where the network input and output are
+        built anyway, so no extra full-size copies are made.
+        
+        With an outscale other than the network scale, the network output is
+        resized to it (the default, best quality). With fast=True and an
+        outscale below the network scale, the input is shrunk first so the
+        network directly produces (about) the target size: compute drops by
+        (outscale / scale)², at the cost of the detail lost in the shrink.
+        
+        Args:
+            img: numpy array (H, W, C)
+            color_order: Channel order of img and of the result, 'bgr' or 'rgb'
+            outscale: Output size relative to the input (default: network scale)
+            fast: Shrink the input instead of the output for outscale < scale
+        
+        Returns:
+            Upscaled image as numpy array (same color order)
+        """
+        if color_order not in COLOR_ORDERS:
+            raise ValueError(f"Unknown color order '{color_order}'. Available: {', '.join(COLOR_ORDERS)}")
+        if not outscale or outscale == self.scale:
+            return self._enhance(img, color_order)
+        size = target_size(img, outscale)
+        return resize_to(self._enhance(self._pre_shrink(img, outscale, fast), color_order), size)
+    
+    def upscale_many_arrays(self, images, color_order='bgr', outscale=None, fast=False):
+        """
+        Upscale several images at once, batching their tiles together
+        
+        Args:
+            images: List of numpy arrays
+            color_order: Channel order of the inputs and results, 'bgr' or 'rgb'
+            outscale, fast: See upscale_array()
+        
+        Returns:
+            List of upscaled images as numpy arrays (same color order)
+        """
+        if self.cpu_pool is not None or not all(is_standard_image(img) for img in images):
+            return [self.upscale_array(img, color_order, outscale, fast) for img in images]
+        if color_order not in COLOR_ORDERS:
+            raise ValueError(f"Unknown color order '{color_order}'. Available: {', '.join(COLOR_ORDERS)}")
+        if not outscale or outscale == self.scale:
+            return self.engine.upscale_many(images, color_order)
+        sizes = [target_size(img, outscale) for img in images]
+        outputs = self.engine.upscale_many([self._pre_shrink(img, outscale, fast) for img in images], color_order)
+        return [resize_to(output, size) for output, size in zip(outputs, sizes)]
+    
+    def _pre_shrink(self, img, outscale, fast):
+        """Input for the fast mode: shrunk by outscale / scale (unchanged otherwise)"""
+        if not fast or outscale >= self.scale:
+            return img
+        return resize_to(img, target_size(img, outscale / self.scale))
+    
     def upscale_from_array(self, img_array):
         """
         Upscale from numpy array (RGB format)
@@ -181,23 +447,11 @@ class SuperResolution:
         Returns:
             Upscaled image as numpy array (RGB format)
         """
-        # Convert RGB to BGR for processing
-        img_bgr = cv2.cvtColor(img_array, cv2.COLOR_RGB2BGR)
-        
-        # Run super-resolution (automatic tiling with Gaussian blending)
-        try:
-            output_bgr, _ = self.upsampler.enhance(img_bgr, outscale=self.scale)
-        except RuntimeError as e:
-            if 'out of memory' in str(e).lower():
-                print("GPU out of memory, retrying with smaller tiles...")
-                original_tile = self.upsampler.tile
-                self.upsampler.tile = max(256, original_tile // 2)
-                output_bgr, _ = self.upsampler.enhance(img_bgr, outscale=self.scale)
-                self.upsampler.tile = original_tile  # Restore original
-            else:
-                raise e
-        
-        # Convert back to RGB
-        output_rgb = cv2.cvtColor(output_bgr, cv2.COLOR_BGR2RGB)
-        return output_rgb
+        return self.upscale_array(img_array, color_order='rgb')
+    
+    def upscale_many_from_array(self, img_arrays):
+        """
+        Upscale several images at once (RGB format, see upscale_many_arrays)
+        """
+        return self.upscale_many_arrays(img_arrays, color_order='rgb')
 
@@ -0,0 +1,164 @@
+"""
+Tile-level result reuse for the tiling engine
+
+Screenshots, scans and memes often repeat the same tile or contain large
+uniform areas. Before tiles reach the network they are hashed: identical
+tiles of one run are computed once, recently computed tiles are taken from
+an in-memory LRU cache (across requests), and near-constant tiles are
+upscaled by plain interpolation.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+
+def tile_key(pixels, source_box, color_order):
+    """Identity of a tile's output: input pixels (tile_pad context included), output crop and channel order"""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(repr((pixels.shape, source_box, color_order)).encode())
+    digest.update(np.ascontiguousarray(pixels))
+    return digest.digest()
+
+
+def is_flat(pixels, tolerance):
+    """Whether every channel of a uint8 tile stays within tolerance levels"""
+    flat = pixels.reshape(-1, pixels.shape[-1])
+    return bool(((flat.max(axis=0).astype(np.int16) - flat.min(axis=0)) <= tolerance).all())
+
+
+def interpolate_tile(pixels, source_box, scale):
+    """Cheap stand-in for the network on a flat tile: the cropped input, resized bilinearly"""
+    x0, y0, x1, y1 = source_box
+    crop = np.ascontiguousarray(pixels[y0:y1, x0:x1])
+    return cv2.resize(crop, ((x1 - x0) * scale, (y1 - y0) * scale), interpolation=cv2.INTER_LINEAR)
+
+
+class TileDeduplicator:
+    """
+    Hash tiles before inference and reuse outputs where possible
+
+    Tiles are checked in order: flat (within flat_tolerance levels per channel,
+    if enabled) -> interpolated; in the cache -> reused; identical to another
+    tile of the same run -> computed once. Counters track how many tiles
+    skipped the network and the estimated network time saved.
+    """
+
+    def __init__(self, scale, max_bytes, flat_tolerance=-1):
+        """
+        Args:
+            scale: Network scale
+            max_bytes: Size limit of the cross-request tile cache (0 = only reuse within a run)
+            flat_tolerance: Max per-channel range of a flat tile (-1 = no flat fast path)
+        """
+        self.scale = scale
+        self.max_bytes = max_bytes
+        self.flat_tolerance = flat_tolerance
+
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()  # key -> uint8 output tile, least recently used first
+        self._bytes = 0
+        self._counts = {'tiles': 0, 'network': 0, 'duplicates': 0, 'cache_hits': 0, 'flat': 0}
+        self._saved_pixels = 0
+        self._forward_pixels = 0
+        self._forward_seconds = 0.0
+
+    def filter(self, work, color_order):
+        """
+        Paste every tile that can skip the network
+
+        Args:
+            work: List of (padded uint8 input, tile, OutputCanvas)
+            color_order: Channel order of the input and output
+
+        Returns:
+            Tuple of (work items to run, {id(item): (key, duplicate items)} for finish())
+        """
+        pending = OrderedDict()  # key -> items with that key
+        flat = hits = 0
+        saved = 0
+        for item in work:
+            padded, tile, canvas = item
+            pixels = padded[tile.pad_y0:tile.pad_y1, tile.pad_x0:tile.pad_x1]
+            source_box = canvas.source_box(tile)
+            if self.flat_tolerance >= 0 and is_flat(pixels, self.flat_tolerance):
+                canvas.paste(tile, interpolate_tile(pixels, source_box, self.scale))
+                flat += 1
+                saved += pixels.shape[0] * pixels.shape[1]
+                continue
+            key = tile_key(pixels, source_box, color_order)
+            cached = self._get(key)
+            if cached is not None:
+                canvas.paste(tile, cached)
+                hits += 1
+                saved += pixels.shape[0] * pixels.shape[1]
+                continue
+            pending.setdefault(key, []).append(item)
+
+        run = []
+        followers = {}
+        duplicates = 0
+        for key, items in pending.items():
+            run.append(items[0])
+            followers[id(items[0])] = (key, items[1:])
+            duplicates += len(items) - 1
+            tile = items[0][1]
+            saved += (len(items) - 1) * (tile.pad_y1 - tile.pad_y0) * (tile.pad_x1 - tile.pad_x0)
+
+        with self._lock:
+            self._counts['tiles'] += len(work)
+            self._counts['network'] += len(run)
+            self._counts['duplicates'] += duplicates
+            self._counts['cache_hits'] += hits
+            self._counts['flat'] += flat
+            self._saved_pixels += saved
+        return run, followers
+
+    def finish(self, item, tile_pixels, followers):
+        """Paste a computed tile into its duplicates and keep it for later runs"""
+        key, duplicates = followers[id(item)]
+        for _, tile, canvas in duplicates:
+            canvas.paste(tile, tile_pixels)
+        self._put(key, tile_pixels)
+
+    def record_forward(self, seconds, pixels):
+        """Network time spent on padded input pixels (for the savings estimate)"""
+        with self._lock:
+            self._forward_seconds += seconds
+            self._forward_pixels += pixels
+
+    def _get(self, key):
+        with self._lock:
+            tile_pixels = self._cache.get(key)
+            if tile_pixels is not None:
+                self._cache.move_to_end(key)
+            return tile_pixels
+
+    def _put(self, key, tile_pixels):
+        if tile_pixels.nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._cache:
+                return
+            self._cache[key] = tile_pixels
+            self._bytes += tile_pixels.nbytes
+            while self._bytes > self.max_bytes:
+                _, evicted = self._cache.popitem(last=False)
+                self._bytes -= evicted.nbytes
+
+    def stats(self):
+        """Snapshot of tile counts, hit rate and estimated network time saved"""
+        with self._lock:
+            counts = dict(self._counts)
+            reused = counts['duplicates'] + counts['cache_hits'] + counts['flat']
+            seconds_per_pixel = self._forward_seconds / self._forward_pixels if self._forward_pixels else None
+            return dict(
+                counts,
+                hit_rate=round(reused / counts['tiles'], 3) if counts['tiles'] else 0.0,
+                saved_megapixels=round(self._saved_pixels / 1e6, 2),
+                saved_seconds=None if seconds_per_pixel is None else round(self._saved_pixels * seconds_per_pixel, 1),
+                cache_entries=len(self._cache),
+                cache_mb=round(self._bytes / (1024 * 1024), 1),
+            )
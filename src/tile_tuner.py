@@ -0,0 +1,294 @@
+"""
+Tile size auto-tuning for the tiling engine
+
+Measures forward-pass speed and peak memory of candidate tile sizes on the
+current machine, keeps the result in a JSON profile beside the weights, and
+plans a tile size per image from it.
+"""
+import json
+import logging
+import math
+import os
+import platform
+import threading
+import time
+
+import torch
+
+from .config import Config
+from .tiling import is_out_of_memory
+
+logger = logging.getLogger(__name__)
+
+PROFILE_FILE = 'tile_profile.json'
+
+
+def padded_length(length, tile_size, tile_pad):
+    """Input pixels fed to the network along one axis, context included (see tiling.tile_grid)"""
+    if tile_size <= 0 or tile_size >= length:
+        return length
+    tiles = math.ceil(length / tile_size)
+    # Every tile gets tile_pad on both sides, except at the image borders
+    return length + tile_pad * 2 * (tiles - 1)
+
+
+def balanced_tile_size(height, width, tile_size, multiple=8):
+    """
+    Smallest tile size giving the same tile grid as tile_size
+
+    Tiles come out (nearly) equal instead of full tiles plus a thin remainder,
+    so they share one shape and batch together. The size is rounded up to a
+    multiple of `multiple` so tiles stay aligned for pixel-unshuffle networks
+    (never past tile_size when it is itself a multiple).
+    """
+    if tile_size <= 0 or tile_size >= max(height, width):
+        return max(height, width)
+    size = max(math.ceil(length / math.ceil(length / tile_size)) for length in (height, width))
+    return min(tile_size, -(-size // multiple) * multiple)
+
+
+def machine_key(model_name, device, tile_pad, batch_size, precision='fp32', backend='pytorch'):
+    """Profile key: everything that changes the measurements"""
+    if device.type == 'cuda':
+        hardware = torch.cuda.get_device_name(device)
+    else:
+        hardware = f"{platform.machine()}-{os.cpu_count()}cpu-{torch.get_num_threads()}t"
+    key = f"{model_name}|{hardware}|fp16={Config.USE_FP16 and device.type == 'cuda'}|pad={tile_pad}|batch={batch_size}"
+    # Reduced CPU precisions and other backends are profiled separately (eager fp32 keys predate them)
+    if precision != 'fp32':
+        key += f"|{precision}"
+    if backend != 'pytorch':
+        key += f"|{backend}"
+    return key
+
+
+def available_memory(device):
+    """Bytes the tiles may use: free GPU memory, or available RAM (None if unknown)"""
+    if device.type == 'cuda':
+        return torch.cuda.mem_get_info(device)[0]
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def _resident_bytes():
+    """Anonymous (not file-backed) resident memory of this process (Linux), or None"""
+    try:
+        with open('/proc/self/statm') as f:
+            fields = f.read().split()
+        return (int(fields[1]) - int(fields[2])) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class PeakMemory:
+    """
+    Peak memory added while the block runs, in bytes (None if unmeasurable)
+
+    On CUDA this is torch's allocator peak; on CPU the anonymous resident
+    memory is sampled from a background thread (memory-mapped files, which
+    the OS can write back, are not counted).
+    """
+
+    INTERVAL = 0.002
+
+    def __init__(self, device):
+        self.device = device
+        self.peak = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        if self.device.type == 'cuda':
+            torch.cuda.synchronize(self.device)
+            torch.cuda.reset_peak_memory_stats(self.device)
+            self._baseline = torch.cuda.memory_allocated(self.device)
+        else:
+            self._baseline = _resident_bytes()
+            if self._baseline is not None:
+                self._max = self._baseline
+                self._thread = threading.Thread(target=self._sample, daemon=True)
+                self._thread.start()
+        return self
+
+    def _sample(self):
+        while not self._stop.wait(self.INTERVAL):
+            self._max = max(self._max, _resident_bytes() or 0)
+
+    def __exit__(self, *exc):
+        if self.device.type == 'cuda':
+            torch.cuda.synchronize(self.device)
+            self.peak = torch.cuda.max_memory_allocated(self.device) - self._baseline
+        elif self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._max = max(self._max, _resident_bytes() or 0)
+            self.peak = self._max - self._baseline
+        return False
+
+
+class TileProfile:
+    """
+    Measured cost of tile sizes for one model on one machine
+
+    measurements maps tile size -> {'seconds_per_mp': forward time per padded
+    input megapixel, 'peak_mb': peak memory of one tile}; every measured size
+    fits the memory budget. tile_size is the largest of them; plan() picks
+    the cheapest size for a given image.
+    """
+
+    def __init__(self, key, tile_pad, measurements, tile_size):
+        self.key = key
+        self.tile_pad = tile_pad
+        self.measurements = {int(size): stats for size, stats in measurements.items()}
+        self.tile_size = tile_size
+
+    def plan(self, height, width):
+        """
+        Tile size for an image (pre-padded input dimensions)
+
+        Estimates the forward time of every measured size from the padded
+        pixels its tile grid feeds the network, and returns the cheapest one,
+        balanced so the tiles share a shape.
+        """
+        best_cost, best_size = None, self.tile_size
+        for size, stats in self.measurements.items():
+            pixels = padded_length(height, size, self.tile_pad) * padded_length(width, size, self.tile_pad)
+            cost = pixels * stats['seconds_per_mp']
+            if best_cost is None or cost < best_cost:
+                best_cost, best_size = cost, size
+        return balanced_tile_size(height, width, best_size)
+
+    def to_dict(self):
+        return {
+            'tile_pad': self.tile_pad,
+            'tile_size': self.tile_size,
+            'measurements': {str(size): stats for size, stats in sorted(self.measurements.items())},
+            'measured_at': time.time(),
+        }
+
+    @classmethod
+    def from_dict(cls, key, data):
+        return cls(key, data['tile_pad'], data['measurements'], data['tile_size'])
+
+
+def measure_tile_size(engine, tile_size, repeat=1):
+    """
+    Forward time and peak memory of one tile of tile_size (plus tile_pad context)
+
+    Returns:
+        Dict with 'seconds_per_mp' and 'peak_mb' (None if memory is unmeasurable)
+    """
+    side = tile_size + 2 * engine.tile_pad
+    batch = torch.rand(1, 3, side, side, device=engine.device)
+    engine._forward(batch[:, :, :64, :64])  # Warm-up outside the measurement
+    best = float('inf')
+    peak = None
+    for _ in range(repeat):
+        with PeakMemory(engine.device) as memory:
+            start = time.perf_counter()
+            engine._forward(batch)
+            if engine.device.type == 'cuda':
+                torch.cuda.synchronize(engine.device)
+            best = min(best, time.perf_counter() - start)
+        if memory.peak is not None:
+            peak = max(peak or 0, memory.peak)
+    return {
+        'seconds_per_mp': best / (side * side / 1e6),
+        'peak_mb': None if peak is None else round(peak / (1024 * 1024), 1),
+    }
+
+
+def tune(engine, key, candidates=None, memory_fraction=None, repeat=1):
+    """
+    Measure candidate tile sizes and build a profile
+
+    Candidates are tried from small to large and the search stops at the
+    first one whose batch would not fit the memory budget (memory_fraction of
+    what is available) or that runs out of memory.
+
+    Args:
+        engine: TileEngine to measure (its network, device and tile_pad)
+        key: Profile key (see machine_key)
+        candidates: Tile sizes to try (default Config.TILE_CANDIDATES)
+        memory_fraction: Share of free memory the tiles may use (default Config.TILE_MEMORY_FRACTION)
+        repeat: Timed runs per size (the best is kept)
+
+    Returns:
+        TileProfile
+    """
+    candidates = sorted(candidates or Config.TILE_CANDIDATES)
+    memory_fraction = memory_fraction or Config.TILE_MEMORY_FRACTION
+    available = available_memory(engine.device)
+    budget = available * memory_fraction if available else None
+
+    measurements = {}
+    for size in candidates:
+        try:
+            stats = measure_tile_size(engine, size, repeat)
+        except RuntimeError as e:
+            if not is_out_of_memory(e):
+                raise
+            logger.info(f"Tile {size}: out of memory")
+            break
+        if budget and stats['peak_mb'] and stats['peak_mb'] * 1024 * 1024 * engine.max_batch_size > budget:
+            logger.info(f"Tile {size}: {stats['peak_mb']:.0f} MB per tile exceeds the memory budget")
+            break
+        measurements[size] = stats
+        logger.info(f"Tile {size}: {stats['seconds_per_mp']:.2f} s/MP, peak {stats['peak_mb']} MB")
+
+    if not measurements:
+        measurements[candidates[0]] = {'seconds_per_mp': 1.0, 'peak_mb': None}
+    return TileProfile(key, engine.tile_pad, measurements, max(measurements))
+
+
+def profile_path():
+    return Config.WEIGHTS_DIR / PROFILE_FILE
+
+
+def load_profiles():
+    """All saved profiles, by key ({} if none)"""
+    try:
+        return json.loads(profile_path().read_text())
+    except (OSError, ValueError):
+        return {}
+
+
+def save_profile(profile):
+    """Store a profile beside the weights (other keys are kept)"""
+    profiles = load_profiles()
+    profiles[profile.key] = profile.to_dict()
+    path = profile_path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix('.tmp')
+    tmp.write_text(json.dumps(profiles, indent=2))
+    tmp.replace(path)
+
+
+def load_or_tune(engine, model_name, precision='fp32', backend='pytorch'):
+    """
+    Saved profile for this model, machine, precision and backend, tuning (and saving) it on first use
+
+    Returns:
+        TileProfile
+    """
+    key = machine_key(model_name, engine.device, engine.tile_pad, engine.max_batch_size, precision, backend)
+    data = load_profiles().get(key)
+    if data is not None:
+        return TileProfile.from_dict(key, data)
+
+    logger.info(f"No tile profile for {key}, measuring tile sizes...")
+    profile = tune(engine, key)
+    try:
+        save_profile(profile)
+    except OSError as e:
+        logger.warning(f"Could not save tile profile: {e}")
+    return profile
@@ -0,0 +1,537 @@
+"""
+Tile splitting and stitching for tiled super-resolution
+
+Mirrors the pre-processing and tiling of RealESRGANer.enhance so the tiled
+paths in this package produce the same output as the official upsampler.
+"""
+import math
+import os
+import tempfile
+import time
+from typing import NamedTuple
+
+import numpy as np
+import torch
+
+from .config import Config
+
+
+class Tile(NamedTuple):
+    """A tile on the (pre-padded) input image"""
+    index: int
+    # Core area written to the output
+    x0: int
+    y0: int
+    x1: int
+    y1: int
+    # Core area plus tile_pad context fed to the network
+    pad_x0: int
+    pad_y0: int
+    pad_x1: int
+    pad_y1: int
+
+    @property
+    def crop_box(self):
+        """Core area relative to the padded tile, in input pixels (x0, y0, x1, y1)"""
+        return (
+            self.x0 - self.pad_x0,
+            self.y0 - self.pad_y0,
+            self.x1 - self.pad_x0,
+            self.y1 - self.pad_y0,
+        )
+
+
+def tile_grid(height, width, tile_size, tile_pad):
+    """
+    Split an image into padded tiles
+
+    Args:
+        height, width: Input image dimensions
+        tile_size: Core tile size (0 = single tile)
+        tile_pad: Context pixels added around each tile
+
+    Returns:
+        List of Tile in row-major order
+    """
+    if tile_size <= 0:
+        return [Tile(0, 0, 0, width, height, 0, 0, width, height)]
+
+    tiles = []
+    tiles_x = math.ceil(width / tile_size)
+    tiles_y = math.ceil(height / tile_size)
+    for y in range(tiles_y):
+        for x in range(tiles_x):
+            x0 = x * tile_size
+            y0 = y * tile_size
+            x1 = min(x0 + tile_size, width)
+            y1 = min(y0 + tile_size, height)
+            tiles.append(Tile(
+                len(tiles), x0, y0, x1, y1,
+                max(x0 - tile_pad, 0), max(y0 - tile_pad, 0),
+                min(x1 + tile_pad, width), min(y1 + tile_pad, height),
+            ))
+    return tiles
+
+
+def mod_scale_for(scale):
+    """Input dimension multiple required by the network (pixel-unshuffle archs)"""
+    if scale == 2:
+        return 2
+    if scale == 1:
+        return 4
+    return None
+
+
+def pad_input(img, pre_pad, scale):
+    """
+    Add RealESRGANer's pre-padding and mod padding to a uint8 image
+
+    Padding is done on the uint8 pixels; conversion to floats happens per
+    tile (see network_input), so the whole image never exists as float32.
+
+    Args:
+        img: numpy array (H, W, 3), uint8
+        pre_pad: Reflect padding added to the bottom/right border
+        scale: Network scale (decides the mod padding)
+
+    Returns:
+        uint8 array (H', W', 3), same channel order
+    """
+    # Padded in two steps like RealESRGANer (reflecting a reflection differs
+    # from a single wider reflection)
+    if pre_pad:
+        img = np.pad(img, ((0, pre_pad), (0, pre_pad), (0, 0)), mode='reflect')
+    mod_scale = mod_scale_for(scale)
+    if mod_scale is not None:
+        pad_h = (mod_scale - img.shape[0] % mod_scale) % mod_scale
+        pad_w = (mod_scale - img.shape[1] % mod_scale) % mod_scale
+        if pad_h or pad_w:
+            img = np.pad(img, ((0, pad_h), (0, pad_w), (0, 0)), mode='reflect')
+    return img
+
+
+def network_input(pixels, color_order='bgr'):
+    """
+    Convert uint8 pixels (a padded image or a tile of it) to the network's layout
+
+    Args:
+        pixels: numpy array (h, w, 3), uint8
+        color_order: Channel order of pixels, 'bgr' or 'rgb'
+
+    Returns:
+        float32 array (3, h, w) in RGB order, values in [0, 1]
+    """
+    img = pixels.astype(np.float32) / 255
+    if color_order == 'bgr':
+        img = img[:, :, ::-1]
+    return np.ascontiguousarray(img.transpose(2, 0, 1))
+
+
+def allocate_output(shape, mmap_threshold=None):
+    """
+    Empty uint8 output image, memory-mapped in Config.TEMP_DIR when large
+
+    The backing file is unlinked right away where the OS allows it, so its
+    disk space is released with the array.
+
+    Args:
+        shape: (height, width, channels)
+        mmap_threshold: Size in bytes above which a memmap is used
+            (default Config.OUTPUT_MMAP_MB; 0 = never)
+
+    Returns:
+        numpy array or numpy.memmap
+    """
+    if mmap_threshold is None:
+        mmap_threshold = Config.OUTPUT_MMAP_MB * 1024 * 1024
+    if not mmap_threshold or math.prod(shape) <= mmap_threshold:
+        return np.empty(shape, dtype=np.uint8)
+
+    Config.TEMP_DIR.mkdir(parents=True, exist_ok=True)
+    fd, path = tempfile.mkstemp(dir=Config.TEMP_DIR, prefix='output_', suffix='.raw')
+    try:
+        output = np.memmap(path, dtype=np.uint8, mode='w+', shape=shape)
+    finally:
+        os.close(fd)
+    try:
+        os.unlink(path)
+    except OSError:
+        pass  # Still mapped (Windows): left for TEMP_DIR cleanup
+    return output
+
+
+def to_output_tile(output_chw, crop_box, scale, color_order='bgr'):
+    """
+    Crop a network output tile to its core area and convert to uint8
+
+    Args:
+        output_chw: float array (3, h, w) in RGB order
+        crop_box: Tile.crop_box in input pixels
+        scale: Network scale
+        color_order: Channel order of the result, 'bgr' or 'rgb'
+
+    Returns:
+        uint8 array (h', w', 3) in color_order
+    """
+    x0, y0, x1, y1 = (v * scale for v in crop_box)
+    if color_order == 'bgr':
+        output_chw = output_chw[::-1]
+    tile = np.clip(output_chw[:, y0:y1, x0:x1], 0, 1).transpose(1, 2, 0)
+    return (tile * 255.0).round().astype(np.uint8)
+
+
+def paste_tile(output, tile, tile_pixels, scale, origin_y=0):
+    """
+    Write a converted tile into the output image, dropping pre/mod padding
+
+    Args:
+        output: uint8 array (H*scale, W*scale, 3) being assembled, or a band of it
+        tile: Tile the data belongs to
+        tile_pixels: Output of to_output_tile()
+        scale: Network scale
+        origin_y: Output row that row 0 of output corresponds to (for bands)
+    """
+    out_h, out_w = output.shape[:2]
+    y0, x0 = tile.y0 * scale - origin_y, tile.x0 * scale
+    if y0 >= out_h or x0 >= out_w:
+        return
+    y1 = min(tile.y1 * scale - origin_y, out_h)
+    x1 = min(tile.x1 * scale, out_w)
+    output[y0:y1, x0:x1] = tile_pixels[:y1 - y0, :x1 - x0]
+
+
+class OutputCanvas:
+    """
+    Output image of one input, assembled tile by tile
+
+    Finished tiles are written straight into the output array (or the band of
+    it currently held, for row-by-row output). With blend > 0, each tile also
+    writes `blend` input pixels past its core on every side that has a
+    neighbour, taken from its tile_pad context, and overlapping tiles are
+    cross-faded in place: every overlap pixel ends up as the weighted mean of
+    the tiles covering it, with weights ramping linearly across the seam, in
+    whatever order the tiles finish (up to rounding). With blend = 0 tiles
+    are pasted exactly as RealESRGANer does.
+    """
+
+    def __init__(self, array, input_shape, tile_size, tile_pad, scale, blend=0, origin_y=0):
+        """
+        Args:
+            array: uint8 output (H*scale, W*scale, 3), or its first band
+            input_shape: (height, width) of the pre-padded input
+            tile_size, tile_pad: Tiling of the input (see tile_grid)
+            scale: Network scale
+            blend: Cross-fade half-width in input pixels (capped at tile_pad and tile_size)
+            origin_y: Output row of array's first row
+        """
+        self.array = array
+        self.height, self.width = input_shape
+        self.scale = scale
+        self.tiles = tile_grid(self.height, self.width, tile_size, tile_pad)
+        limit = min(tile_pad, tile_size) if tile_size > 0 else 0
+        self.blend = max(0, min(blend, limit))
+        self.origin_y = origin_y
+        self.pasted = []
+
+    def extent(self, tile):
+        """Input area a tile writes: its core, widened by blend towards its neighbours"""
+        b = self.blend
+        return (
+            tile.x0 - b if tile.x0 > 0 else tile.x0,
+            tile.y0 - b if tile.y0 > 0 else tile.y0,
+            tile.x1 + b if tile.x1 < self.width else tile.x1,
+            tile.y1 + b if tile.y1 < self.height else tile.y1,
+        )
+
+    def source_box(self, tile):
+        """extent() relative to the padded tile, in input pixels (the crop of the network output)"""
+        x0, y0, x1, y1 = self.extent(tile)
+        return x0 - tile.pad_x0, y0 - tile.pad_y0, x1 - tile.pad_x0, y1 - tile.pad_y0
+
+    def _weights(self, tile, ys, xs):
+        """Blend weights of a tile on output rows ys and columns xs, as an (len(ys), len(xs), 1) array"""
+        b2 = 2 * self.blend
+        centres_x = (xs + 0.5) / self.scale
+        centres_y = (ys + 0.5) / self.scale
+        wx = np.ones(len(xs), dtype=np.float32)
+        wy = np.ones(len(ys), dtype=np.float32)
+        if tile.x0 > 0:
+            wx *= np.clip((centres_x - (tile.x0 - self.blend)) / b2, 0, 1)
+        if tile.x1 < self.width:
+            wx *= np.clip(((tile.x1 + self.blend) - centres_x) / b2, 0, 1)
+        if tile.y0 > 0:
+            wy *= np.clip((centres_y - (tile.y0 - self.blend)) / b2, 0, 1)
+        if tile.y1 < self.height:
+            wy *= np.clip(((tile.y1 + self.blend) - centres_y) / b2, 0, 1)
+        return (wy[:, None] * wx[None, :])[:, :, None]
+
+    def paste(self, tile, pixels):
+        """
+        Write a converted tile (cropped to source_box) into the output
+
+        Rows outside the array held (other bands) and pre/mod padding are dropped.
+        """
+        if not self.blend:
+            paste_tile(self.array, tile, pixels, self.scale, self.origin_y)
+            self.pasted.append(tile)
+            return
+
+        s = self.scale
+        ex0, ey0, ex1, ey1 = self.extent(tile)
+        out_h, out_w = self.array.shape[:2]
+        # Target rectangle in array coordinates, clipped to the array
+        y0, y1 = max(ey0 * s - self.origin_y, 0), min(ey1 * s - self.origin_y, out_h)
+        x0, x1 = ex0 * s, min(ex1 * s, out_w)
+        if y0 >= y1 or x0 >= x1:
+            self.pasted.append(tile)
+            return
+        source = pixels[y0 + self.origin_y - ey0 * s:y1 + self.origin_y - ey0 * s, x0 - ex0 * s:x1 - ex0 * s]
+
+        ys = np.arange(y0, y1) + self.origin_y
+        xs = np.arange(x0, x1)
+        weight = self._weights(tile, ys, xs)
+        # Weight already written here by overlapping tiles
+        covered = np.zeros_like(weight)
+        for other in self.pasted:
+            ox0, oy0, ox1, oy1 = self.extent(other)
+            iy0, iy1 = max(oy0 * s, ys[0]), min(oy1 * s, ys[-1] + 1)
+            ix0, ix1 = max(ox0 * s, x0), min(ox1 * s, x1)
+            if iy0 < iy1 and ix0 < ix1:
+                covered[iy0 - ys[0]:iy1 - ys[0], ix0 - x0:ix1 - x0] += self._weights(
+                    other, np.arange(iy0, iy1), np.arange(ix0, ix1)
+                )
+
+        target = self.array[y0:y1, x0:x1]
+        blended = (target * covered + source * weight) / np.maximum(covered + weight, 1e-6)
+        target[...] = np.where(covered > 0, blended.round(), source).astype(np.uint8)
+        self.pasted.append(tile)
+
+
+def is_out_of_memory(error):
+    """Whether a RuntimeError is an allocation failure (GPU or CPU)"""
+    message = str(error).lower()
+    return 'out of memory' in message or "can't allocate memory" in message
+
+
+class TileEngine:
+    """
+    Batched tiled inference for one loaded network
+
+    Tiles of equal shape (all interior tiles, and matching edge tiles) are
+    stacked into a single forward pass, across one image or several images.
+    The batch size halves on out-of-memory and grows back after a run of
+    successful batches. With a batch size of 1 (and no blending) the output
+    is identical to RealESRGANer; batched convolutions may differ by 1 in a
+    few pixels.
+
+    The input stays uint8 until each tile is converted for the network, and
+    finished tiles go straight into the output array (memory-mapped for large
+    outputs, see allocate_output), so the only full-size buffer is the
+    uint8 result.
+    """
+
+    # Successful batches before trying a larger batch again after a back-off
+    GROW_AFTER = 8
+
+    def __init__(self, model, scale, device, tile_size, tile_pad, pre_pad, max_batch_size=4, tile_planner=None,
+                 blend=0, dedup=None, autocast=None, dtype=None):
+        """
+        Args:
+            model: Network in eval mode, already on device
+            scale: Network scale
+            device: torch.device the model lives on
+            tile_size, tile_pad, pre_pad: Same meaning as for RealESRGANer
+            max_batch_size: Upper bound on tiles per forward pass
+            tile_planner: Optional callable (height, width) -> tile size for a
+                pre-padded input, replacing the fixed tile_size per image
+            blend: Seam cross-fade half-width in input pixels (see OutputCanvas)
+            dedup: Optional tile_cache.TileDeduplicator reusing repeated and flat tiles
+            autocast: Optional dtype to run the network under autocast (e.g. torch.bfloat16 on CPU)
+            dtype: Input dtype of the network (default: that of its parameters, float32 without any)
+        """
+        self.model = model
+        self.scale = scale
+        self.device = device
+        # Quantized and exported networks have no float parameters and take float32 input
+        self.dtype = dtype or next(model.parameters(), torch.empty(0)).dtype
+        self.tile_size = tile_size
+        self.tile_pad = tile_pad
+        self.pre_pad = pre_pad
+        self.max_batch_size = max(1, max_batch_size)
+        self.batch_size = self.max_batch_size
+        self.tile_planner = tile_planner
+        self.blend = blend
+        self.dedup = dedup
+        self.autocast = autocast
+        self._successes = 0
+
+    def upscale(self, img, color_order='bgr'):
+        """
+        Upscale a uint8 image
+
+        Args:
+            img: numpy array (H, W, 3)
+            color_order: Channel order of img and of the result, 'bgr' or 'rgb'
+
+        Returns:
+            Upscaled image as numpy array (same color order)
+        """
+        return self.upscale_many([img], color_order)[0]
+
+    def upscale_many(self, images, color_order='bgr'):
+        """
+        Upscale several uint8 images, batching their tiles together
+
+        Args:
+            images: List of numpy arrays (H, W, 3)
+            color_order: Channel order of the inputs and results, 'bgr' or 'rgb'
+
+        Returns:
+            List of upscaled images (same color order), in input order
+        """
+        outputs = []
+        work = []
+        for img in images:
+            padded = pad_input(img, self.pre_pad, self.scale)
+            height, width = img.shape[:2]
+            canvas = self._canvas(allocate_output((height * self.scale, width * self.scale, 3)), padded)
+            outputs.append(canvas.array)
+            work.extend((padded, tile, canvas) for tile in canvas.tiles)
+
+        self._run_tiles(work, color_order)
+        return outputs
+
+    def upscale_rows(self, img_bgr):
+        """
+        Upscale a BGR uint8 image one row of tiles at a time
+
+        Only one band of output is held at once, and the first band is ready
+        after the first row of tiles instead of the whole image. With
+        blending, the rows the next tile row still fades into are held back
+        and carried over to the next band.
+
+        Yields:
+            (first output row, uint8 band (rows, W*scale, 3) in BGR format), top to bottom
+        """
+        padded = pad_input(img_bgr, self.pre_pad, self.scale)
+        height, width = img_bgr.shape[:2]
+        out_h, out_w = height * self.scale, width * self.scale
+        canvas = self._canvas(None, padded)
+
+        rows = {}  # tile y0 -> tiles in that row
+        for tile in canvas.tiles:
+            rows.setdefault(tile.y0, []).append(tile)
+
+        carry = np.empty((0, out_w, 3), dtype=np.uint8)  # Finished rows still open to blending
+        band_y0 = 0
+        for tiles in rows.values():
+            if band_y0 >= out_h:
+                break  # Only pre/mod padding left
+            _, _, _, extent_y1 = canvas.extent(tiles[0])
+            band_y1 = max(min(extent_y1 * self.scale, out_h), band_y0 + len(carry))
+            band = np.empty((band_y1 - band_y0, out_w, 3), dtype=np.uint8)
+            band[:len(carry)] = carry
+            canvas.array, canvas.origin_y = band, band_y0
+            self._run_tiles([(padded, tile, canvas) for tile in tiles])
+
+            # Rows the next tile row may still blend into are kept back
+            last = tiles[0].y1 >= canvas.height
+            cut = band_y1 if last else min(max((tiles[0].y1 - canvas.blend) * self.scale, band_y0), band_y1)
+            if cut > band_y0:
+                yield band_y0, band[:cut - band_y0]
+            carry = band[cut - band_y0:].copy()
+            band_y0 = cut
+        if len(carry) and band_y0 < out_h:
+            yield band_y0, carry
+
+    def _canvas(self, array, padded):
+        """OutputCanvas for a padded input, with the tile size planned for it"""
+        tile_size = self.tile_size_for(*padded.shape[:2])
+        return OutputCanvas(array, padded.shape[:2], tile_size, self.tile_pad, self.scale, self.blend)
+
+    def tile_size_for(self, height, width):
+        """Tile size for a pre-padded input: the planner's choice, or the fixed tile_size"""
+        if self.tile_planner is None:
+            return self.tile_size
+        return self.tile_planner(height, width)
+
+    def _run_tiles(self, work, color_order='bgr'):
+        """
+        Run tiles through the network in batches of equal shape and paste the results
+
+        Args:
+            work: List of (padded uint8 input, tile, OutputCanvas)
+            color_order: Channel order of the input and output, 'bgr' or 'rgb'
+        """
+        followers = {}
+        if self.dedup is not None:
+            work, followers = self.dedup.filter(work, color_order)
+
+        groups = {}  # padded tile shape -> work items
+        for item in work:
+            tile = item[1]
+            shape = (tile.pad_y1 - tile.pad_y0, tile.pad_x1 - tile.pad_x0)
+            groups.setdefault(shape, []).append(item)
+
+        for items in groups.values():
+            start = 0
+            while start < len(items):
+                chunk = items[start:start + self.batch_size]
+                batch = torch.from_numpy(np.stack([
+                    network_input(padded[tile.pad_y0:tile.pad_y1, tile.pad_x0:tile.pad_x1], color_order)
+                    for padded, tile, _ in chunk
+                ])).to(self.device)
+                started = time.perf_counter()
+                try:
+                    output = self._forward(batch)
+                except RuntimeError as e:
+                    if not is_out_of_memory(e) or len(chunk) == 1:
+                        raise
+                    del batch
+                    self._back_off(len(chunk))
+                    continue
+
+                for item, output_tile in zip(chunk, output):
+                    _, tile, canvas = item
+                    tile_pixels = self._to_pixels(output_tile, canvas.source_box(tile), color_order)
+                    canvas.paste(tile, tile_pixels)
+                    if followers:
+                        self.dedup.finish(item, tile_pixels, followers)
+                if self.dedup is not None:
+                    pixels = batch.shape[0] * batch.shape[2] * batch.shape[3]
+                    self.dedup.record_forward(time.perf_counter() - started, pixels)
+                start += len(chunk)
+                self._grow()
+
+    def _forward(self, batch):
+        """Run the network on a (N, 3, h, w) batch"""
+        with torch.no_grad(), torch.autocast(self.device.type, dtype=self.autocast, enabled=self.autocast is not None):
+            return self.model(batch.to(self.dtype))
+
+    def _to_pixels(self, output_chw, crop_box, color_order='bgr'):
+        """Crop an output tile and convert it to uint8 (BGR or RGB) on the host"""
+        x0, y0, x1, y1 = (v * self.scale for v in crop_box)
+        tile = output_chw[:, y0:y1, x0:x1]
+        if color_order == 'bgr':
+            tile = tile.flip(0)
+        tile = tile.float().clamp_(0, 1)
+        tile = tile.mul_(255.0).round_().to(torch.uint8)
+        return tile.permute(1, 2, 0).cpu().numpy()
+
+    def _back_off(self, failed_size):
+        """Halve the batch size after an out-of-memory error"""
+        self.batch_size = max(1, failed_size // 2)
+        self._successes = 0
+        if self.device.type == 'cuda':
+            torch.cuda.empty_cache()
+        print(f"Out of memory with {failed_size} tiles per batch, retrying with {self.batch_size}...")
+
+    def _grow(self):
+        """Try a larger batch again after enough successful passes"""
+        if self.batch_size >= self.max_batch_size:
+            return
+        self._successes += 1
+        if self._successes >= self.GROW_AFTER:
+            self.batch_size = min(self.max_batch_size, self.batch_size * 2)
+            self._successes = 0
+
@@ -1,13 +1,37 @@
 """
 Utility functions for image processing and file handling
 """
+import sys
 import uuid
+from io import BytesIO
 from pathlib import Path
 from PIL import Image
 import cv2
 import numpy as np
 
 
+def patch_torchvision_compat():
+    """
+    Provide torchvision.transforms.functional_tensor for basicsr
+
+    Newer torchvision releases removed the module basicsr imports at load time.
+    Entry points apply the same patch; worker processes call this directly.
+    """
+    if 'torchvision.transforms.functional_tensor' in sys.modules:
+        return
+    try:
+        import torchvision.transforms.functional as F
+        
+        class FunctionalTensorModule:
+            @staticmethod
+            def rgb_to_grayscale(img, num_output_channels=1):
+                return F.rgb_to_grayscale(img, num_output_channels)
+        
+        sys.modules['torchvision.transforms.functional_tensor'] = FunctionalTensorModule()
+    except Exception:
+        pass  # Ignore if torchvision not installed yet
+
+
 def generate_unique_filename(extension='png'):
     """Generate unique filename using UUID"""
     return f"{uuid.uuid4().hex}.{extension}"
@@ -51,6 +75,17 @@ def cv2_to_pil(cv2_image):
     return pil_image
 
 
+def _encode_params(extension, quality):
+    """OpenCV encoder parameters for a file extension and quality setting"""
+    if extension.lower() in ['.jpg', '.jpeg']:
+        return [cv2.IMWRITE_JPEG_QUALITY, quality]
+    elif extension.lower() == '.png':
+        # PNG compression: 0-9 (0=no compression, 9=max compression)
+        compression = 9 - int(quality / 11)  # Convert quality to compression level
+        return [cv2.IMWRITE_PNG_COMPRESSION, compression]
+    return []
+
+
 def save_cv2_image(cv2_image, output_path, quality=95):
     """
     Save OpenCV image with quality settings
@@ -61,15 +96,25 @@ def save_cv2_image(cv2_image, output_path, quality=95):
         quality: JPEG quality (1-100) or PNG compression (0-9)
     """
     output_path = Path(output_path)
+    cv2.imwrite(str(output_path), cv2_image, _encode_params(output_path.suffix, quality))
+
+
+def encode_cv2_image(cv2_image, extension='.png', quality=95):
+    """
+    Encode OpenCV image in memory with the same settings as save_cv2_image()
     
-    if output_path.suffix.lower() in ['.jpg', '.jpeg']:
-        cv2.imwrite(str(output_path), cv2_image, [cv2.IMWRITE_JPEG_QUALITY, quality])
-    elif output_path.suffix.lower() == '.png':
-        # PNG compression: 0-9 (0=no compression, 9=max compression)
-        compression = 9 - int(quality / 11)  # Convert quality to compression level
-        cv2.imwrite(str(output_path), cv2_image, [cv2.IMWRITE_PNG_COMPRESSION, compression])
-    else:
-        cv2.imwrite(str(output_path), cv2_image)
+    Args:
+        cv2_image: numpy array in BGR format
+        extension: Output format ('.png', '.jpg', ...)
+        quality: JPEG quality (1-100) or PNG compression (0-9)
+    
+    Returns:
+        Encoded bytes
+    """
+    success, buffer = cv2.imencode(extension, cv2_image, _encode_params(extension, quality))
+    if not success:
+        raise ValueError(f"Could not encode image as {extension}")
+    return buffer.tobytes()
 
 
 def check_image_size(image_path, max_pixels=10000*10000):
@@ -142,40 +187,141 @@ def compress_for_telegram(image_path, max_size_mb=9.5, quality=95):
         quality: Initial quality setting
     
     Returns:
-        Path to compressed image (may be same as input if no compression needed)
+        Path to compressed image (may be same as input if no compression needed;
+        a .jpg next to it otherwise, written once)
     """
-    file_size = get_file_size_mb(image_path)
-    
-    if file_size <= max_size_mb:
+    image_path = Path(image_path)
+    if get_file_size_mb(image_path) <= max_size_mb:
         return image_path
     
-    print(f"Image too large ({file_size:.1f} MB), compressing to under {max_size_mb} MB...")
-    
-    # Load image
     img = cv2.imread(str(image_path))
     if img is None:
         return image_path
     
-    output_path = image_path
-    current_quality = quality
-    
-    # Try reducing quality first (faster than resizing)
-    while file_size > max_size_mb and current_quality > 40:
-        current_quality -= 10
-        save_cv2_image(img, output_path, quality=current_quality)
-        file_size = get_file_size_mb(output_path)
-        print(f"Reduced quality to {current_quality}, size: {file_size:.1f} MB")
-    
-    # If still too large, resize progressively
-    if file_size > max_size_mb:
-        scale_factor = 0.9  # Reduce by 10% each iteration
-        while file_size > max_size_mb and img.shape[0] > 500:  # Don't go too small
-            new_width = int(img.shape[1] * scale_factor)
-            new_height = int(img.shape[0] * scale_factor)
-            img = cv2.resize(img, (new_width, new_height), interpolation=cv2.INTER_AREA)
-            save_cv2_image(img, output_path, quality=max(current_quality, 70))
-            file_size = get_file_size_mb(output_path)
-            print(f"Resized to {new_width}×{new_height}, size: {file_size:.1f} MB")
-    
-    print(f"Final size: {file_size:.1f} MB")
+    output, extension = encode_for_telegram(img, max_size_mb=max_size_mb, quality=quality)
+    output_path = image_path.with_suffix(extension)
+    output_path.write_bytes(output.getbuffer())
+    if output_path != image_path:
+        image_path.unlink()
     return output_path
+
+
+# Pixels sampled for size prediction (full-width row strips of the image)
+SIZE_PROBE_PIXELS = 1_000_000
+# Lowest JPEG quality tried before the image is downscaled instead
+MIN_JPEG_QUALITY = 40
+# JPEG quality used for downscaled images
+RESIZE_JPEG_QUALITY = 70
+
+
+def encode_for_telegram(cv2_image=None, encoded=None, max_size_mb=9.5, quality=95):
+    """
+    Encode image in memory to meet Telegram's size requirements (10 MB for photos)
+    
+    A lossless PNG is sent if it fits. Otherwise the JPEG quality is chosen by
+    binary search on a small probe of the image, and if even MIN_JPEG_QUALITY
+    is too large the scale factor is predicted from the probe's bits per
+    pixel. Only the final image is encoded at full size (again only if the
+    prediction missed).
+    
+    Args:
+        cv2_image: numpy array in BGR format (decoded from encoded if omitted)
+        encoded: Existing PNG encoding of the image, sent as-is if small enough
+        max_size_mb: Maximum size in MB (default 9.5 for safety margin)
+        quality: Highest JPEG quality to use
+    
+    Returns:
+        Tuple of (BytesIO positioned at the start, file extension)
+    """
+    max_bytes = int(max_size_mb * 1024 * 1024)
+    
+    if encoded is None:
+        encoded = encode_cv2_image(cv2_image, '.png', quality)
+    if len(encoded) <= max_bytes:
+        return BytesIO(encoded), '.png'
+    
+    if cv2_image is None:
+        cv2_image = cv2.imdecode(np.frombuffer(encoded, dtype=np.uint8), cv2.IMREAD_COLOR)
+    
+    height, width = cv2_image.shape[:2]
+    probe = _size_probe(cv2_image)
+    
+    # Highest quality whose predicted size fits, correcting the target if a prediction misses
+    target = max_bytes
+    for _ in range(3):
+        jpeg_quality = _search_quality(probe, height * width, target, MIN_JPEG_QUALITY, quality)
+        if jpeg_quality is None:
+            break
+        encoded = encode_cv2_image(cv2_image, '.jpg', jpeg_quality)
+        if len(encoded) <= max_bytes:
+            return BytesIO(encoded), '.jpg'
+        target = int(target * max_bytes / len(encoded) * 0.97)
+    
+    # Downscale: iterate the scale on the probe, since bits per pixel rise as detail is packed tighter
+    jpeg_quality = min(quality, RESIZE_JPEG_QUALITY)
+    min_scale = min(1.0, 500 / height)  # Don't go too small
+    scale = 1.0
+    for _ in range(2):
+        small_probe = _resize(probe, scale)
+        bits = len(encode_cv2_image(small_probe, '.jpg', jpeg_quality)) / _pixels(small_probe)
+        scale = max(min_scale, min(1.0, (max_bytes * 0.95 / (bits * height * width)) ** 0.5))
+    
+    while True:
+        img = _resize(cv2_image, scale)
+        encoded = encode_cv2_image(img, '.jpg', jpeg_quality)
+        if len(encoded) <= max_bytes or scale <= min_scale:
+            break
+        scale = max(min_scale, scale * (max_bytes / len(encoded)) ** 0.5 * 0.98)
+    
+    return BytesIO(encoded), '.jpg'
+
+
+def _pixels(img):
+    """Pixel count of an image"""
+    return img.shape[0] * img.shape[1]
+
+
+def _resize(img, scale):
+    """Downscale by a factor (no-op at 1.0)"""
+    if scale >= 1.0:
+        return img
+    size = (max(1, int(img.shape[1] * scale)), max(1, int(img.shape[0] * scale)))
+    return cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+
+
+def _size_probe(img, max_pixels=SIZE_PROBE_PIXELS):
+    """
+    Evenly spaced full-resolution row strips of an image
+    
+    Strips are 16 rows high, aligned to JPEG's macroblocks, so the probe
+    compresses like the full image per pixel.
+    """
+    height, width = img.shape[:2]
+    if height * width <= max_pixels:
+        return img
+    strip = 16
+    count = max(1, min(height // strip, max_pixels // (strip * width)))
+    starts = np.linspace(0, height // strip - 1, count).astype(int) * strip
+    return np.concatenate([img[y:y + strip] for y in starts])
+
+
+def _search_quality(probe, pixels, target, low, high):
+    """
+    Highest JPEG quality in [low, high] whose size, extrapolated from the
+    probe to pixels, stays within target bytes
+    
+    Returns:
+        Quality, or None if even low is too large
+    """
+    def predicted_size(q):
+        return len(encode_cv2_image(probe, '.jpg', q)) * pixels / _pixels(probe)
+    
+    if predicted_size(low) > target:
+        return None
+    while low < high:
+        mid = (low + high + 1) // 2
+        if predicted_size(mid) <= target:
+            low = mid
+        else:
+            high = mid - 1
+    return low
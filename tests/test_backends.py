@@ -0,0 +1,91 @@
+"""
+Exported backends must reproduce eager PyTorch within one level on the same tiles
+"""
+import numpy as np
+import pytest
+import torch
+
+from src.config import Config
+from src.tiling import TileEngine
+
+MODEL_NAME = 'RealESRGAN_x2plus'
+SCALE = 2
+
+
+def stand_in_network(seed=0):
+    """Small x2 network with RRDBNet's kinds of layers (conv, LeakyReLU, pixel unshuffle/shuffle)"""
+    torch.manual_seed(seed)
+    network = torch.nn.Sequential(
+        torch.nn.PixelUnshuffle(2),
+        torch.nn.Conv2d(12, 32, 3, padding=1),
+        torch.nn.LeakyReLU(negative_slope=0.2, inplace=True),
+        torch.nn.Conv2d(32, 3 * 4 * SCALE * SCALE, 3, padding=1),
+        torch.nn.PixelShuffle(2 * SCALE),
+    )
+    return network.eval()
+
+
+@pytest.fixture
+def weights(tmp_path, monkeypatch):
+    """Stand-in weights file in a temporary WEIGHTS_DIR; load_network returns the stand-in"""
+    network = stand_in_network()
+    monkeypatch.setattr(Config, 'WEIGHTS_DIR', tmp_path)
+    model_path = Config.get_model_path(MODEL_NAME)
+    torch.save({'params': network.state_dict()}, model_path)
+    monkeypatch.setattr('src.super_resolution.load_network', lambda name, path: (stand_in_network(), SCALE))
+    return network, model_path
+
+
+def upscale(network, img, dtype=None):
+    engine = TileEngine(
+        network, SCALE, torch.device('cpu'), tile_size=24, tile_pad=6, pre_pad=3, max_batch_size=4, dtype=dtype
+    )
+    return engine.upscale(img)
+
+
+def random_image(rows, cols, seed=0):
+    return np.random.default_rng(seed).integers(0, 256, size=(rows, cols, 3), dtype=np.uint8)
+
+
+def check_against_eager(backend, network):
+    img = random_image(53, 71)  # Odd size: several tiles, edge tiles and mod padding
+    expected = upscale(network, img)
+    result = upscale(backend.network, img, dtype=backend.dtype)
+    assert result.shape == expected.shape
+    assert np.abs(result.astype(np.int16) - expected).max() <= 1
+
+
+def test_onnxruntime_matches_eager(weights):
+    pytest.importorskip('onnx')
+    pytest.importorskip('onnxruntime')
+    from src.backends import OnnxRuntimeBackend
+    from src.export import export_path
+
+    network, model_path = weights
+    backend = OnnxRuntimeBackend(MODEL_NAME, model_path, torch.device('cpu'), num_threads=1)
+    assert export_path(MODEL_NAME, 'onnx').exists()
+    check_against_eager(backend, network)
+
+
+def test_torchscript_matches_eager(weights):
+    from src.backends import TorchScriptBackend
+    from src.export import export_path
+
+    network, model_path = weights
+    backend = TorchScriptBackend(MODEL_NAME, model_path, torch.device('cpu'))
+    assert export_path(MODEL_NAME).exists()
+    check_against_eager(backend, network)
+
+
+def test_stale_export_is_rebuilt(weights):
+    pytest.importorskip('onnx')
+    pytest.importorskip('onnxruntime')
+    from src.backends import OnnxRuntimeBackend
+
+    network, model_path = weights
+    backend = OnnxRuntimeBackend(MODEL_NAME, model_path, torch.device('cpu'), num_threads=1)
+    torch.save({'params': network.state_dict(), 'retrained': True}, model_path)  # New weights file
+    assert backend._load(MODEL_NAME, model_path) is None
+
+    backend = OnnxRuntimeBackend(MODEL_NAME, model_path, torch.device('cpu'), num_threads=1)
+    assert backend._load(MODEL_NAME, model_path) is not None
@@ -0,0 +1,43 @@
+"""
+The fused grading pipeline must match chaining the individual functions bit for bit
+"""
+import numpy as np
+import pytest
+
+from src.color_grading import ColorGrading
+
+SHAPES = [(301, 257), (1, 1), (2, 999)]
+
+# (band_rows, workers): whole image, uneven bands, one-row bands, parallel bands
+STRIPING = [(0, 1), (37, 1), (1, 1), (0, 3), (37, 3), (1, 3)]
+
+
+def random_image(rows, cols, seed=0):
+    return np.random.default_rng(seed).integers(0, 256, size=(rows, cols, 3), dtype=np.uint8)
+
+
+@pytest.mark.parametrize('preset', sorted(ColorGrading.PRESETS))
+@pytest.mark.parametrize('shape', SHAPES, ids=lambda shape: f"{shape[0]}x{shape[1]}")
+@pytest.mark.parametrize('band_rows, workers', STRIPING)
+def test_pipeline_matches_reference(preset, shape, band_rows, workers):
+    img = random_image(*shape)
+    original = img.copy()
+    expected = ColorGrading.apply_preset_reference(img.copy(), preset)
+
+    compiled = ColorGrading.compile_preset(preset)
+    result = ColorGrading.run_pipeline(img, compiled, band_rows=band_rows, workers=workers)
+
+    assert result.dtype == expected.dtype
+    assert np.array_equal(result, expected)
+    assert np.array_equal(img, original)  # Input is never modified
+
+
+@pytest.mark.parametrize('preset', sorted(ColorGrading.PRESETS))
+def test_apply_preset_matches_reference(preset):
+    img = random_image(64, 48, seed=1)
+    assert np.array_equal(ColorGrading.apply_preset(img, preset), ColorGrading.apply_preset_reference(img, preset))
+
+
+def test_unknown_preset():
+    with pytest.raises(ValueError):
+        ColorGrading.compile_preset('nope')
@@ -0,0 +1,90 @@
+"""
+RGB input must give the BGR result with red and blue swapped, on every tiling path
+"""
+import numpy as np
+import pytest
+import torch
+
+from src.super_resolution import SuperResolution, swap_red_blue
+from src.tiling import TileEngine
+
+SCALE = 2
+
+
+def stand_in_network(seed=0):
+    """Small x2 network that mixes channels (so a swapped order shows up in the output)"""
+    torch.manual_seed(seed)
+    network = torch.nn.Sequential(
+        torch.nn.Conv2d(3, 3 * SCALE * SCALE, 3, padding=1),
+        torch.nn.PixelShuffle(SCALE),
+        torch.nn.Sigmoid(),
+    )
+    return network.eval()
+
+
+def make_engine(tile_size, max_batch_size=4):
+    return TileEngine(
+        stand_in_network(), SCALE, torch.device('cpu'),
+        tile_size=tile_size, tile_pad=4, pre_pad=2, max_batch_size=max_batch_size
+    )
+
+
+def make_upscaler(engine):
+    """SuperResolution around a tiling engine, without loading any weights"""
+    upscaler = SuperResolution.__new__(SuperResolution)
+    upscaler.engine = engine
+    upscaler.cpu_pool = None
+    upscaler.scale = SCALE
+    return upscaler
+
+
+def random_image(rows, cols, seed=0):
+    return np.random.default_rng(seed).integers(0, 256, size=(rows, cols, 3), dtype=np.uint8)
+
+
+# tile_size 0 runs the image as a single tile; 16 splits it into batched tiles (odd sizes give edge tiles)
+TILINGS = [pytest.param(0, id='single-tile'), pytest.param(16, id='batched')]
+
+
+@pytest.mark.parametrize('tile_size', TILINGS)
+def test_engine_rgb_matches_bgr(tile_size):
+    engine = make_engine(tile_size)
+    img_bgr = random_image(37, 45)
+    output_bgr = engine.upscale(img_bgr, 'bgr')
+    output_rgb = engine.upscale(swap_red_blue(img_bgr), 'rgb')
+    assert output_bgr.shape == (37 * SCALE, 45 * SCALE, 3)
+    assert np.array_equal(output_rgb, swap_red_blue(output_bgr))
+
+
+@pytest.mark.parametrize('tile_size', TILINGS)
+def test_upscale_array_rgb_matches_bgr(tile_size):
+    upscaler = make_upscaler(make_engine(tile_size))
+    img_bgr = random_image(33, 29, seed=1)
+    output_bgr = upscaler.upscale_array(img_bgr, color_order='bgr')
+    output_rgb = upscaler.upscale_array(swap_red_blue(img_bgr), color_order='rgb')
+    assert np.array_equal(output_rgb, swap_red_blue(output_bgr))
+    assert np.array_equal(upscaler.upscale_from_array(swap_red_blue(img_bgr)), output_rgb)
+
+
+@pytest.mark.parametrize('tile_size', TILINGS)
+def test_upscale_many_arrays_rgb_matches_bgr(tile_size):
+    upscaler = make_upscaler(make_engine(tile_size))
+    images_bgr = [random_image(24, 40, seed=2), random_image(24, 40, seed=3)]
+    outputs_bgr = upscaler.upscale_many_arrays(images_bgr, color_order='bgr')
+    outputs_rgb = upscaler.upscale_many_arrays([swap_red_blue(img) for img in images_bgr], color_order='rgb')
+    for output_bgr, output_rgb in zip(outputs_bgr, outputs_rgb):
+        assert np.array_equal(output_rgb, swap_red_blue(output_bgr))
+
+
+def test_input_is_not_modified():
+    upscaler = make_upscaler(make_engine(16))
+    img_rgb = random_image(20, 20, seed=4)
+    original = img_rgb.copy()
+    upscaler.upscale_array(img_rgb, color_order='rgb')
+    assert np.array_equal(img_rgb, original)
+
+
+def test_unknown_color_order():
+    upscaler = make_upscaler(make_engine(0))
+    with pytest.raises(ValueError):
+        upscaler.upscale_array(random_image(8, 8), color_order='hsv')